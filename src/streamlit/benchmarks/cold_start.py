@@ -0,0 +1,85 @@
+"""
+Cold start of a replica: time from nothing loaded to the first answered query, loading the index
+from its per-component files (JSONL doc table, segmented lexical index, embedding store, filters)
+versus mapping the single-file snapshot. Each variant runs in a fresh process; the page cache is
+warm for both, so this measures parsing and building, not disk reads.
+
+Usage (from src/streamlit):
+python -m benchmarks.cold_start --num-pages 20000
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from benchmarks.ingestion_throughput import write_export
+from core.ingestion import IndexWriter, ingest, read_html_export
+
+LOAD_FROM_FILES = """
+import time
+start_time = time.time()
+from pathlib import Path
+from core.doc_table import DocTable
+from core.embedding_store import EmbeddingStore
+from core.filters import FilterIndex
+from core.segments import SegmentedIndex
+index_dir = Path({index_dir!r})
+doc_table = DocTable.load(index_dir)
+lexical = SegmentedIndex(index_dir / "lexical").pin()
+dense = EmbeddingStore.open(index_dir / "dense")
+filters = FilterIndex.load(index_dir / "filters")
+load_time = time.time() - start_time
+doc_ids, _ = lexical.top_k("word1 word7", 10)
+documents = doc_table.get(doc_ids)
+print(load_time, time.time() - start_time, len(documents))
+"""
+
+LOAD_FROM_SNAPSHOT = """
+import time
+start_time = time.time()
+from core.snapshot import Snapshot, snapshot_doc_table, snapshot_embeddings, snapshot_filter_index, snapshot_lexical_index
+snapshot = Snapshot.open({snapshot_path!r})
+doc_table = snapshot_doc_table(snapshot)
+lexical = snapshot_lexical_index(snapshot)
+dense = snapshot_embeddings(snapshot)
+filters = snapshot_filter_index(snapshot)
+load_time = time.time() - start_time
+doc_ids, _ = lexical.top_k("word1 word7", 10)
+documents = doc_table.get(doc_ids)
+print(load_time, time.time() - start_time, len(documents))
+"""
+
+async def random_embeddings(texts):
+    return np.random.default_rng(len(texts)).standard_normal((len(texts), 384)).astype(np.float32)
+
+def run(script: str):
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), float(output[1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-pages", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        export_dir = Path(tmp_dir) / "export"
+        export_dir.mkdir()
+        write_export(export_dir, args.num_pages)
+        index_dir = Path(tmp_dir) / "index"
+        writer = IndexWriter(index_dir, snapshot=True)
+        stats = asyncio.run(ingest(read_html_export(export_dir), writer, workers=1, embed=random_embeddings, embedding_model="random"))
+        snapshot_size = (index_dir / "snapshot.bin").stat().st_size
+        print(f"indexed {stats.num_pages} pages ({stats.num_chunks} chunks), snapshot {snapshot_size / 2**20:.1f} MiB")
+
+        for name, script in [
+            ("files", LOAD_FROM_FILES.format(index_dir=str(index_dir))),
+            ("snapshot", LOAD_FROM_SNAPSHOT.format(snapshot_path=str(index_dir / "snapshot.bin"))),
+        ]:
+            load_time, first_query_time = run(script)
+            print(f"{name:>8}: loaded in {load_time * 1000:8.1f} ms, first query answered after {first_query_time * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Memory and fetch latency of the doc table: the JSONL rows parsed into Python strings and dicts
+versus the block-compressed doc store, which keeps only the compressed blocks (memory-mapped) and
+an LRU of decompressed ones. Fetches are of random result pages (`--page-size` docs), with the
+block cache disabled (every fetch decompresses) and warmed up on a working set of hot docs.
+
+Usage (from src/streamlit):
+python -m benchmarks.doc_store --num-pages 20000 --docs-per-block 8 16 32
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+
+from benchmarks.ingestion_throughput import write_export
+from core.doc_store import default_codec
+from core.doc_table import DOC_STORE_DIRNAME, DOC_TABLE_FILENAME, DocTable, write_doc_store
+from core.ingestion import IndexWriter, ingest, read_html_export
+
+def traced(load):
+    """Result of `load()` and the Python heap it still holds."""
+    tracemalloc.start()
+    result = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+def fetch_latency(doc_table: DocTable, pages: np.ndarray) -> float:
+    """Mean microseconds per fetched doc."""
+    start_time = time.perf_counter()
+    for doc_ids in pages:
+        for document in doc_table.get(doc_ids):
+            document.page_content
+    return (time.perf_counter() - start_time) / pages.size * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-pages", type=int, default=5000)
+    parser.add_argument("--docs-per-block", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--codec", default=default_codec(), choices=("zstd", "zlib"))
+    parser.add_argument("--page-size", type=int, default=5)
+    parser.add_argument("--num-fetches", type=int, default=2000)
+    parser.add_argument("--hot-docs", type=int, default=1000, help="working set of the warm cache fetches")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        export_dir = Path(tmp_dir) / "export"
+        export_dir.mkdir()
+        write_export(export_dir, args.num_pages)
+        index_dir = Path(tmp_dir) / "index"
+        stats = asyncio.run(ingest(read_html_export(export_dir), IndexWriter(index_dir, embeddings=False, dedup=False), workers=1))
+        jsonl_size = (index_dir / DOC_TABLE_FILENAME).stat().st_size
+        print(f"indexed {stats.num_pages} pages ({stats.num_chunks} chunks), {jsonl_size / 2**20:.1f} MiB of JSONL")
+
+        def load_jsonl() -> DocTable:
+            with open(index_dir / DOC_TABLE_FILENAME) as f:
+                rows = [json.loads(line) for line in f]
+            return DocTable([row["page_content"] for row in rows], [row["metadata"] for row in rows])
+
+        rng = np.random.default_rng(0)
+        cold_pages = rng.integers(0, stats.num_chunks, size=(args.num_fetches, args.page_size))
+        hot_pages = rng.integers(0, min(args.hot_docs, stats.num_chunks), size=(args.num_fetches, args.page_size))
+
+        doc_table, resident = traced(load_jsonl)
+        print(f"{'in memory':>22}: {resident / 2**20:8.1f} MiB resident, {fetch_latency(doc_table, cold_pages):6.1f} us/doc")
+        del doc_table
+
+        for docs_per_block in args.docs_per_block:
+            write_doc_store(index_dir, codec=args.codec, docs_per_block=docs_per_block)
+            stored = sum(path.stat().st_size for path in (index_dir / DOC_STORE_DIRNAME).rglob("*") if path.is_file())
+            uncached, resident = traced(lambda: DocTable.load(index_dir, cache_blocks=0))
+            cached = DocTable.load(index_dir)
+            fetch_latency(cached, hot_pages)
+            print(
+                f"{args.codec} {docs_per_block:>3} docs/block: {resident / 2**20:8.1f} MiB resident + {stored / 2**20:.1f} MiB mapped "
+                f"({jsonl_size / stored:.1f}x smaller), {fetch_latency(uncached, cold_pages):6.1f} us/doc uncached, "
+                f"{fetch_latency(cached, hot_pages):6.1f} us/doc cached"
+            )
+
+if __name__ == "__main__":
+    main()
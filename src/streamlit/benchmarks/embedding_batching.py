@@ -0,0 +1,88 @@
+"""
+Query embedding throughput and latency of concurrent sessions, each sending one request per
+query versus coalesced by the micro-batcher. The embedding server is simulated: a request costs
+a fixed overhead (`--request-ms`, HTTP and GPU launch) plus `--per-text-ms` per text, with at most
+`--server-slots` requests processed at once. Every client runs in its own thread and event loop,
+like a Streamlit session.
+
+Usage (from src/streamlit):
+python -m benchmarks.embedding_batching --clients 1 8 32 --batch-sizes 8 32 --wait-ms 2 5
+"""
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+import numpy as np
+
+from core.embedding_batcher import EmbeddingBatcher
+
+class SimulatedServer:
+    def __init__(self, request_ms: float, per_text_ms: float, slots: int, dim: int = 1024):
+        self.request_ms = request_ms
+        self.per_text_ms = per_text_ms
+        self.slots = threading.Semaphore(slots)
+        self.dim = dim
+        self.num_requests = 0
+
+    def process(self, texts: List[str]) -> np.ndarray:
+        with self.slots:
+            self.num_requests += 1
+            time.sleep((self.request_ms + self.per_text_ms * len(texts)) / 1000)
+        return np.ones((len(texts), self.dim), dtype=np.float32)
+
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> np.ndarray:
+        return await asyncio.to_thread(self.process, texts)
+
+def run_clients(embed_query: Callable[[str], Awaitable[np.ndarray]], clients: int, queries_per_client: int) -> np.ndarray:
+    """Latencies (ms) of every query of `clients` concurrent clients, each sending its queries one after the other."""
+    def client(i: int) -> List[float]:
+        async def run() -> List[float]:
+            latencies = []
+            for j in range(queries_per_client):
+                start_time = time.perf_counter()
+                await embed_query(f"query {i} {j}")
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            return latencies
+        return asyncio.run(run())
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        return np.concatenate(list(pool.map(client, range(clients))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queries-per-client", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--wait-ms", type=float, nargs="+", default=[2, 5])
+    parser.add_argument("--request-ms", type=float, default=20)
+    parser.add_argument("--per-text-ms", type=float, default=0.5)
+    parser.add_argument("--server-slots", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'clients':>7} {'mode':>18} {'queries/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'requests':>9}")
+    for clients in args.clients:
+        configs = [("unbatched", None, None)] + [
+            (f"batch {batch_size}, {wait_ms:g} ms", batch_size, wait_ms) for batch_size in args.batch_sizes for wait_ms in args.wait_ms
+        ]
+        for name, batch_size, wait_ms in configs:
+            server = SimulatedServer(args.request_ms, args.per_text_ms, args.server_slots)
+            batcher = None
+            if batch_size is None:
+                embed_query = lambda text: server.embed([text])
+            else:
+                batcher = EmbeddingBatcher(server.embed, max_batch_size=batch_size, max_wait=wait_ms / 1000)
+                embed_query = batcher.embed_query
+            start_time = time.perf_counter()
+            latencies = run_clients(embed_query, clients, args.queries_per_client)
+            duration = time.perf_counter() - start_time
+            if batcher is not None:
+                batcher.close()
+            print(
+                f"{clients:>7} {name:>18} {len(latencies) / duration:10.1f} {np.percentile(latencies, 50):8.1f} "
+                f"{np.percentile(latencies, 95):8.1f} {server.num_requests:>9}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Memory, open time, latency and recall loss of the memory-mapped embedding store per dtype,
+measured against exact float32 search.
+
+Usage (from src/streamlit):
+python -m benchmarks.embedding_store --num-docs 200000 --dim 1024 --dtypes float32 float16 int8
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+from benchmarks.hnsw_recall import clustered_embeddings, mean_latency_ms
+from core.dense import DenseIndex
+from core.embedding_store import EmbeddingStore, STORE_DTYPES
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--dtypes", nargs="+", default=list(STORE_DTYPES), choices=STORE_DTYPES)
+    args = parser.parse_args()
+
+    embeddings = clustered_embeddings(args.num_docs, args.dim)
+    query_vectors = clustered_embeddings(args.num_queries, args.dim, seed=1)
+    exact = DenseIndex.build(embeddings)
+    exact_ids = [exact.top_k(query_vector, args.k)[0] for query_vector in query_vectors]
+
+    print(f"{'dtype':>8} {'MiB':>8} {'bytes/vec':>9} {'open ms':>8} {'ms/query':>9} {f'recall@{args.k}':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for dtype in args.dtypes:
+            EmbeddingStore.write(Path(tmp_dir) / dtype, embeddings, dtype=dtype)
+            start_time = time.perf_counter()
+            store = EmbeddingStore.open(Path(tmp_dir) / dtype)
+            open_ms = (time.perf_counter() - start_time) * 1000
+            latency_ms = mean_latency_ms(lambda q: store.top_k(q, args.k), query_vectors)
+            hits = sum(
+                len(np.intersect1d(store.top_k(query_vector, args.k)[0], ids))
+                for query_vector, ids in zip(query_vectors, exact_ids)
+            )
+            recall = hits / (args.k * len(query_vectors))
+            print(
+                f"{dtype:>8} {store.nbytes / 2**20:>8.1f} {store.nbytes / store.num_docs:>9.0f} "
+                f"{open_ms:>8.2f} {latency_ms:>9.2f} {recall:>10.3f}"
+            )
+
+if __name__ == "__main__":
+    main()
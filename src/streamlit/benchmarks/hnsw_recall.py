@@ -0,0 +1,56 @@
+"""
+Recall/latency sweep of the HNSW index against exact brute-force search.
+
+Usage (from src/streamlit):
+python -m benchmarks.hnsw_recall --num-docs 20000 --dim 384 --M 8 16 32 --ef-search 16 32 64 128
+"""
+import argparse
+import time
+import numpy as np
+
+from core.dense import DenseIndex
+from core.hnsw import HNSWIndex
+
+def clustered_embeddings(num_docs: int, dim: int, num_clusters: int = 100, seed: int = 0) -> np.ndarray:
+    """Synthetic embeddings with some cluster structure, closer to real text embeddings than pure noise."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, num_docs)
+    return centroids[assignments] + 0.5 * rng.standard_normal((num_docs, dim)).astype(np.float32)
+
+def mean_latency_ms(search, query_vectors: np.ndarray) -> float:
+    start_time = time.perf_counter()
+    for query_vector in query_vectors:
+        search(query_vector)
+    return (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--M", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+
+    embeddings = clustered_embeddings(args.num_docs, args.dim)
+    query_vectors = clustered_embeddings(args.num_queries, args.dim, seed=1)
+    exact = DenseIndex.build(embeddings)
+    exact_ms = mean_latency_ms(lambda q: exact.top_k(q, args.k), query_vectors)
+    print(f"exact search: {exact_ms:.2f} ms/query over {args.num_docs} docs")
+
+    print(f"{'M':>4} {'ef_search':>9} {f'recall@{args.k}':>10} {'ms/query':>9}")
+    for M in args.M:
+        start_time = time.perf_counter()
+        index = HNSWIndex.build(embeddings, M=M, ef_construction=args.ef_construction)
+        build_duration = time.perf_counter() - start_time
+        print(f"built M={M} in {build_duration:.1f} s ({args.num_docs / build_duration:.0f} docs/s)")
+        for ef_search in args.ef_search:
+            recall = index.recall(exact, query_vectors, args.k, ef_search=ef_search)
+            latency_ms = mean_latency_ms(lambda q: index.top_k(q, args.k, ef_search=ef_search), query_vectors)
+            print(f"{M:>4} {ef_search:>9} {recall:>10.3f} {latency_ms:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Ingestion throughput (docs/s) of the bulk pipeline at several worker counts, on a synthetic
+Confluence HTML export. Embedding is left out since it is bound by the embedding server, not by
+the pipeline: this measures reading, markup stripping, chunking and index writing.
+
+Usage (from src/streamlit):
+python -m benchmarks.ingestion_throughput --num-pages 20000 --workers 1 4 16
+"""
+import argparse
+import asyncio
+import datetime
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from core.ingestion import IndexWriter, ingest, read_html_export
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>Policies : {title}</title><style>body {{ font-family: sans-serif; }}</style></head>
+<body><div id="page"><div id="main-header"><ol id="breadcrumbs"><li><a href="index.html">Policies</a></li></ol>
+<h1 id="title-heading" class="pagetitle">{title}</h1></div>
+<div id="content" class="view"><div class="page-metadata">Created by Jane Doe, last modified on {date}</div>
+<div id="main-content" class="wiki-content group">{body}</div></div>
+<div id="footer"><p>Document generated by Confluence</p></div></div></body></html>
+"""
+
+def write_export(path: Path, num_pages: int, vocab_size: int = 20000, seed: int = 0):
+    """Pages of 3-20 paragraphs (with a table every few pages) of Zipf-distributed words."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"word{i}" for i in range(vocab_size)])
+    start_date = datetime.date(2023, 1, 1)
+    for page_id in range(num_pages):
+        paragraphs = []
+        for _ in range(rng.integers(3, 21)):
+            tokens = words[np.minimum(rng.zipf(1.3, size=rng.integers(20, 120)), vocab_size) - 1]
+            paragraphs.append(f"<p>{' '.join(tokens)} <strong>{tokens[0]}</strong></p>")
+        if page_id % 5 == 0:
+            paragraphs.append("<table><tr><th>Circular</th><th>Status</th></tr><tr><td>C-12/2024</td><td>Active</td></tr></table>")
+        date = start_date + datetime.timedelta(days=int(rng.integers(0, 730)))
+        html = PAGE_TEMPLATE.format(title=f"Policy {page_id}", date=date.strftime("%b %d, %Y"), body="\n".join(paragraphs))
+        (path / f"Policy-{page_id}_{100000 + page_id}.html").write_text(html)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-pages", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        export_dir = Path(tmp_dir) / "export"
+        export_dir.mkdir()
+        write_export(export_dir, args.num_pages)
+        print(f"wrote {args.num_pages} pages")
+        for workers in args.workers:
+            writer = IndexWriter(Path(tmp_dir) / f"index_{workers}", embeddings=False)
+            stats = asyncio.run(ingest(read_html_export(export_dir), writer, workers=workers, pages_per_task=args.pages_per_task))
+            print(
+                f"{workers:>3} workers: {stats.pages_per_second:8.1f} docs/s, {stats.chunks_per_second:8.1f} chunks/s "
+                f"({stats.num_pages} pages, {stats.num_chunks} chunks in {stats.duration:.1f} s)"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Recall@k against bytes per vector for the IVF-PQ index, with and without exact re-ranking from
+the memory-mapped full vectors.
+
+Usage (from src/streamlit):
+python -m benchmarks.ivfpq_recall --num-docs 200000 --dim 384 --subquantizers 16 32 64 --nprobe 8 32
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.hnsw_recall import clustered_embeddings, mean_latency_ms
+from core.dense import DenseIndex
+from core.embedding_store import EmbeddingStore
+from core.ivfpq import IVFPQIndex
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--num-lists", type=int, default=256)
+    parser.add_argument("--training-size", type=int, default=20000)
+    parser.add_argument("--subquantizers", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--rerank-k", type=int, nargs="+", default=[0, 100])
+    args = parser.parse_args()
+
+    embeddings = clustered_embeddings(args.num_docs, args.dim)
+    query_vectors = clustered_embeddings(args.num_queries, args.dim, seed=1)
+    exact = DenseIndex.build(embeddings)
+    exact_ids = [exact.top_k(query_vector, args.k)[0] for query_vector in query_vectors]
+    print(f"float32 flat: {exact.embeddings.nbytes / exact.num_docs:.0f} bytes/vector")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = EmbeddingStore.write(tmp_dir, embeddings, dtype="float32")
+        print(f"{'m':>4} {'bytes/vec':>9} {'nprobe':>6} {'rerank':>6} {f'recall@{args.k}':>10} {'ms/query':>9}")
+        for num_subquantizers in args.subquantizers:
+            start_time = time.perf_counter()
+            index = IVFPQIndex.build(
+                embeddings,
+                num_lists=args.num_lists,
+                num_subquantizers=num_subquantizers,
+                training_size=args.training_size,
+            )
+            index.rerank_store = store
+            print(f"built m={num_subquantizers} in {time.perf_counter() - start_time:.1f} s")
+            for nprobe in args.nprobe:
+                for rerank_k in args.rerank_k:
+                    search = lambda q: index.top_k(q, args.k, nprobe=nprobe, rerank_k=rerank_k)
+                    hits = sum(
+                        len(np.intersect1d(search(query_vector)[0], ids))
+                        for query_vector, ids in zip(query_vectors, exact_ids)
+                    )
+                    recall = hits / (args.k * len(query_vectors))
+                    print(
+                        f"{num_subquantizers:>4} {index.bytes_per_vector:>9.0f} {nprobe:>6} {rerank_k:>6} "
+                        f"{recall:>10.3f} {mean_latency_ms(search, query_vectors):>9.2f}"
+                    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Latency of exhaustive BM25 scoring against block-max pruned top-k (always pruned, and adaptive as
+`BM25Index.top_k` runs it for unconstrained queries) on natural-language style queries, from keyword queries to long ones
+mixing in many very common words, checking that all three return identical results.
+
+Usage (from src/streamlit):
+python -m benchmarks.lexical_pruning --num-docs 500000 --k 20 --num-common 0 2 8
+"""
+import argparse
+import time
+import numpy as np
+
+from core.bm25 import BM25Index
+
+def zipf_corpus(num_docs: int, vocab_size: int, doc_length: int, seed: int = 0) -> np.ndarray:
+    """Token ids with a Zipfian frequency distribution, one row per document."""
+    rng = np.random.default_rng(seed)
+    probabilities = 1 / np.arange(1, vocab_size + 1)
+    probabilities /= probabilities.sum()
+    return rng.choice(vocab_size, size=(num_docs, doc_length), p=probabilities)
+
+def natural_language_queries(num_queries: int, vocab_size: int, num_common: int = 8, seed: int = 1) -> list:
+    """Long queries mixing very common "function" words with a few mid-frequency and rare content words."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(num_queries):
+        common = rng.integers(0, 50, size=num_common)
+        mid = rng.integers(50, 500, size=2)
+        rare = rng.integers(500, vocab_size, size=3)
+        queries.append(" ".join(f"w{token}" for token in np.concatenate([common, mid, rare])))
+    return queries
+
+def report(name: str, durations: list):
+    durations_ms = np.array(durations) * 1000
+    print(f"{name:>12}: mean {durations_ms.mean():.2f} ms, p50 {np.percentile(durations_ms, 50):.2f} ms, p99 {np.percentile(durations_ms, 99):.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=100000)
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--doc-length", type=int, default=120)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--num-common", type=int, nargs="+", default=[0, 1, 2, 4, 8], help="very common words per query, one query set each")
+    args = parser.parse_args()
+
+    corpus = zipf_corpus(args.num_docs, args.vocab_size, args.doc_length)
+    start_time = time.perf_counter()
+    index = BM25Index.build(" ".join(f"w{token}" for token in row) for row in corpus)
+    print(f"built {args.num_docs} docs in {time.perf_counter() - start_time:.1f} s")
+
+    searches = {
+        "exhaustive": index.top_k_exhaustive,
+        "block-max": lambda query, k: index.top_k_block_max(query, k, adaptive=False),
+        "adaptive": index.top_k_block_max,
+    }
+    all_timings = {name: [] for name in searches}
+    for num_common in args.num_common:
+        queries = natural_language_queries(args.num_queries, args.vocab_size, num_common=num_common)
+        timings = {name: [] for name in searches}
+        for query in queries:
+            results = {}
+            for name, search in searches.items():
+                start_time = time.perf_counter()
+                results[name] = search(query, args.k)
+                timings[name].append(time.perf_counter() - start_time)
+            exhaustive_ids, exhaustive_scores = results["exhaustive"]
+            for name, (doc_ids, scores) in results.items():
+                if not (np.array_equal(exhaustive_ids, doc_ids) and np.array_equal(exhaustive_scores, scores)):
+                    raise AssertionError(f"'{name}' results differ from exhaustive scoring for query '{query}'")
+        print(f"{num_common} common words per query, identical top-{args.k} for all {len(queries)} queries")
+        for name, durations in timings.items():
+            report(name, durations)
+            all_timings[name].extend(durations)
+    print("all queries")
+    for name, durations in all_timings.items():
+        report(name, durations)
+
+if __name__ == "__main__":
+    main()
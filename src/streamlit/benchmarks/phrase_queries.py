@@ -0,0 +1,97 @@
+"""
+Latency of `"exact phrase"` and `a NEAR/n b` queries answered from positional postings against
+the substring-scan approach (fetch every bag-of-words hit and scan its `page_content`), checking
+that both return the same top-k. Also reports how much the delta-encoded positions add to the index.
+
+Usage (from src/streamlit):
+python -m benchmarks.phrase_queries --num-docs 200000 --k 20
+"""
+import argparse
+import time
+import numpy as np
+
+from benchmarks.lexical_pruning import zipf_corpus
+from core.bm25 import BM25Index, tokenize
+from core.positions import parse_query
+
+def sample_queries(corpus: np.ndarray, num_queries: int, max_distance: int = 5, seed: int = 2) -> list:
+    """Phrases of 2-4 consecutive words and NEAR pairs taken from random documents, so every query has hits."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in range(num_queries):
+        row = corpus[rng.integers(len(corpus))]
+        if i % 2 == 0:
+            length = rng.integers(2, 5)
+            start = rng.integers(len(row) - length)
+            queries.append('"' + " ".join(f"w{token}" for token in row[start:start + length]) + '"')
+        else:
+            distance = rng.integers(1, max_distance + 1)
+            start = rng.integers(len(row) - distance)
+            queries.append(f"w{row[start]} NEAR/{distance} w{row[start + distance]}")
+    return queries
+
+def substring_scan_top_k(index: BM25Index, texts: list, query: str, k: int):
+    """Bag-of-words candidates from the postings, then a scan of each candidate's text for the constraints."""
+    parsed = parse_query(query)
+    term_ids = index.query_term_ids(parsed.text)
+    candidates = np.asarray(index.postings(term_ids[0])[0], dtype=np.int64)
+    for term_id in term_ids[1:]:
+        candidates = np.intersect1d(candidates, index.postings(term_id)[0])
+
+    matches = []
+    for doc_id in candidates.tolist():
+        text = texts[doc_id]
+        if all(f" {phrase} " in f" {text} " for phrase in parsed.phrases) and all(
+            near_in_text(tokenize(text), left, right, distance) for left, right, distance in parsed.nears
+        ):
+            matches.append(doc_id)
+    return index.top_k(parsed.text, k, allowed_ids=np.array(matches, dtype=np.int64))
+
+def near_in_text(tokens: list, left: str, right: str, distance: int) -> bool:
+    left_positions = np.flatnonzero(np.array(tokens) == left)
+    right_positions = np.flatnonzero(np.array(tokens) == right)
+    return bool((np.abs(left_positions[:, None] - right_positions[None, :]) <= distance).any())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=100000)
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--doc-length", type=int, default=120)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = zipf_corpus(args.num_docs, args.vocab_size, args.doc_length)
+    texts = [" ".join(f"w{token}" for token in row) for row in corpus]
+    start_time = time.perf_counter()
+    index = BM25Index.build(texts, positions=True)
+    print(f"built {args.num_docs} docs in {time.perf_counter() - start_time:.1f} s")
+    postings_bytes = index.doc_ids.nbytes + index.term_freqs.nbytes + index.indptr.nbytes
+    print(
+        f"postings {postings_bytes / 2**20:.1f} MiB, positions {index.positions.nbytes / 2**20:.1f} MiB "
+        f"({index.positions.deltas.dtype} deltas)"
+    )
+
+    searches = {
+        "substring scan": lambda query, k: substring_scan_top_k(index, texts, query, k),
+        "positional": index.top_k,
+    }
+    timings = {name: [] for name in searches}
+    for query in sample_queries(corpus, args.num_queries):
+        results = {}
+        for name, search in searches.items():
+            start_time = time.perf_counter()
+            results[name] = search(query, args.k)
+            timings[name].append(time.perf_counter() - start_time)
+        scan_ids, scan_scores = results["substring scan"]
+        doc_ids, scores = results["positional"]
+        if not (np.array_equal(scan_ids, doc_ids) and np.array_equal(scan_scores, scores)):
+            raise AssertionError(f"positional results differ from the substring scan for query '{query}'")
+
+    print(f"identical top-{args.k} for all {args.num_queries} queries")
+    for name, durations in timings.items():
+        durations_ms = np.array(durations) * 1000
+        print(f"{name:>14}: mean {durations_ms.mean():.2f} ms, p50 {np.percentile(durations_ms, 50):.2f} ms, p99 {np.percentile(durations_ms, 99):.2f} ms")
+
+if __name__ == "__main__":
+    main()
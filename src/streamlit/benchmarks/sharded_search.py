@@ -0,0 +1,103 @@
+"""
+Lexical search throughput (queries/s) under concurrent load: one process scoring the segmented
+index from a thread pool (as concurrent Streamlit sessions do, serialised by the GIL) against
+scatter-gather over N shard worker processes. Half the queries are restricted to a data source and
+a date range, some docs are tombstoned and near-duplicates are collapsed, as in the app, and both
+must return identical results. Also times reopening the index on a running pool, which is what an
+index reload costs. Run it on a machine with at least as many cores as shards, the speedup is
+bounded by the core count.
+
+Usage (from src/streamlit):
+python -m benchmarks.sharded_search --num-docs 500000 --shards 2 4 8 --clients 16
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.lexical_pruning import natural_language_queries, zipf_corpus
+from core.dedup import live_top_k
+from core.filters import FilterIndex
+from core.segments import SegmentedIndex
+from core.sharding import ShardPool
+
+def throughput(top_k, requests: list, k: int, clients: int) -> float:
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(lambda request: top_k(*request, k), requests))
+    return len(requests) / (time.perf_counter() - start_time)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=100000)
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--doc-length", type=int, default=120)
+    parser.add_argument("--num-segments", type=int, default=16)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4, os.cpu_count()])
+    parser.add_argument("--clients", type=int, default=16, help="concurrent queries")
+    parser.add_argument("--tombstones", type=float, default=0.01, help="fraction of docs deleted")
+    parser.add_argument("--duplicates", type=float, default=0.05, help="fraction of docs that are a near-duplicate of another")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = zipf_corpus(args.num_docs, args.vocab_size, args.doc_length)
+    texts = [" ".join(f"w{token}" for token in row) for row in corpus]
+    months = [f"{2024 + segment // 12}-{segment % 12 + 1:02d}" for segment in range(args.num_segments)]
+    segment_doc_ids = np.array_split(np.arange(len(texts)), args.num_segments)
+    metadatas = [
+        {"date": f"{month}-{day % 28 + 1:02d}", "data_source": ("Confluence", "Jira")[day % 2]}
+        for month, doc_ids in zip(months, segment_doc_ids) for day in range(len(doc_ids))
+    ]
+    filters = FilterIndex.build(metadatas)
+    tombstones = np.sort(rng.choice(args.num_docs, int(args.num_docs * args.tombstones), replace=False)).astype(np.int64)
+    cluster_ids = np.arange(args.num_docs)
+    duplicates = rng.choice(args.num_docs, int(args.num_docs * args.duplicates), replace=False)
+    cluster_ids[duplicates] = rng.integers(0, args.num_docs, len(duplicates))
+    queries = natural_language_queries(args.num_queries, args.vocab_size)
+    date_range = (f"{months[0]}-01", f"{months[len(months) // 2]}-28")
+    requests = [(query, "Jira", date_range) if i % 2 else (query, None, None) for i, query in enumerate(queries)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # one add per segment and no merges, so there are `num_segments` segments to spread over the shards
+        index = SegmentedIndex.create(tmp_dir)
+        for doc_ids in segment_doc_ids:
+            index.add([texts[i] for i in doc_ids.tolist()], [metadatas[i] for i in doc_ids.tolist()], doc_ids=doc_ids)
+        index = SegmentedIndex(tmp_dir).pin()
+        print(f"indexed {args.num_docs} docs in {len(index.segments)} segments, {os.cpu_count()} cores")
+
+        def single_top_k(query, data_source, date_range, k):
+            allowed_ids = filters.allowed_ids(data_source=data_source, date_range=date_range)
+            top_k = lambda k, allowed_ids: index.top_k(query, k, allowed_ids=allowed_ids, date_range=date_range)
+            return live_top_k(top_k, k, allowed_ids, tombstones, cluster_ids)
+
+        expected = [single_top_k(*request, args.k) for request in requests]
+        baseline = throughput(single_top_k, requests, args.k, args.clients)
+        print(f"single process: {baseline:8.1f} queries/s")
+        for num_shards in args.shards:
+            start_time = time.perf_counter()
+            pool = ShardPool(num_shards)
+            sharded = pool.open(tmp_dir, filters=filters, tombstones=tombstones, cluster_ids=cluster_ids)
+            start_duration = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            sharded.close()
+            sharded = pool.open(tmp_dir, filters=filters, tombstones=tombstones, cluster_ids=cluster_ids)
+            reload_duration = time.perf_counter() - start_time
+            sharded_top_k = lambda query, data_source, date_range, k: sharded.top_k(query, k, data_source=data_source, date_range=date_range)
+            for request, (doc_ids, scores) in zip(requests, expected):
+                sharded_ids, sharded_scores = sharded_top_k(*request, args.k)
+                if not np.array_equal(doc_ids, sharded_ids) or not np.allclose(scores, sharded_scores):
+                    raise AssertionError(f"{num_shards} shards differ from the single index for {request}")
+            queries_per_second = throughput(sharded_top_k, requests, args.k, args.clients)
+            print(
+                f"{num_shards:>3} shards:     {queries_per_second:8.1f} queries/s ({queries_per_second / baseline:.2f}x), "
+                f"started in {start_duration:.2f}s, reopened in {reload_duration:.2f}s"
+            )
+            sharded.close()
+            pool.close()
+
+if __name__ == "__main__":
+    main()
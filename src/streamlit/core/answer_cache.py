@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Union
+
+def answer_key(model: str, max_tokens: int, prompt_hash: str, question: str, doc_ids: Sequence[int]) -> str:
+    """Everything a temperature 0 generation depends on: the model, the prompt and the ordered context documents."""
+    payload = json.dumps([model, max_tokens, prompt_hash, question.strip(), [int(doc_id) for doc_id in doc_ids]])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    SQLite store of generated RAG answers, shared by every session and kept across restarts. The
+    database is in WAL mode so lookups never wait for a write. Each answer records the data source
+    and index generation its context came from: it is only served on that generation, and storing
+    an answer for a new generation of a source deletes the answers of its previous ones.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                data_source TEXT NOT NULL,
+                generation TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answers_data_source ON answers (data_source, generation);
+        """)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, generation: str) -> Optional[str]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT answer FROM answers WHERE key = ? AND generation = ?", (key, generation)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, data_source: str, generation: str, answer: str):
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM answers WHERE data_source = ? AND generation != ?", (data_source, generation))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO answers (key, data_source, generation, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data_source, generation, answer, time.time()),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+    def close(self):
+        self.connection.close()
+
+async def replay(answer: str, delay: float) -> AsyncIterator[str]:
+    """Growing prefixes of a cached answer, one word every `delay` seconds, to show it like a stream; nothing if `delay` is 0."""
+    if delay <= 0:
+        return
+    words = answer.split(" ")
+    for i in range(1, len(words)):
+        yield " ".join(words[:i])
+        await asyncio.sleep(delay)
@@ -0,0 +1,521 @@
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from core.filters import contains
+from core.positions import ParsedQuery, PositionalPostings, near_matches, parse_query, phrase_matches
+from core.ranking import top_k
+
+TOKEN_PATTERN = re.compile(r"\w+")
+BLOCK_SIZE = 128
+# relative slack on score upper bounds, so float32 rounding can never prune a true top-k document
+BOUND_SLACK = 1e-5
+# cost of one binary-search step into a posting list, relative to scoring one posting exhaustively
+# (fitted with benchmarks/lexical_pruning.py): probing n docs in a list of m postings costs about
+# PROBE_STEP_COST * n * log2(m) postings
+PROBE_STEP_COST = 0.25
+# fixed cost of block-max pruning per query term, in postings scored exhaustively: seeding the
+# threshold, gathering candidates and each probing pass make a few NumPy calls per term
+PRUNING_TERM_COST = 8000
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def sorted_union(chunks: List[np.ndarray]) -> np.ndarray:
+    """Sorted unique doc ids of several id arrays (a sort beats np.unique's hashing for these sizes)."""
+    doc_ids = np.sort(np.concatenate(chunks).astype(np.int64))
+    if len(doc_ids) == 0:
+        return doc_ids
+    keep = np.empty(len(doc_ids), dtype=bool)
+    keep[0] = True
+    np.not_equal(doc_ids[1:], doc_ids[:-1], out=keep[1:])
+    return doc_ids[keep]
+
+def probe_cost(doc_freqs: np.ndarray, num_docs: int) -> float:
+    """Cost of probing `num_docs` docs in posting lists of `doc_freqs` postings, in postings scored exhaustively."""
+    return PROBE_STEP_COST * num_docs * float(np.log2(doc_freqs + 1).sum())
+
+def probe_keys(sorted_ids: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+    """
+    `doc_ids` in the dtype of the `sorted_ids` they are binary-searched in: searching int64 keys in
+    an int32 array makes np.searchsorted cast the whole array, a copy per probe that costs more than
+    the search itself. Doc ids of an index always fit its posting dtype.
+    """
+    return doc_ids.astype(sorted_ids.dtype, copy=False)
+
+class BM25Index:
+    """
+    Inverted index with its posting lists stored as CSR arrays: the postings of term `t` are
+    `doc_ids[indptr[t]:indptr[t + 1]]` (sorted ascending) with matching `term_freqs`.
+
+    Every posting list is also cut into blocks of `BLOCK_SIZE` postings, and the index stores the
+    last doc id and the maximum BM25 contribution of each block (`block_indptr` gives the blocks
+    of each term). These upper bounds drive the block-max pruning in `top_k`.
+
+    Optionally, `positions` holds the token positions of every posting, which lets `top_k` answer
+    `"exact phrase"` and `a NEAR/n b` queries from the postings alone. Without them such queries
+    are ranked as plain bags of words.
+    """
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+        block_indptr: Optional[np.ndarray] = None,
+        block_last_docs: Optional[np.ndarray] = None,
+        block_max_scores: Optional[np.ndarray] = None,
+        positions: Optional[PositionalPostings] = None,
+    ):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.positions = positions
+
+        self._set_scoring_stats(len(doc_lengths), float(doc_lengths.mean()) if len(doc_lengths) else 0.0, np.diff(indptr))
+
+        if block_indptr is None:
+            block_indptr, block_last_docs, block_max_scores = self._compute_blocks()
+        self._set_blocks(block_indptr, block_last_docs, block_max_scores)
+
+    def _set_scoring_stats(self, num_docs: int, avg_doc_length: float, doc_freqs: np.ndarray):
+        doc_freqs = np.asarray(doc_freqs, dtype=np.float32)
+        self.avg_doc_length = avg_doc_length
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        # length normalisation only depends on the document, so it is computed once at load time
+        self.length_norm = (
+            self.k1 * (1 - self.b + self.b * self.doc_lengths / max(avg_doc_length, 1e-9))
+        ).astype(np.float32)
+
+    def _set_blocks(self, block_indptr: np.ndarray, block_last_docs: np.ndarray, block_max_scores: np.ndarray):
+        self.block_indptr = block_indptr
+        self.block_last_docs = block_last_docs
+        self.block_max_scores = block_max_scores
+        self.term_max_scores = np.zeros(len(self.indptr) - 1, dtype=np.float32)
+        has_blocks = np.diff(block_indptr) > 0
+        self.term_max_scores[has_blocks] = np.maximum.reduceat(block_max_scores, block_indptr[:-1][has_blocks])
+
+    def apply_collection_stats(
+        self,
+        num_docs: int,
+        avg_doc_length: float,
+        doc_freqs: np.ndarray,
+        block_impacts: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
+        """
+        Scores with collection-wide statistics instead of this index's own, e.g. summed over all the
+        segments of a segmented index, so that every segment ranks on the same scale. `doc_freqs` is
+        aligned with this index's term ids. Block upper bounds are recomputed to match: from the
+        saved `block_impacts` (see `block_impacts`) if given, otherwise by rescoring every posting.
+        """
+        self._set_scoring_stats(num_docs, avg_doc_length, doc_freqs)
+        if block_impacts is None:
+            self._set_blocks(*self._compute_blocks())
+            return
+        max_term_freqs, min_doc_lengths = block_impacts
+        block_terms = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.block_indptr))
+        length_norm = (self.k1 * (1 - self.b + self.b * min_doc_lengths / max(avg_doc_length, 1e-9))).astype(np.float32)
+        # same float32 expression as `term_scores`, for the best term frequency and shortest document of each block
+        block_max_scores = self.idf[block_terms] * max_term_freqs * (self.k1 + 1) / (max_term_freqs + length_norm)
+        self._set_blocks(self.block_indptr, self.block_last_docs, block_max_scores.astype(np.float32))
+
+    def _block_starts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Term id of every posting, and the offset of the first posting of every block."""
+        doc_freqs = np.diff(self.indptr)
+        posting_terms = np.repeat(np.arange(len(doc_freqs)), doc_freqs)
+        offsets = np.arange(len(self.doc_ids)) - self.indptr[posting_terms]
+        return posting_terms, np.flatnonzero(offsets % BLOCK_SIZE == 0)
+
+    def _compute_blocks(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-block last doc id and max BM25 contribution for every posting list."""
+        doc_freqs = np.diff(self.indptr)
+        block_indptr = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+        np.cumsum((doc_freqs + BLOCK_SIZE - 1) // BLOCK_SIZE, out=block_indptr[1:])
+        if len(self.doc_ids) == 0:
+            return block_indptr, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        posting_terms, block_starts = self._block_starts()
+        # same float32 expression as `term_scores`, so the bounds are exact per posting
+        doc_ids = np.asarray(self.doc_ids)
+        scores = self.idf[posting_terms] * self.term_freqs * (self.k1 + 1) / (self.term_freqs + self.length_norm[doc_ids])
+        block_ends = np.append(block_starts[1:], len(doc_ids)) - 1
+        return (
+            block_indptr,
+            doc_ids[block_ends].astype(np.int32),
+            np.maximum.reduceat(scores, block_starts).astype(np.float32),
+        )
+
+    def block_impacts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Highest term frequency and shortest document length of every block. A term's BM25
+        contribution grows with the first and shrinks with the second whatever the collection
+        statistics, so together they bound the block under any of them.
+        """
+        if len(self.doc_ids) == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        _, block_starts = self._block_starts()
+        return (
+            np.maximum.reduceat(np.asarray(self.term_freqs, dtype=np.float32), block_starts),
+            np.minimum.reduceat(np.asarray(self.doc_lengths, dtype=np.float32)[np.asarray(self.doc_ids)], block_starts),
+        )
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75, positions: bool = False) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        term_chunks, doc_chunks, tf_chunks, position_chunks, doc_lengths = [], [], [], [], []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            if not tokens:
+                continue
+            token_ids = np.fromiter(
+                (vocab.setdefault(token, len(vocab)) for token in tokens),
+                dtype=np.int32,
+                count=len(tokens),
+            )
+            unique_ids, counts = np.unique(token_ids, return_counts=True)
+            term_chunks.append(unique_ids)
+            tf_chunks.append(counts)
+            doc_chunks.append(np.full(len(unique_ids), doc_id, dtype=np.int32))
+            if positions:
+                # token positions grouped by term id, i.e. in the same order as this doc's postings
+                position_chunks.append(np.argsort(token_ids, kind="stable"))
+
+        if term_chunks:
+            terms = np.concatenate(term_chunks)
+            docs = np.concatenate(doc_chunks)
+            tfs = np.concatenate(tf_chunks)
+        else:
+            terms = docs = tfs = np.empty(0, dtype=np.int32)
+        postings_positions = None
+        if positions:
+            postings_positions = PositionalPostings.encode(
+                np.concatenate(position_chunks) if position_chunks else np.empty(0, dtype=np.int64),
+                tfs,
+            )
+        return cls.from_postings(
+            vocab, terms, docs, tfs, np.asarray(doc_lengths, dtype=np.float32), k1=k1, b=b, positions=postings_positions,
+        )
+
+    @classmethod
+    def from_postings(
+        cls,
+        vocab: Dict[str, int],
+        term_ids: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+        positions: Optional[PositionalPostings] = None,
+    ) -> "BM25Index":
+        """
+        Builds the CSR layout from unordered (term id, doc id, term frequency) postings, with their
+        `positions` (if any) in the same order.
+        """
+        # postings are grouped by term and, within a term, sorted by doc id
+        order = np.lexsort((doc_ids, term_ids))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=indptr[1:])
+        return cls(
+            vocab=vocab,
+            indptr=indptr,
+            doc_ids=doc_ids[order].astype(np.int32),
+            term_freqs=term_freqs[order].astype(np.float32),
+            doc_lengths=doc_lengths,
+            k1=k1,
+            b=b,
+            positions=positions.take(order) if positions is not None else None,
+        )
+
+    def query_term_ids(self, query: str) -> List[int]:
+        """Known query terms in order of first appearance."""
+        term_ids = []
+        for token in tokenize(query):
+            term_id = self.vocab.get(token)
+            if term_id is not None and term_id not in term_ids:
+                term_ids.append(term_id)
+        return term_ids
+
+    def doc_freqs_of(self, term_ids: List[int]) -> np.ndarray:
+        """Posting list lengths of `term_ids`."""
+        term_ids = np.array(term_ids)
+        return np.asarray(self.indptr[term_ids + 1] - self.indptr[term_ids])
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.term_freqs[start:end]
+
+    def term_scores(self, term_id: int, doc_ids: np.ndarray, term_freqs: np.ndarray) -> np.ndarray:
+        """BM25 contribution of `term_id` for each posting."""
+        return self.idf[term_id] * term_freqs * (self.k1 + 1) / (term_freqs + self.length_norm[doc_ids])
+
+    def score(self, query: str, term_ids: Optional[List[int]] = None) -> np.ndarray:
+        """Dense array of BM25 scores for every document in the index (`term_ids` are the query's, if already looked up)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term_id in self.query_term_ids(query) if term_ids is None else term_ids:
+            doc_ids, term_freqs = self.postings(term_id)
+            # doc ids are unique within a posting list, so fancy-index accumulation is safe
+            scores[doc_ids] += self.term_scores(term_id, doc_ids, term_freqs)
+        return scores
+
+    def top_k_exhaustive(self, query: str, k: int, term_ids: Optional[List[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids and scores of the k best matching documents, scoring every posting of every query term."""
+        scores = self.score(query, term_ids)
+        matches = np.flatnonzero(scores > 0)
+        best = matches[top_k(scores[matches], k)]
+        return best, scores[best]
+
+    def score_candidates(self, term_ids: List[int], candidates: np.ndarray) -> np.ndarray:
+        """Exact BM25 scores of sorted `candidates`, found in each posting list by binary search."""
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        keys = probe_keys(self.doc_ids, candidates)
+        # accumulate in query-term order, like `score`, so both paths produce bit-identical floats
+        for term_id in term_ids:
+            doc_ids, term_freqs = self.postings(term_id)
+            positions = np.searchsorted(doc_ids, keys)
+            found = positions < len(doc_ids)
+            found[found] = doc_ids[positions[found]] == keys[found]
+            scores[found] += self.term_scores(term_id, candidates[found], term_freqs[positions[found]])
+        return scores
+
+    def _initial_threshold(self, term_ids: List[int], k: int) -> float:
+        """
+        A lower bound on the final k-th best score: the exact k-th best score among seed documents
+        taken from the highest-scoring blocks of the strongest query terms.
+        """
+        seed_chunks, num_seeds = [], 0
+        for term_id in sorted(term_ids, key=lambda term_id: -self.term_max_scores[term_id]):
+            first_block, last_block = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+            doc_ids, _ = self.postings(term_id)
+            num_postings = 0
+            for block in np.argsort(-self.block_max_scores[first_block:last_block], kind="stable"):
+                seed_chunks.append(doc_ids[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+                num_postings += len(seed_chunks[-1])
+                if num_postings >= k:
+                    break
+            num_seeds += num_postings
+            if num_seeds >= k:
+                seed_ids = sorted_union(seed_chunks)
+                if len(seed_ids) >= k:
+                    seed_scores = self.score_candidates(term_ids, seed_ids)
+                    return float(seed_scores[top_k(seed_scores, k)[-1]])
+        return 0.0
+
+    def _block_upper_bounds(self, term_ids: List[int], candidates: np.ndarray) -> np.ndarray:
+        """Sum over query terms of the max score of the block each candidate would fall in."""
+        bounds = np.zeros(len(candidates), dtype=np.float32)
+        keys = probe_keys(self.block_last_docs, candidates)
+        for term_id in term_ids:
+            first_block, last_block = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+            blocks = np.searchsorted(self.block_last_docs[first_block:last_block], keys)
+            inside = blocks < last_block - first_block
+            bounds[inside] += self.block_max_scores[first_block + blocks[inside]]
+        return bounds
+
+    def top_k_block_max(self, query: str, k: int, adaptive: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same results as `top_k_exhaustive`, using block-max MaxScore pruning:
+
+        1. a score threshold is seeded from the best blocks of the strongest query terms;
+        2. terms whose summed upper bounds stay below the threshold are "non-essential": a document
+           that only contains them cannot reach the top k, so their (usually long) posting lists
+           are never scanned, only probed by binary search;
+        3. candidates come from the blocks of the essential terms whose block max, plus the upper
+           bounds of every other term, can still reach the threshold;
+        4. candidates whose exact essential score plus the non-essential block maxima cannot reach
+           the threshold are dropped, and only the survivors are scored in full.
+
+        With `adaptive`, queries for which pruning costs more than scoring every posting (see
+        `PROBE_STEP_COST` and `PRUNING_TERM_COST`) are scored exhaustively instead; the results are
+        the same either way. Every candidate is probed in every query term's list, and the
+        candidates are about the essential postings (block maxima rarely rule out whole blocks), so
+        long queries of common words and small indexes are scored exhaustively.
+        """
+        term_ids = self.query_term_ids(query)
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        doc_freqs = self.doc_freqs_of(term_ids)
+        num_postings = doc_freqs.sum()
+        # short posting lists: cheaper to score them all than to even estimate the pruning cost
+        if adaptive and PRUNING_TERM_COST * len(term_ids) > num_postings:
+            return self.top_k_exhaustive(query, k, term_ids)
+        upper_bounds = self.term_max_scores[term_ids].astype(np.float64) * (1 + BOUND_SLACK)
+        by_bound = np.argsort(upper_bounds, kind="stable")
+        cumulative_bounds = np.cumsum(upper_bounds[by_bound])
+        # candidates (about the essential postings) are probed in every query term's list
+        pruning_cost = lambda threshold: PRUNING_TERM_COST * len(term_ids) + probe_cost(
+            doc_freqs, doc_freqs[by_bound[np.searchsorted(cumulative_bounds, threshold, side="left"):]].sum(),
+        )
+        # the k-th best score is usually above the strongest term's best contribution: a query too
+        # costly to prune even at that threshold is scored exhaustively before computing the real one
+        if adaptive and pruning_cost(upper_bounds.max()) > num_postings:
+            return self.top_k_exhaustive(query, k, term_ids)
+        threshold = self._initial_threshold(term_ids, k) * (1 - BOUND_SLACK)
+        if threshold <= 0:
+            # fewer than k matching documents, nothing can be pruned
+            return self.top_k_exhaustive(query, k, term_ids)
+        if adaptive and pruning_cost(threshold) > num_postings:
+            return self.top_k_exhaustive(query, k, term_ids)
+
+        num_non_essential = int(np.searchsorted(cumulative_bounds, threshold, side="left"))
+        non_essential = set(term_ids[i] for i in by_bound[:num_non_essential])
+        # both groups keep the query-term order so partial scores accumulate like `score`
+        essential_terms = [term_id for term_id in term_ids if term_id not in non_essential]
+        non_essential_terms = [term_id for term_id in term_ids if term_id in non_essential]
+        total_bound = upper_bounds.sum()
+
+        candidate_chunks = []
+        for term_id, upper_bound in zip(term_ids, upper_bounds):
+            if term_id in non_essential:
+                continue
+            first_block, last_block = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+            block_max = self.block_max_scores[first_block:last_block] * (1 + BOUND_SLACK)
+            doc_ids, _ = self.postings(term_id)
+            live_blocks = np.flatnonzero(block_max + (total_bound - upper_bound) >= threshold)
+            if len(live_blocks) == last_block - first_block:
+                candidate_chunks.append(doc_ids)
+            elif len(live_blocks):
+                posting_starts = live_blocks * BLOCK_SIZE
+                lengths = np.minimum(posting_starts + BLOCK_SIZE, len(doc_ids)) - posting_starts
+                offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+                candidate_chunks.append(doc_ids[np.repeat(posting_starts, lengths) + offsets])
+        if not candidate_chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates = sorted_union(candidate_chunks)
+
+        bounds = (
+            self.score_candidates(essential_terms, candidates)
+            + self._block_upper_bounds(non_essential_terms, candidates)
+        ) * (1 + BOUND_SLACK)
+        candidates = candidates[bounds >= threshold]
+        scores = self.score_candidates(term_ids, candidates)
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def top_k_filtered(self, query: str, k: int, allowed_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k restricted to the sorted `allowed_ids`. A narrow filter scores only the allowed docs by
+        probing each posting list, so it gets cheaper as the filter narrows; a broad one scores
+        exhaustively and masks.
+        """
+        term_ids = self.query_term_ids(query)
+        if not term_ids or k <= 0 or len(allowed_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        doc_freqs = self.doc_freqs_of(term_ids)
+        if probe_cost(doc_freqs, len(allowed_ids)) <= doc_freqs.sum():
+            scores = self.score_candidates(term_ids, allowed_ids)
+        else:
+            scores = self.score(query)[allowed_ids]
+        matches = np.flatnonzero(scores > 0)
+        best = matches[top_k(scores[matches], k)]
+        return allowed_ids[best], scores[best]
+
+    def occurrences(self, term_id: int, candidates: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc id, position) of every occurrence of `term_id`, only decoding the postings of the sorted `candidates`."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        postings = np.arange(start, end)
+        if candidates is not None:
+            postings = postings[contains(candidates, np.asarray(self.doc_ids[start:end]))]
+        owners, positions = self.positions.decode(postings)
+        return np.asarray(self.doc_ids)[postings[owners]], positions
+
+    def constrained_doc_ids(self, parsed: ParsedQuery) -> Optional[np.ndarray]:
+        """
+        Sorted doc ids satisfying every `"exact phrase"` and `a NEAR/n b` constraint of the query, or
+        None when it has none (or the index has no positions). Candidates are narrowed to the docs
+        containing every constrained term before any positions are decoded.
+        """
+        if not parsed.has_constraints or self.positions is None:
+            return None
+        # a quoted phrase without any word (`"--"`, `"?"`) constrains nothing
+        phrases = [[self.vocab.get(token) for token in tokens] for tokens in map(tokenize, parsed.phrases) if tokens]
+        nears = [
+            (self.vocab.get(left.lower()), self.vocab.get(right.lower()), distance)
+            for left, right, distance in parsed.nears
+        ]
+        if not phrases and not nears:
+            return None
+        term_ids = {term_id for terms in phrases for term_id in terms}
+        term_ids.update(term_id for left_id, right_id, _ in nears for term_id in (left_id, right_id))
+        if None in term_ids:
+            return np.empty(0, dtype=np.int64)
+
+        # intersect from the rarest term, so each step only probes the survivors
+        term_ids = sorted(term_ids, key=lambda term_id: self.indptr[term_id + 1] - self.indptr[term_id])
+        candidates = np.asarray(self.postings(term_ids[0])[0], dtype=np.int64)
+        for term_id in term_ids[1:]:
+            candidates = candidates[contains(np.asarray(self.postings(term_id)[0]), probe_keys(self.doc_ids, candidates))]
+
+        occurrences = {term_id: self.occurrences(term_id, candidates) for term_id in term_ids}
+        for phrase_ids in phrases:
+            matches = phrase_matches([occurrences[term_id] for term_id in phrase_ids])
+            candidates = candidates[contains(matches, candidates)]
+        for left_id, right_id, distance in nears:
+            matches = near_matches(occurrences[left_id], occurrences[right_id], distance)
+            candidates = candidates[contains(matches, candidates)]
+        return candidates
+
+    def top_k(self, query: str, k: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Doc ids and scores of the k best matching documents (among `allowed_ids` if given), best first.
+        Phrase and proximity constraints restrict the matches and all query words are used for ranking.
+        """
+        parsed = parse_query(query)
+        if parsed.has_constraints:
+            query = parsed.text
+            constrained_ids = self.constrained_doc_ids(parsed)
+            if constrained_ids is not None:
+                allowed_ids = constrained_ids if allowed_ids is None else allowed_ids[contains(constrained_ids, allowed_ids)]
+        if allowed_ids is not None:
+            return self.top_k_filtered(query, k, allowed_ids)
+        return self.top_k_block_max(query, k)
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "indptr.npy", self.indptr)
+        np.save(path / "doc_ids.npy", self.doc_ids)
+        np.save(path / "term_freqs.npy", self.term_freqs)
+        np.save(path / "doc_lengths.npy", self.doc_lengths)
+        np.save(path / "block_indptr.npy", self.block_indptr)
+        np.save(path / "block_last_docs.npy", self.block_last_docs)
+        np.save(path / "block_max_scores.npy", self.block_max_scores)
+        if self.positions is not None:
+            self.positions.save(path)
+        with open(path / "vocab.json", "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "vocab": self.vocab}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Loads an index saved with `save`, memory-mapping the posting arrays."""
+        path = Path(path)
+        with open(path / "vocab.json") as f:
+            params = json.load(f)
+        return cls(
+            vocab=params["vocab"],
+            indptr=np.load(path / "indptr.npy", mmap_mode="r"),
+            doc_ids=np.load(path / "doc_ids.npy", mmap_mode="r"),
+            term_freqs=np.load(path / "term_freqs.npy", mmap_mode="r"),
+            doc_lengths=np.load(path / "doc_lengths.npy"),
+            k1=params["k1"],
+            b=params["b"],
+            block_indptr=np.load(path / "block_indptr.npy"),
+            block_last_docs=np.load(path / "block_last_docs.npy", mmap_mode="r"),
+            block_max_scores=np.load(path / "block_max_scores.npy", mmap_mode="r"),
+            positions=PositionalPostings.load(path) if PositionalPostings.exists(path) else None,
+        )
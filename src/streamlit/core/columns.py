@@ -0,0 +1,305 @@
+import datetime
+import json
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+import numpy as np
+
+from core.files import atomic_save, atomic_write_json
+from core.filters import MISSING_DATE, to_day
+
+class PackedStrings(Sequence):
+    """Strings stored as one UTF-8 buffer and `offsets` into it, decoded (and JSON-parsed if `as_json`) on access."""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray, as_json: bool = False):
+        self.offsets = offsets
+        self.data = data
+        self.as_json = as_json
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Any:
+        value = self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+        return json.loads(value) if self.as_json else value
+
+    @classmethod
+    def pack(cls, strings: Iterable[str]) -> "PackedStrings":
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def take(self, rows: np.ndarray) -> "PackedStrings":
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[:-1])[rows]
+        lengths = np.asarray(self.offsets[1:])[rows] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return PackedStrings(offsets, np.asarray(self.data)[index], self.as_json)
+
+    def head(self, n: int) -> "PackedStrings":
+        return PackedStrings(self.offsets[:n + 1], self.data[:self.offsets[n]], self.as_json)
+
+    @classmethod
+    def concatenate(cls, first: "PackedStrings", second: "PackedStrings") -> "PackedStrings":
+        return cls(
+            np.concatenate([first.offsets, np.asarray(second.offsets[1:]) + first.offsets[-1]]),
+            np.concatenate([first.data, second.data]),
+            first.as_json,
+        )
+
+def from_day(day: int) -> Optional[str]:
+    """ISO date of days since the Unix epoch, the inverse of `to_day`."""
+    if day == MISSING_DATE:
+        return None
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=day)).isoformat()
+
+# metadata keys held in columns, every other key is kept as JSON in `extras`
+COLUMN_KEYS = ("title", "link", "date", "data_source", "page_id", "chunk", "token_counts")
+PAGE_COLUMNS = ("page_ids", "titles", "links")
+FACETS = ("data_source", "year")
+SORT_KEYS = ("relevance", "date", "title")
+
+def rank_titles(titles: List[str]) -> np.ndarray:
+    """Alphabetical rank of every title, which sorting by title compares."""
+    ranks = np.empty(len(titles), dtype=np.int32)
+    ranks[sorted(range(len(titles)), key=titles.__getitem__)] = np.arange(len(titles), dtype=np.int32)
+    return ranks
+
+class MetadataTable:
+    """
+    Document metadata as columns indexed by doc id instead of one dict per chunk. Title, link and
+    page id are stored once per page (`page_index` maps every doc to its page), dates as days since
+    epoch, data sources as codes into `sources`, and token counts as one column per tokenizer (-1
+    when missing). Filters, sorts and facets over doc ids are vectorized over these columns;
+    `table[doc_id]` only builds the metadata dict of a row that is displayed.
+    """
+
+    def __init__(
+        self,
+        page_index: np.ndarray,
+        pages: Dict[str, PackedStrings],
+        title_ranks: np.ndarray,
+        dates: np.ndarray,
+        source_codes: np.ndarray,
+        sources: List[str],
+        chunks: np.ndarray,
+        token_counts: np.ndarray,
+        tokenizers: List[str],
+        extras: PackedStrings,
+    ):
+        self.page_index = page_index
+        self.pages = pages
+        self.title_ranks = title_ranks
+        self.dates = dates
+        self.source_codes = source_codes
+        self.sources = sources
+        self.chunks = chunks
+        self.token_counts = token_counts
+        self.tokenizers = tokenizers
+        self.extras = extras
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __getitem__(self, doc_id: int) -> dict:
+        doc_id = int(doc_id)
+        page = int(self.page_index[doc_id])
+        metadata = {
+            "title": self.pages["titles"][page],
+            "link": self.pages["links"][page],
+            "date": from_day(int(self.dates[doc_id])),
+            "data_source": self.sources[self.source_codes[doc_id]],
+            "page_id": self.pages["page_ids"][page],
+            "chunk": int(self.chunks[doc_id]),
+        }
+        counts = {name: int(count) for name, count in zip(self.tokenizers, self.token_counts[doc_id].tolist()) if count >= 0}
+        if counts:
+            metadata["token_counts"] = counts
+        extras = self.extras[doc_id]
+        if extras:
+            metadata.update(json.loads(extras))
+        return metadata
+
+    @classmethod
+    def build(cls, metadatas: Iterable[dict]) -> "MetadataTable":
+        """Columns of metadata dicts (in doc id order); consecutive chunks of a page share its page entry."""
+        page_index, page_rows, dates, source_codes, chunks, token_counts, extras = [], [], [], [], [], [], []
+        sources: Dict[str, int] = {}
+        tokenizers: Dict[str, int] = {}
+        for metadata in metadatas:
+            page_row = (str(metadata.get("page_id") or ""), str(metadata.get("title") or ""), str(metadata.get("link") or ""))
+            if not page_rows or page_rows[-1] != page_row:
+                page_rows.append(page_row)
+            page_index.append(len(page_rows) - 1)
+            dates.append(to_day(metadata.get("date")))
+            source_codes.append(sources.setdefault(metadata.get("data_source") or "", len(sources)))
+            chunks.append(int(metadata.get("chunk") or 0))
+            counts = metadata.get("token_counts") or {}
+            for name in counts:
+                tokenizers.setdefault(name, len(tokenizers))
+            token_counts.append(counts)
+            rest = {key: value for key, value in metadata.items() if key not in COLUMN_KEYS and key not in ("doc_id", "score")}
+            extras.append(json.dumps(rest) if rest else "")
+
+        count_columns = np.full((len(token_counts), len(tokenizers)), -1, dtype=np.int32)
+        for doc_id, counts in enumerate(token_counts):
+            for name, count in counts.items():
+                count_columns[doc_id, tokenizers[name]] = count
+        return cls(
+            np.array(page_index, dtype=np.int32),
+            {name: PackedStrings.pack(row[i] for row in page_rows) for i, name in enumerate(PAGE_COLUMNS)},
+            rank_titles([title for _, title, _ in page_rows]),
+            np.array(dates, dtype=np.int32),
+            np.array(source_codes, dtype=np.int16),
+            list(sources),
+            np.array(chunks, dtype=np.int32),
+            count_columns,
+            list(tokenizers),
+            PackedStrings.pack(extras),
+        )
+
+    def head(self, num_docs: int) -> "MetadataTable":
+        """The rows of the first `num_docs` doc ids."""
+        num_pages = int(self.page_index[num_docs - 1]) + 1 if num_docs else 0
+        pages = {name: strings.head(num_pages) for name, strings in self.pages.items()}
+        return MetadataTable(
+            self.page_index[:num_docs],
+            pages,
+            rank_titles(list(pages["titles"])),
+            self.dates[:num_docs],
+            self.source_codes[:num_docs],
+            self.sources,
+            self.chunks[:num_docs],
+            self.token_counts[:num_docs],
+            self.tokenizers,
+            self.extras.head(num_docs),
+        )
+
+    @classmethod
+    def concatenate(cls, first: "MetadataTable", second: "MetadataTable") -> "MetadataTable":
+        """The rows of `first` followed by those of `second`, without building metadata dicts; only the titles are decoded, to rank them."""
+        sources = list(first.sources) + [source for source in second.sources if source not in first.sources]
+        source_map = np.array([sources.index(source) for source in second.sources], dtype=np.int16)
+        tokenizers = list(first.tokenizers) + [name for name in second.tokenizers if name not in first.tokenizers]
+        token_counts = np.full((len(first) + len(second), len(tokenizers)), -1, dtype=np.int32)
+        token_counts[:len(first), :len(first.tokenizers)] = first.token_counts
+        token_counts[len(first):, [tokenizers.index(name) for name in second.tokenizers]] = second.token_counts
+        pages = {name: PackedStrings.concatenate(first.pages[name], second.pages[name]) for name in PAGE_COLUMNS}
+        return cls(
+            np.concatenate([first.page_index, np.asarray(second.page_index) + len(first.pages["titles"])]).astype(np.int32),
+            pages,
+            rank_titles(list(pages["titles"])),
+            np.concatenate([first.dates, second.dates]).astype(np.int32),
+            np.concatenate([first.source_codes, source_map[np.asarray(second.source_codes, dtype=np.int64)]]).astype(np.int16),
+            sources,
+            np.concatenate([first.chunks, second.chunks]).astype(np.int32),
+            token_counts,
+            tokenizers,
+            PackedStrings.concatenate(first.extras, second.extras),
+        )
+
+    def take(self, rows: np.ndarray) -> "MetadataTable":
+        """The table of the given rows; pages are kept whole, so orphaned ones stay until the table is rebuilt."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return MetadataTable(
+            np.asarray(self.page_index)[rows],
+            self.pages,
+            self.title_ranks,
+            np.asarray(self.dates)[rows],
+            np.asarray(self.source_codes)[rows],
+            self.sources,
+            np.asarray(self.chunks)[rows],
+            np.asarray(self.token_counts)[rows],
+            self.tokenizers,
+            self.extras.take(rows),
+        )
+
+    def update(self, metadatas: Mapping[int, dict]) -> "MetadataTable":
+        """This table with the rows of the given doc ids replaced by their new metadata dicts."""
+        updated = MetadataTable.concatenate(self, MetadataTable.build(metadatas.values()))
+        rows = np.arange(len(self), dtype=np.int64)
+        rows[np.fromiter(metadatas, dtype=np.int64, count=len(metadatas))] = np.arange(len(self), len(updated), dtype=np.int64)
+        return updated.take(rows)
+
+    def sort(self, doc_ids: np.ndarray, by: str = "relevance") -> np.ndarray:
+        """Stable order of `doc_ids` (given best first) by newest date or by title; relevance keeps them as they are."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if by == "relevance":
+            return np.arange(len(doc_ids))
+        if by == "date":
+            return np.argsort(-self.dates[doc_ids].astype(np.int64), kind="stable")
+        if by == "title":
+            return np.argsort(self.title_ranks[self.page_index[doc_ids]], kind="stable")
+        raise ValueError(f"Cannot sort by '{by}', expected one of {SORT_KEYS}.")
+
+    def facet(self, doc_ids: np.ndarray, by: str) -> Dict[str, int]:
+        """Number of `doc_ids` per data source or per year, most frequent first."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if by == "data_source":
+            labels, codes = self.sources, self.source_codes[doc_ids]
+        elif by == "year":
+            dates = self.dates[doc_ids]
+            dates = dates[dates != MISSING_DATE]
+            years = dates.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+            labels, codes = np.unique(years, return_inverse=True)
+            labels = [str(year) for year in labels.tolist()]
+        else:
+            raise ValueError(f"Cannot facet by '{by}', expected one of {FACETS}.")
+        counts = np.bincount(np.asarray(codes, dtype=np.int64).ravel(), minlength=len(labels))
+        order = np.argsort(-counts, kind="stable")
+        return {labels[i]: int(counts[i]) for i in order.tolist() if counts[i]}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {
+            "page_index": self.page_index,
+            "title_ranks": self.title_ranks,
+            "dates": self.dates,
+            "source_codes": self.source_codes,
+            "chunks": self.chunks,
+            "token_counts": self.token_counts,
+        }
+        for name, strings in [*self.pages.items(), ("extras", self.extras)]:
+            arrays[f"{name}_offsets"] = strings.offsets
+            arrays[f"{name}_data"] = strings.data
+        return arrays
+
+    def meta(self) -> dict:
+        return {"num_docs": len(self), "sources": self.sources, "tokenizers": self.tokenizers}
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], meta: dict) -> "MetadataTable":
+        strings = lambda name: PackedStrings(arrays[f"{name}_offsets"], arrays[f"{name}_data"])
+        return cls(
+            arrays["page_index"],
+            {name: strings(name) for name in PAGE_COLUMNS},
+            arrays["title_ranks"],
+            arrays["dates"],
+            arrays["source_codes"],
+            meta["sources"],
+            arrays["chunks"],
+            arrays["token_counts"],
+            meta["tokenizers"],
+            strings("extras"),
+        )
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in self.arrays().items():
+            atomic_save(path / f"{name}.npy", np.asarray(array))
+        atomic_write_json(path / "table.json", self.meta())
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "MetadataTable":
+        path = Path(path)
+        with open(path / "table.json") as f:
+            meta = json.load(f)
+        arrays = {file.stem: np.load(file, mmap_mode="r") for file in path.glob("*.npy")}
+        return cls.from_arrays(arrays, meta)
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        return (Path(path) / "table.json").exists()
@@ -1,13 +1,23 @@
+import hashlib
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from langchain.prompts.prompt import PromptTemplate
 from loguru import logger
 from typing import List
+import numpy as np
 from pydantic import BaseModel
 
-from core.dependencies import get_model_information
+from core.dependencies import get_cached_model_information
 from core.settings import settings, openai_async_client
+from core.tokens import tokenizer_name
+
+QA_PROMPT_TEMPLATE = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
 
 class ConversationHandler(BaseModel):
     model: str
@@ -16,25 +26,27 @@ class ConversationHandler(BaseModel):
     api_token: str = "EMPTY"
 
     def format_docs(self, documents: List[Document]):
-        llm = self._get_llm()
-        model_context_length = get_model_information(self.model)["loader_params"]["max_context_length"]
-
-        def _reduce_tokens_below_limit(max_tokens_limit: int, docs: List[Document], llm) -> List[Document]:
-            num_docs = len(docs)
-
-            tokens = [
-                llm.get_num_tokens(doc.page_content)
-                for doc in docs
-            ]
-            token_count = sum(tokens[:num_docs])
-            while token_count > max_tokens_limit:
-                num_docs -= 1
-                token_count -= tokens[num_docs]
-
+        model_information = get_cached_model_information(self.model)
+        model_context_length = model_information["loader_params"]["max_context_length"]
+        tokenizer_params = model_information.get("tokenizer_params")
+        tokenizer = tokenizer_name(tokenizer_params) if tokenizer_params else None
+
+        def _reduce_tokens_below_limit(max_tokens_limit: int, docs: List[Document]) -> List[Document]:
+            # token counts recorded at ingestion; the LLM only counts docs indexed without them
+            tokens = [doc.metadata.get("token_counts", {}).get(tokenizer) for doc in docs]
+            if None in tokens:
+                llm = self._get_llm()
+                tokens = [llm.get_num_tokens(doc.page_content) if count is None else count for doc, count in zip(docs, tokens)]
+            # longest prefix of the ranking that fits the limit
+            num_docs = int(np.searchsorted(np.cumsum(tokens), max_tokens_limit, side="right"))
             return docs[:num_docs]
         
         max_tokens_limit = model_context_length - self.max_tokens - 10
-        return "\n\n".join(doc.page_content for doc in _reduce_tokens_below_limit(max_tokens_limit, documents, llm))
+        return "\n\n".join(doc.page_content for doc in _reduce_tokens_below_limit(max_tokens_limit, documents))
+
+    def prompt_hash(self) -> str:
+        """Changes with the QA prompt template, so answers cached with a previous prompt are not served."""
+        return hashlib.sha256(QA_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()
 
     def get_rag_chain(self):
         qa_prompt = self._get_qa_prompt()
@@ -94,13 +106,7 @@ class ConversationHandler(BaseModel):
     def _get_qa_prompt(self):
         """Constructs the prompt to use for question answering."""
         messages = []
-        qa_prompt_template = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-{context}
-
-Question: {question}
-Helpful Answer:"""
-        messages.append(HumanMessagePromptTemplate(prompt=PromptTemplate.from_template(qa_prompt_template)))
+        messages.append(HumanMessagePromptTemplate(prompt=PromptTemplate.from_template(QA_PROMPT_TEMPLATE)))
         qa_prompt = ChatPromptTemplate.from_messages(messages)
         logger.debug(f"Prompt template '{qa_prompt}'")
         return qa_prompt
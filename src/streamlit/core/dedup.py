@@ -0,0 +1,187 @@
+import json
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+
+from core.bm25 import tokenize
+from core.files import atomic_save, atomic_write_json
+from core.filters import contains
+
+EMPTY_HASH = np.uint32((1 << 32) - 1)
+
+def shingle_hashes(text: str, shingle_size: int = 3) -> np.ndarray:
+    """Distinct crc32 hashes of the word `shingle_size`-grams of a text (the whole text if it is shorter)."""
+    tokens = tokenize(text)
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    shingles = {" ".join(tokens[i:i + shingle_size]) for i in range(max(len(tokens) - shingle_size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+def first_occurrences(values: np.ndarray) -> np.ndarray:
+    """Sorted positions of the first occurrence of every distinct value, i.e. what survives collapsing repeats."""
+    _, first = np.unique(values, return_index=True)
+    return np.sort(first)
+
+def live_top_k(
+    top_k: Callable[[int, Optional[np.ndarray]], Tuple[np.ndarray, np.ndarray]],
+    k: int,
+    allowed_ids: Optional[np.ndarray],
+    tombstones: np.ndarray,
+    cluster_ids: Optional[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs a retriever's `top_k(k, allowed_ids)` without tombstoned docs and with near-duplicates
+    collapsed to their best scoring doc. Tombstones are removed from the allowed ids, or, unfiltered,
+    the retriever over-fetches by the number of tombstones and they are dropped from its results.
+    If collapsing leaves fewer than k docs, the retriever is asked for twice as many, so the result
+    is still the exact top-k over distinct clusters.
+    """
+    if len(tombstones) and allowed_ids is not None:
+        allowed_ids = allowed_ids[~contains(tombstones, allowed_ids)]
+        tombstones = tombstones[:0]
+    fetch_k = k + len(tombstones)
+    while True:
+        doc_ids, scores = top_k(fetch_k, allowed_ids)
+        exhausted = len(doc_ids) < fetch_k
+        if len(tombstones):
+            live = ~contains(tombstones, doc_ids)
+            doc_ids, scores = doc_ids[live], scores[live]
+        if cluster_ids is not None:
+            distinct = first_occurrences(cluster_ids[doc_ids])
+            doc_ids, scores = doc_ids[distinct], scores[distinct]
+        if len(doc_ids) >= k or exhausted or cluster_ids is None:
+            return doc_ids[:k], scores[:k]
+        fetch_k *= 2
+
+class MinHasher:
+    """
+    MinHash signatures of texts' word shingles: the fraction of equal signature slots of two texts
+    estimates the Jaccard similarity of their shingle sets. Permutations are multiply-shift hashes
+    `((a * x + b) mod 2^64) >> 32` drawn from a fixed seed, so signatures are comparable across runs.
+    """
+
+    def __init__(self, num_permutations: int = 64, shingle_size: int = 3, seed: int = 0):
+        self.num_permutations = num_permutations
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 1 << 63, size=num_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_permutations, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) == 0:
+            return np.full(self.num_permutations, EMPTY_HASH, dtype=np.uint32)
+        # uint64 arithmetic wraps around, which is the mod 2^64
+        permuted = (hashes[:, None] * self.a + self.b) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str]) -> np.ndarray:
+        signatures = [self.signature(text) for text in texts]
+        if not signatures:
+            return np.empty((0, self.num_permutations), dtype=np.uint32)
+        return np.stack(signatures)
+
+def cluster_signatures(
+    signatures: np.ndarray,
+    num_bands: int = 8,
+    threshold: float = 0.8,
+    live: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Near-duplicate clusters by LSH banding: docs whose signatures agree on every slot of some band
+    share a bucket, and each is joined with the first doc of its bucket if their estimated Jaccard
+    similarity reaches `threshold`. With 8 bands of 8 slots, pairs at 0.8 similarity collide with
+    ~0.98 probability and pairs at 0.5 with ~0.03. Returns, per doc, the smallest doc id of its
+    cluster; docs that are not `live` (tombstoned) or empty stay on their own.
+    """
+    num_docs, num_permutations = signatures.shape
+    rows = num_permutations // num_bands
+    parents = np.arange(num_docs)
+
+    def find(doc_id: int) -> int:
+        while parents[doc_id] != doc_id:
+            parents[doc_id] = parents[parents[doc_id]]
+            doc_id = parents[doc_id]
+        return doc_id
+
+    valid = ~(signatures == EMPTY_HASH).all(axis=1)
+    if live is not None:
+        valid &= live
+    doc_ids = np.flatnonzero(valid)
+    for band in range(num_bands):
+        keys = np.ascontiguousarray(signatures[doc_ids, band * rows:(band + 1) * rows])
+        _, first, inverse = np.unique(keys.view(np.dtype((np.void, rows * keys.itemsize))).ravel(), return_index=True, return_inverse=True)
+        leaders = doc_ids[first[inverse.ravel()]]
+        members = np.flatnonzero(leaders != doc_ids)
+        if len(members) == 0:
+            continue
+        similarities = (signatures[doc_ids[members]] == signatures[leaders[members]]).mean(axis=1)
+        for doc_id, leader in zip(doc_ids[members][similarities >= threshold].tolist(), leaders[members][similarities >= threshold].tolist()):
+            root, leader_root = find(doc_id), find(leader)
+            if root != leader_root:
+                parents[max(root, leader_root)] = min(root, leader_root)
+
+    # pointer jumping down to the roots, which are always the smallest id of their tree
+    while True:
+        grandparents = parents[parents]
+        if np.array_equal(grandparents, parents):
+            return parents.astype(np.int64)
+        parents = grandparents
+
+class DedupWriter:
+    """
+    Appends the MinHash signature of every indexed chunk to `signatures.bin` and, on `close`,
+    clusters all of them into `cluster_ids.npy`: the representative doc id of each doc id, which
+    search uses to collapse near-duplicate results.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        append: bool = False,
+        num_docs: Optional[int] = None,
+        num_bands: int = 8,
+        threshold: float = 0.8,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        params = {"num_permutations": 64, "shingle_size": 3, "seed": 0, "num_bands": num_bands, "threshold": threshold}
+        if append and (self.path / "dedup.json").exists():
+            with open(self.path / "dedup.json") as f:
+                params = {**json.load(f), "threshold": threshold}
+        self.params = params
+        self.hasher = MinHasher(params["num_permutations"], params["shingle_size"], params["seed"])
+        self._file = open(self.path / "signatures.bin", "ab" if append else "wb")
+        self.num_docs = self._file.tell() // (params["num_permutations"] * 4)
+        if num_docs is not None and num_docs < self.num_docs:
+            # signatures written by an interrupted run
+            self._file.truncate(num_docs * params["num_permutations"] * 4)
+            self.num_docs = num_docs
+
+    def add(self, texts: List[str]):
+        self._file.write(self.hasher.signatures(texts).tobytes())
+        self.num_docs += len(texts)
+
+    def close(self, tombstones: Optional[np.ndarray] = None) -> np.ndarray:
+        self._file.close()
+        signatures = np.fromfile(self.path / "signatures.bin", dtype=np.uint32).reshape(-1, self.params["num_permutations"])
+        live = np.ones(len(signatures), dtype=bool)
+        if tombstones is not None:
+            live[tombstones[tombstones < len(live)]] = False
+        cluster_ids = cluster_signatures(signatures, self.params["num_bands"], self.params["threshold"], live)
+        atomic_save(self.path / "cluster_ids.npy", cluster_ids)
+        atomic_write_json(self.path / "dedup.json", self.params)
+        return cluster_ids
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        return (Path(path) / "cluster_ids.npy").exists()
+
+def load_cluster_ids(path: Union[str, Path]) -> np.ndarray:
+    return np.load(Path(path) / "cluster_ids.npy", mmap_mode="r")
+
+def cluster_stats(cluster_ids: np.ndarray) -> Dict[str, int]:
+    num_clusters = int(np.count_nonzero(cluster_ids == np.arange(len(cluster_ids))))
+    return {"num_docs": len(cluster_ids), "num_clusters": num_clusters, "num_duplicates": len(cluster_ids) - num_clusters}
@@ -0,0 +1,59 @@
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+from core.ranking import top_k
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalises rows so that a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def top_k_among(embeddings: np.ndarray, query: np.ndarray, k: int, doc_ids: np.ndarray, block_size: int = 4096) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k restricted to the sorted `doc_ids` (used for filter pushdown), gathering and scoring
+    the rows block by block. `embeddings` may be any matrix-like that supports fancy indexing.
+    """
+    scores = np.empty(len(doc_ids), dtype=np.float32)
+    for start in range(0, len(doc_ids), block_size):
+        scores[start:start + block_size] = embeddings[doc_ids[start:start + block_size]] @ query
+    best = top_k(scores, k)
+    return doc_ids[best], scores[best]
+
+class DenseIndex:
+    """Exact (brute-force) cosine similarity search over a contiguous float32 embedding matrix."""
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    @property
+    def num_docs(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray) -> "DenseIndex":
+        return cls(np.ascontiguousarray(normalize(np.asarray(embeddings, dtype=np.float32))))
+
+    def score(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every document, as a single matmul."""
+        return self.embeddings @ normalize(np.asarray(query_vector, dtype=np.float32))
+
+    def top_k(self, query_vector: np.ndarray, k: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids and cosine similarities of the k nearest documents (among `allowed_ids` if given), best first."""
+        if allowed_ids is not None:
+            return top_k_among(self.embeddings, normalize(np.asarray(query_vector, dtype=np.float32)), k, allowed_ids)
+        scores = self.score(query_vector)
+        best = top_k(scores, k)
+        return best, scores[best]
+
+    def save(self, path: str):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        np.save(Path(path) / "embeddings.npy", self.embeddings)
+
+    @classmethod
+    def load(cls, path: str) -> "DenseIndex":
+        return cls(np.ascontiguousarray(np.load(Path(path) / "embeddings.npy")))
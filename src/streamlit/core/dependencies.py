@@ -1,6 +1,9 @@
+from typing import Dict
 from loguru import logger
 from core.settings import settings, requests_session
 
+_model_information: Dict[str, dict] = {}
+
 def get_model_information(model_name):
     if settings.openai_api_service == "openai":
         # default gpt-3.5-turbo context length
@@ -23,3 +26,12 @@ def get_model_information(model_name):
         logger.error(response.text)
         return None
     return response.json()
+
+def get_cached_model_information(model_name):
+    """`get_model_information`, fetched once per model (failures are retried on the next call)."""
+    if model_name not in _model_information:
+        information = get_model_information(model_name)
+        if information is None:
+            return None
+        _model_information[model_name] = information
+    return _model_information[model_name]
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Union
+import numpy as np
+
+from core.files import atomic_save, atomic_write_json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("zstd", "zlib")
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+def compress(codec: str, data: bytes, level: int = 3) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        # a decompressor is cheap to create and not safe to share between threads
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+class BlockStore:
+    """
+    Read-only strings addressed by doc id, compressed in blocks of up to `docs_per_block`
+    consecutive docs (zstd, or zlib without the `zstandard` package). `block_starts` holds the first
+    doc id of every block (blocks are shorter where an ingestion ended), `block_offsets` locates
+    every block in `data` and `ends` holds where each doc ends within its decompressed block, so a
+    fetch decompresses a single block. The `cache_blocks` most recently used decompressed blocks are
+    kept, which serves the consecutive chunks of a page and repeated fetches of the same results.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        block_offsets: np.ndarray,
+        ends: np.ndarray,
+        docs_per_block: int,
+        codec: str,
+        as_json: bool = False,
+        cache_blocks: int = 256,
+        block_starts: Optional[np.ndarray] = None,
+    ):
+        if codec == "zstd" and zstandard is None:
+            raise RuntimeError("The document store is zstd-compressed, install the 'zstandard' package to read it.")
+        self.data = data
+        self.block_offsets = block_offsets
+        self.ends = ends
+        self.docs_per_block = docs_per_block
+        # stores written before blocks could be appended only have full blocks
+        self.block_starts = block_starts if block_starts is not None else np.arange(0, len(ends), docs_per_block, dtype=np.int64)
+        self.codec = codec
+        self.as_json = as_json
+        self.cache_blocks = cache_blocks
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.block_offsets.nbytes + self.ends.nbytes + self.block_starts.nbytes
+
+    def _block(self, block: int) -> bytes:
+        with self._lock:
+            data = self._cache.get(block)
+            if data is not None:
+                self.hits += 1
+                self._cache.move_to_end(block)
+                return data
+            self.misses += 1
+        data = decompress(self.codec, self.data[self.block_offsets[block]:self.block_offsets[block + 1]].tobytes())
+        with self._lock:
+            self._cache[block] = data
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, doc_id: int):
+        doc_id = int(doc_id)
+        if not 0 <= doc_id < len(self.ends):
+            raise IndexError(doc_id)
+        block = int(np.searchsorted(self.block_starts, doc_id, side="right")) - 1
+        start = int(self.ends[doc_id - 1]) if doc_id != self.block_starts[block] else 0
+        value = self._block(block)[start:int(self.ends[doc_id])].decode("utf-8")
+        return json.loads(value) if self.as_json else value
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "cached_blocks": len(self._cache)}
+
+    @classmethod
+    def open(cls, path: Union[str, Path], as_json: bool = False, cache_blocks: int = 256) -> "BlockStore":
+        path = Path(path)
+        with open(path / "store.json") as f:
+            params = json.load(f)
+        block_offsets = np.load(path / "block_offsets.npy", mmap_mode="r")
+        # blocks are appended to `data.bin` in place, so only the committed bytes are mapped
+        size = int(block_offsets[-1])
+        # an empty file cannot be memory-mapped
+        data = np.memmap(path / "data.bin", dtype=np.uint8, mode="r", shape=(size,)) if size else np.empty(0, dtype=np.uint8)
+        return cls(
+            data,
+            block_offsets,
+            np.load(path / "ends.npy", mmap_mode="r"),
+            params["docs_per_block"],
+            params["codec"],
+            as_json=as_json,
+            cache_blocks=cache_blocks,
+            block_starts=np.load(path / "block_starts.npy", mmap_mode="r") if (path / "block_starts.npy").exists() else None,
+        )
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        return (Path(path) / "store.json").exists()
+
+class BlockStoreWriter:
+    """
+    Compresses strings block by block into `data.bin`. The files replace those of an existing store
+    on `close`, `store.json` last, so readers keep the previous store (and its memory maps) until then.
+
+    With `num_docs`, the first `num_docs` docs of the existing store are kept (in its codec) and new
+    blocks are appended to its `data.bin` after theirs, so only the new docs are compressed; readers
+    only map the bytes of the blocks committed by `close`.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        codec: Optional[str] = None,
+        docs_per_block: int = 16,
+        level: int = 3,
+        num_docs: Optional[int] = None,
+    ):
+        existing = BlockStore.open(path) if num_docs and BlockStore.exists(path) else None
+        if existing is not None:
+            codec = existing.codec
+        codec = codec or default_codec()
+        if codec not in CODECS:
+            raise ValueError(f"Document store codec '{codec}' not supported.")
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("The 'zstandard' package is required for zstd compression.")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.docs_per_block = docs_per_block
+        self.level = level
+        self._block_offsets = [0]
+        self._block_starts = []
+        self._ends = []
+        self._block = []
+        self._block_length = 0
+        if existing is not None and len(existing):
+            num_docs = min(num_docs, len(existing))
+            # whole blocks are kept, the kept docs of a cut block are compressed again
+            block_ends = np.append(np.asarray(existing.block_starts[1:]), len(existing))
+            kept_blocks = int(np.searchsorted(block_ends, num_docs, side="right"))
+            cut_start = int(block_ends[kept_blocks - 1]) if kept_blocks else 0
+            cut = [existing[doc_id] for doc_id in range(cut_start, num_docs)]
+            self._block_offsets = np.asarray(existing.block_offsets[:kept_blocks + 1]).tolist()
+            self._block_starts = np.asarray(existing.block_starts[:kept_blocks]).tolist()
+            self._ends = np.asarray(existing.ends[:cut_start]).tolist()
+            self._data_path = self.path / "data.bin"
+            self._file = open(self._data_path, "r+b")
+            # drops the blocks past the kept ones, which no reader maps
+            self._file.truncate(self._block_offsets[-1])
+            self._file.seek(self._block_offsets[-1])
+            for value in cut:
+                self.add(value)
+        else:
+            self._data_path = self.path / "data.bin.tmp"
+            self._file = open(self._data_path, "wb")
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def add(self, value: str):
+        encoded = value.encode("utf-8")
+        if not self._block:
+            self._block_starts.append(len(self._ends))
+        self._block.append(encoded)
+        self._block_length += len(encoded)
+        self._ends.append(self._block_length)
+        if len(self._block) == self.docs_per_block:
+            self._flush()
+
+    def _flush(self):
+        if self._block:
+            compressed = compress(self.codec, b"".join(self._block), self.level)
+            self._file.write(compressed)
+            self._block_offsets.append(self._block_offsets[-1] + len(compressed))
+            self._block, self._block_length = [], 0
+
+    def close(self):
+        self._flush()
+        self._file.close()
+        if self._data_path != self.path / "data.bin":
+            os.replace(self._data_path, self.path / "data.bin")
+        atomic_save(self.path / "block_offsets.npy", np.array(self._block_offsets, dtype=np.int64))
+        atomic_save(self.path / "block_starts.npy", np.array(self._block_starts, dtype=np.int64))
+        atomic_save(self.path / "ends.npy", np.array(self._ends, dtype=np.uint32))
+        atomic_write_json(self.path / "store.json", {
+            "num_docs": len(self._ends),
+            "docs_per_block": self.docs_per_block,
+            "codec": self.codec,
+        })
@@ -0,0 +1,199 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from langchain_core.documents import Document
+
+from core.columns import MetadataTable
+from core.doc_store import BlockStore, BlockStoreWriter
+
+DOC_TABLE_FILENAME = "docs.jsonl"
+# metadata of rows updated in place, one {"doc_id", "metadata"} line per update, the last one wins
+DOC_UPDATES_FILENAME = "doc_updates.jsonl"
+DOC_STORE_DIRNAME = "doc_store"
+METADATA_DIRNAME = "metadata"
+
+class DocTable:
+    """
+    Maps the integer doc ids used by the search indexes back to langchain Documents. Page contents
+    are any sequence indexed by doc id: a list, or the compressed `BlockStore` of the doc store,
+    which only decompresses the rows that are fetched. Metadata is held in a columnar
+    `MetadataTable` (built from dicts if given as such), so Documents are only materialized by `get`.
+    """
+
+    def __init__(self, page_contents: Sequence[str], metadatas: Union[MetadataTable, Sequence[dict]]):
+        self.page_contents = page_contents
+        self.metadatas = metadatas if isinstance(metadatas, MetadataTable) else MetadataTable.build(metadatas)
+
+    def __len__(self) -> int:
+        return len(self.page_contents)
+
+    def get(self, doc_ids: Sequence[int]) -> List[Document]:
+        return [
+            Document(
+                page_content=self.page_contents[doc_id],
+                metadata={**self.metadatas[doc_id], "doc_id": int(doc_id)},
+            ) for doc_id in doc_ids
+        ]
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "DocTable":
+        page_contents, metadatas = [], []
+        for document in documents:
+            page_contents.append(document.page_content)
+            metadatas.append(dict(document.metadata))
+        return cls(page_contents, metadatas)
+
+    def save(self, index_dir: str):
+        Path(index_dir).mkdir(parents=True, exist_ok=True)
+        with open(Path(index_dir) / DOC_TABLE_FILENAME, "w") as f:
+            for page_content, metadata in zip(self.page_contents, self.metadatas):
+                f.write(json.dumps({"page_content": page_content, "metadata": metadata}) + "\n")
+        (Path(index_dir) / DOC_UPDATES_FILENAME).unlink(missing_ok=True)
+
+    @staticmethod
+    def writer(
+        index_dir: str,
+        append: bool = False,
+        num_docs: Optional[int] = None,
+        offset: Optional[int] = None,
+        updates_offset: Optional[int] = None,
+    ) -> "DocTableWriter":
+        return DocTableWriter(index_dir, append=append, num_docs=num_docs, offset=offset, updates_offset=updates_offset)
+
+    @classmethod
+    def load(cls, index_dir: str, cache_blocks: int = 256) -> "DocTable":
+        """Opens the doc store and metadata columns if the index has them, otherwise parses the whole JSONL doc table into memory."""
+        store_dir = Path(index_dir) / DOC_STORE_DIRNAME
+        if BlockStore.exists(store_dir / "page_contents") and MetadataTable.exists(Path(index_dir) / METADATA_DIRNAME):
+            return cls(
+                BlockStore.open(store_dir / "page_contents", cache_blocks=cache_blocks),
+                MetadataTable.load(Path(index_dir) / METADATA_DIRNAME),
+            )
+        page_contents, metadatas = [], []
+        for row in read_doc_table(index_dir):
+            page_contents.append(row["page_content"])
+            metadatas.append(row["metadata"])
+        return cls(page_contents, metadatas)
+
+def read_doc_updates(index_dir: str, offset: int = 0) -> Dict[int, dict]:
+    """Latest metadata of every doc id updated in place, by the updates from byte `offset` of their log on."""
+    path = Path(index_dir) / DOC_UPDATES_FILENAME
+    updates = {}
+    if path.exists():
+        with open(path) as f:
+            f.seek(offset)
+            for line in f:
+                row = json.loads(line)
+                updates[row["doc_id"]] = row["metadata"]
+    return updates
+
+def read_doc_table(index_dir: str) -> Iterator[dict]:
+    """Rows of the JSONL doc table, with their metadata updates applied."""
+    updates = read_doc_updates(index_dir)
+    with open(Path(index_dir) / DOC_TABLE_FILENAME) as f:
+        for doc_id, line in enumerate(f):
+            row = json.loads(line)
+            if doc_id in updates:
+                row["metadata"] = updates[doc_id]
+            yield row
+
+def write_doc_store(
+    index_dir: str,
+    codec: Optional[str] = None,
+    docs_per_block: int = 16,
+    num_docs: int = 0,
+    offset: int = 0,
+    updates_offset: int = 0,
+):
+    """
+    (Re)builds the compressed doc store and the metadata columns of an index from its JSONL doc
+    table. With `num_docs`, the first `num_docs` docs of the existing store and columns are kept and
+    only the doc table rows from byte `offset` on (where the kept rows end) are added, and the
+    kept rows get the metadata updates logged from byte `updates_offset` on.
+    """
+    store_dir = Path(index_dir) / DOC_STORE_DIRNAME / "page_contents"
+    metadata_dir = Path(index_dir) / METADATA_DIRNAME
+    existing = None
+    if num_docs and MetadataTable.exists(metadata_dir):
+        existing = MetadataTable.load(metadata_dir)
+    page_contents = BlockStoreWriter(store_dir, codec, docs_per_block, num_docs=num_docs if existing is not None else None)
+    if existing is None or len(page_contents) != num_docs or len(existing) < num_docs:
+        # nothing (consistent) to keep, so everything is rebuilt
+        existing, num_docs, offset, updates_offset = None, 0, 0, 0
+        page_contents = BlockStoreWriter(store_dir, codec, docs_per_block)
+    updates = read_doc_updates(index_dir, updates_offset)
+
+    def metadatas() -> Iterable[dict]:
+        with open(Path(index_dir) / DOC_TABLE_FILENAME) as f:
+            f.seek(offset)
+            for doc_id, line in enumerate(f, start=num_docs):
+                row = json.loads(line)
+                page_contents.add(row["page_content"])
+                yield updates.get(doc_id, row["metadata"])
+
+    metadata_table = MetadataTable.build(metadatas())
+    if existing is not None:
+        kept = existing.head(num_docs)
+        kept_updates = {doc_id: metadata for doc_id, metadata in updates.items() if doc_id < num_docs}
+        if kept_updates:
+            kept = kept.update(kept_updates)
+        metadata_table = MetadataTable.concatenate(kept, metadata_table)
+    page_contents.close()
+    metadata_table.save(metadata_dir)
+
+class DocTableWriter:
+    """
+    Streams rows into the doc table file, so the documents never have to be held in memory together.
+    Rows are never rewritten: `update` logs a row's new metadata to the updates file instead.
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        append: bool = False,
+        num_docs: Optional[int] = None,
+        offset: Optional[int] = None,
+        updates_offset: Optional[int] = None,
+    ):
+        """
+        With `append`, rows past the first `num_docs` (written by an interrupted run) are dropped:
+        the file is cut at `offset` if the byte offset where those rows end is known, otherwise
+        rows are counted up to there. Likewise the updates log is cut at `updates_offset`.
+        """
+        path = Path(index_dir) / DOC_TABLE_FILENAME
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.num_docs = 0
+        if append and path.exists():
+            # doc ids are row numbers, so appended rows continue after the existing ones
+            with open(path, "r+b") as f:
+                if num_docs is not None and offset is not None:
+                    self.num_docs, end = num_docs, offset
+                else:
+                    end = 0
+                    for line in f:
+                        if self.num_docs == num_docs:
+                            break
+                        self.num_docs += 1
+                        end += len(line)
+                f.truncate(end)
+        self._file = open(path, "a" if append else "w")
+        updates_path = Path(index_dir) / DOC_UPDATES_FILENAME
+        if append and updates_offset is not None and updates_path.exists():
+            with open(updates_path, "r+b") as f:
+                f.truncate(updates_offset)
+        self._updates = open(updates_path, "a" if append else "w")
+        # where the rows and updates written by this writer start
+        self.offset, self.updates_offset = self._file.tell(), self._updates.tell()
+
+    def add(self, page_content: str, metadata: dict) -> int:
+        """Appends a row and returns its doc id."""
+        self._file.write(json.dumps({"page_content": page_content, "metadata": metadata}) + "\n")
+        self.num_docs += 1
+        return self.num_docs - 1
+
+    def update(self, doc_id: int, metadata: dict):
+        self._updates.write(json.dumps({"doc_id": int(doc_id), "metadata": metadata}) + "\n")
+
+    def close(self):
+        self._file.close()
+        self._updates.close()
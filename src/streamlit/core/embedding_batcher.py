@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into batched calls of `embed(texts, model)`.
+    A request waits at most `max_wait` seconds for others to join its batch, and a batch is sent
+    as soon as it holds `max_batch_size` texts; identical texts in a batch are embedded once.
+
+    Every Streamlit session runs its script in its own thread and event loop, so batches are
+    collected and sent on a private event loop thread that requests from any loop are handed to.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[List[str], Optional[str]], Awaitable[np.ndarray]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+    ):
+        self.embed = embed
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: Dict[Optional[str], List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_texts = 0
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def embed_query(self, text: str, model: Optional[str] = None) -> np.ndarray:
+        """Embedding of `text`, sent along with the other requests made meanwhile."""
+        future = asyncio.run_coroutine_threadsafe(self._submit(text, model), self._start())
+        return await asyncio.wrap_future(future)
+
+    async def _submit(self, text: str, model: Optional[str]) -> np.ndarray:
+        future = self._loop.create_future()
+        pending = self._pending.setdefault(model, [])
+        pending.append((text, future))
+        self.num_requests += 1
+        if len(pending) >= self.max_batch_size:
+            self._flush(model)
+        elif len(pending) == 1:
+            self._timers[model] = self._loop.call_later(self.max_wait, self._flush, model)
+        return await future
+
+    def _flush(self, model: Optional[str]):
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(model, [])
+        if batch:
+            # batches are sent concurrently, the next one is collected while this one is in flight
+            self._loop.create_task(self._send(model, batch))
+
+    async def _send(self, model: Optional[str], batch: List[Tuple[str, asyncio.Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.num_batches += 1
+        self.num_texts += len(texts)
+        try:
+            vectors = await self.embed(texts, model)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        rows = {text: vector for text, vector in zip(texts, vectors)}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(rows[text])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "mean_batch_size": self.num_texts / self.num_batches if self.num_batches else None,
+        }
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+                self._loop = self._thread = None
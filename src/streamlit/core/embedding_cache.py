@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+import numpy as np
+
+def normalize_text(text: str) -> str:
+    """Whitespace does not change a query, case is kept since cased embedding models embed it differently."""
+    return " ".join(text.split())
+
+class EmbeddingCache:
+    """
+    Query embeddings by embedding model and normalized text, in two tiers: an LRU of the
+    `max_entries` most recently used in memory, backed by a SQLite store at `path` shared by the
+    app's processes and kept across restarts (at most `max_disk_entries`, the oldest are deleted
+    beyond). Vectors are kept as raw float16 bytes, half the size of float32, which changes
+    cosine similarities by well under 1e-3.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_entries: int = 4096, max_disk_entries: int = 1_000_000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.connection = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.connection.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, text)
+                );
+                CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at);
+            """)
+            self._disk_entries = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """float32 embedding of the normalized `text` by `model`, if cached."""
+        key = (model, normalize_text(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self.memory_hits += 1
+                self._entries.move_to_end(key)
+                return vector.astype(np.float32)
+            row = None
+            if self.connection is not None:
+                row = self.connection.execute("SELECT vector FROM embeddings WHERE model = ? AND text = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            vector = np.frombuffer(row[0], dtype=np.float16)
+            self._remember(key, vector)
+            return vector.astype(np.float32)
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> np.ndarray:
+        """Caches the embedding and returns it as it will be served from cache, so cold and warm queries get the same vector."""
+        key = (model, normalize_text(text))
+        vector = np.asarray(vector, dtype=np.float16)
+        with self._lock:
+            self._remember(key, vector)
+            if self.connection is not None:
+                with self.connection:
+                    self.connection.execute("BEGIN")
+                    inserted = self.connection.execute(
+                        "INSERT OR IGNORE INTO embeddings (model, text, vector, created_at) VALUES (?, ?, ?, ?)",
+                        (*key, vector.tobytes(), time.time()),
+                    ).rowcount
+                    self._disk_entries += inserted
+                    if self._disk_entries > self.max_disk_entries:
+                        # another process may have inserted meanwhile, so the count is refreshed
+                        count = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                        self.connection.execute(
+                            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY created_at LIMIT ?)",
+                            (max(count - self.max_disk_entries, 0),),
+                        )
+                        self._disk_entries = min(count, self.max_disk_entries)
+        return vector.astype(np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "disk_entries": self._disk_entries if self.connection is not None else 0,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,175 @@
+import json
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np
+
+from core.dense import normalize, top_k_among
+from core.files import atomic_save, atomic_write_json
+from core.ranking import top_k
+
+STORE_DTYPES = ("float32", "float16", "int8")
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scalar-quantizes L2-normalised rows. int8 uses a per-vector scale (max |x| / 127);
+    float32/float16 are stored as-is with a unit scale.
+    """
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Embedding store dtype '{dtype}' not supported.")
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return codes, scales
+    return embeddings.astype(dtype), np.ones(len(embeddings), dtype=np.float32)
+
+class EmbeddingStore:
+    """
+    Read-only embedding matrix kept on disk and opened with `np.memmap`, so opening it is O(1) and
+    the pages are shared between processes through the OS page cache.
+
+    Rows are stored as float32, float16 or int8 codes with a per-vector float32 scale, and are
+    dequantized block by block while scoring so only one block is ever resident as float32.
+    """
+
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray, block_size: int = 4096):
+        self.vectors = vectors
+        self.scales = scales
+        self.block_size = block_size
+
+    @property
+    def num_docs(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.vectors.shape
+
+    @property
+    def dtype(self) -> str:
+        return self.vectors.dtype.name
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.scales.nbytes
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def __getitem__(self, doc_ids: Union[int, np.ndarray]) -> np.ndarray:
+        """Dequantized float32 rows, so the store can stand in for an in-memory embedding matrix."""
+        rows = np.asarray(self.vectors[doc_ids], dtype=np.float32)
+        scales = self.scales[doc_ids]
+        return rows * (scales[..., None] if rows.ndim > 1 else scales)
+
+    @classmethod
+    def write(cls, path: str, embeddings: np.ndarray, dtype: str = "float32") -> "EmbeddingStore":
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        codes, scales = quantize(normalize(np.asarray(embeddings, dtype=np.float32)), dtype)
+        vectors = np.memmap(path / "vectors.bin", dtype=codes.dtype, mode="w+", shape=codes.shape)
+        vectors[:] = codes
+        vectors.flush()
+        np.save(path / "scales.npy", scales)
+        with open(path / "store.json", "w") as f:
+            json.dump({"num_docs": codes.shape[0], "dim": codes.shape[1], "dtype": dtype}, f)
+        return cls.open(path)
+
+    @classmethod
+    def writer(cls, path: str, dtype: str = "float32", append: bool = False, num_docs: Optional[int] = None) -> "EmbeddingStoreWriter":
+        """Writer appending embeddings batch by batch, for inputs too large to hold in memory."""
+        return EmbeddingStoreWriter(path, dtype, append=append, num_docs=num_docs)
+
+    @classmethod
+    def open(cls, path: str) -> "EmbeddingStore":
+        path = Path(path)
+        with open(path / "store.json") as f:
+            params = json.load(f)
+        vectors = np.memmap(
+            path / "vectors.bin",
+            dtype=params["dtype"],
+            mode="r",
+            shape=(params["num_docs"], params["dim"]),
+        )
+        return cls(vectors, np.load(path / "scales.npy", mmap_mode="r"))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / "store.json").exists()
+
+    def score(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every stored vector."""
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = np.empty(self.num_docs, dtype=np.float32)
+        for start in range(0, self.num_docs, self.block_size):
+            end = min(start + self.block_size, self.num_docs)
+            block = self.vectors[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores[start:end] = block @ query
+        if self.vectors.dtype == np.int8:
+            scores *= self.scales
+        return scores
+
+    def top_k(self, query_vector: np.ndarray, k: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids and cosine similarities of the k nearest documents (among `allowed_ids` if given), best first."""
+        if allowed_ids is not None:
+            query = normalize(np.asarray(query_vector, dtype=np.float32))
+            return top_k_among(self, query, k, allowed_ids, block_size=self.block_size)
+        scores = self.score(query_vector)
+        best = top_k(scores, k)
+        return best, scores[best]
+
+class EmbeddingStoreWriter:
+    """
+    Appends normalised, quantized rows to `vectors.bin` as they arrive. `store.json` is only
+    written by `close`, so readers keep seeing the previous rows until then. With `append`, rows
+    are added after those of an existing store, whose dtype is kept, and only its first `num_docs`
+    rows are kept if given.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32", append: bool = False, num_docs: Optional[int] = None):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"Embedding store dtype '{dtype}' not supported.")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype
+        self.num_docs = 0
+        self.dim: Optional[int] = None
+        self._scales = []
+        if append and EmbeddingStore.exists(self.path):
+            existing = EmbeddingStore.open(self.path)
+            self.dtype, self.num_docs, self.dim = existing.dtype, existing.num_docs, existing.dim
+            if num_docs is not None:
+                self.num_docs = min(self.num_docs, num_docs)
+            self._scales.append(np.array(existing.scales[:self.num_docs]))
+            # drop rows written by an interrupted run after the last close
+            with open(self.path / "vectors.bin", "r+b") as f:
+                f.truncate(existing.vectors[:self.num_docs].nbytes)
+            self._vectors = open(self.path / "vectors.bin", "ab")
+        else:
+            (self.path / "store.json").unlink(missing_ok=True)
+            self._vectors = open(self.path / "vectors.bin", "wb")
+
+    def append(self, embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {embeddings.shape[1]}.")
+        codes, scales = quantize(normalize(embeddings), self.dtype)
+        self._vectors.write(codes.tobytes())
+        self._scales.append(scales)
+        self.num_docs += len(codes)
+
+    def close(self) -> EmbeddingStore:
+        self._vectors.close()
+        scales = np.concatenate(self._scales) if self._scales else np.empty(0, dtype=np.float32)
+        # readers of the previous store keep their memory maps of the replaced files
+        atomic_save(self.path / "scales.npy", scales)
+        atomic_write_json(self.path / "store.json", {"num_docs": self.num_docs, "dim": self.dim or 0, "dtype": self.dtype})
+        return EmbeddingStore.open(self.path)
@@ -0,0 +1,66 @@
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+from openai import AsyncOpenAI
+
+from core.embedding_batcher import EmbeddingBatcher
+from core.embedding_cache import EmbeddingCache, normalize_text
+from core.settings import settings, openai_async_client
+
+@lru_cache(maxsize=1)
+def get_embeddings_client() -> AsyncOpenAI:
+    """OpenAI-compatible client pointed at the configured `/embeddings` route."""
+    return AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_api_base,
+        http_client=openai_async_client,
+    )
+
+async def embed_texts(texts: List[str], model: Optional[str] = None) -> np.ndarray:
+    """Embeds `texts` in one request, returning a (len(texts), dim) float32 matrix."""
+    response = await get_embeddings_client().embeddings.create(
+        model=model or settings.embedding_model_id,
+        input=texts,
+    )
+    data = sorted(response.data, key=lambda item: item.index)
+    return np.array([item.embedding for item in data], dtype=np.float32)
+
+@lru_cache(maxsize=1)
+def get_embedding_batcher() -> Optional[EmbeddingBatcher]:
+    if settings.embedding_batch_size <= 1:
+        return None
+    return EmbeddingBatcher(
+        lambda texts, model: embed_texts(texts, model=model),
+        max_batch_size=settings.embedding_batch_size,
+        max_wait=settings.embedding_batch_wait_ms / 1000,
+    )
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    if settings.embedding_cache_size <= 0 and not settings.embedding_cache_path:
+        return None
+    return EmbeddingCache(
+        settings.embedding_cache_path or None,
+        max_entries=settings.embedding_cache_size,
+        max_disk_entries=settings.embedding_cache_disk_entries,
+    )
+
+async def embed_query(text: str, model: Optional[str] = None) -> np.ndarray:
+    """
+    Embeds one query: from the embedding cache if it was embedded before, otherwise batched with
+    the queries of the other sessions (unless batching is disabled).
+    """
+    model = model or settings.embedding_model_id
+    cache = get_embedding_cache()
+    if cache is not None:
+        vector = cache.get(model, text)
+        if vector is not None:
+            return vector
+        # the normalized text is embedded, so the cached vector is the one its key stands for
+        text = normalize_text(text)
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        vector = await batcher.embed_query(text, model=model)
+    else:
+        vector = (await embed_texts([text], model=model))[0]
+    return cache.put(model, text, vector) if cache is not None else vector
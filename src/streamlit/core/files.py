@@ -0,0 +1,45 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple, Union
+import numpy as np
+
+def atomic_save(path: Union[str, Path], array: np.ndarray):
+    """
+    np.save through a temporary file and a rename. Rewriting a file in place would truncate it under
+    readers that memory-mapped it (SIGBUS); a rename leaves them on the old inode.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def atomic_write_json(path: Union[str, Path], obj: Any):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def file_signature(path: Union[str, Path]) -> Optional[Tuple[int, int]]:
+    """(mtime in ns, size) of a file, or None if it does not exist: changes whenever the file is replaced or appended to."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+@contextmanager
+def file_lock(path: Union[str, Path]) -> Iterator[None]:
+    """Exclusive advisory lock held across processes (e.g. the ingestion job and the app) for the block."""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,129 @@
+import datetime
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+
+from core.files import atomic_save, atomic_write_json
+
+# documents without a date sort first and never fall inside a date range
+MISSING_DATE = np.iinfo(np.int32).min
+# below this fraction of allowed documents, approximate indexes score the allowed rows exactly instead
+EXACT_FILTER_SELECTIVITY = 0.1
+
+def to_day(value: Union[str, datetime.date, None]) -> int:
+    """Days since the Unix epoch for an ISO date string, a date or a datetime."""
+    if value is None or value == "":
+        return MISSING_DATE
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value[:10])
+    return (value - datetime.date(1970, 1, 1)).days
+
+def contains(sorted_ids: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+    """Boolean mask of which `doc_ids` are present in `sorted_ids`."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(doc_ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_ids, doc_ids), len(sorted_ids) - 1)
+    return sorted_ids[positions] == doc_ids
+
+class FilterIndex:
+    """
+    Per-document filter attributes laid out for pushdown into retrieval:
+
+    - `dates`: days since epoch per doc id, with `date_order` (doc ids sorted by date) and
+      `sorted_dates` so a date range becomes two binary searches and a contiguous slice;
+    - `source_bitmaps`: one packed bit array (np.packbits, 1 bit per doc id) per data source.
+    """
+
+    def __init__(self, dates: np.ndarray, sources: List[str], source_bitmaps: np.ndarray):
+        self.dates = dates
+        self.sources = sources
+        self.source_bitmaps = source_bitmaps
+        self.date_order = np.argsort(dates, kind="stable")
+        self.sorted_dates = dates[self.date_order]
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.dates)
+
+    @classmethod
+    def build(cls, metadatas: Sequence[dict]) -> "FilterIndex":
+        dates = np.fromiter((to_day(metadata.get("date")) for metadata in metadatas), dtype=np.int32, count=len(metadatas))
+        source_ids: Dict[str, int] = {}
+        doc_sources = np.fromiter(
+            (source_ids.setdefault(metadata.get("data_source", ""), len(source_ids)) for metadata in metadatas),
+            dtype=np.int32,
+            count=len(metadatas),
+        )
+        return cls.from_arrays(dates, doc_sources, list(source_ids))
+
+    @classmethod
+    def from_arrays(cls, dates: np.ndarray, doc_sources: np.ndarray, sources: List[str]) -> "FilterIndex":
+        """From per-doc days since epoch and indexes into `sources`, e.g. accumulated while streaming documents in."""
+        source_bitmaps = np.stack([
+            np.packbits(doc_sources == source_id) for source_id in range(len(sources))
+        ]) if sources else np.empty((0, 0), dtype=np.uint8)
+        return cls(np.asarray(dates, dtype=np.int32), sources, source_bitmaps)
+
+    def date_range_ids(self, start: Union[str, datetime.date], end: Union[str, datetime.date]) -> np.ndarray:
+        """Sorted doc ids dated within [start, end] (inclusive)."""
+        lo = np.searchsorted(self.sorted_dates, to_day(start), side="left")
+        hi = np.searchsorted(self.sorted_dates, to_day(end), side="right")
+        return np.sort(self.date_order[lo:hi])
+
+    def source_ids(self, data_source: str) -> np.ndarray:
+        """Sorted doc ids belonging to `data_source`."""
+        if data_source not in self.sources:
+            return np.empty(0, dtype=np.int64)
+        bitmap = np.unpackbits(self.source_bitmaps[self.sources.index(data_source)], count=self.num_docs)
+        return np.flatnonzero(bitmap)
+
+    def in_source(self, data_source: str, doc_ids: np.ndarray) -> np.ndarray:
+        """Bit test of `doc_ids` against the source bitmap, without unpacking the whole bitmap."""
+        if data_source not in self.sources:
+            return np.zeros(len(doc_ids), dtype=bool)
+        bitmap = self.source_bitmaps[self.sources.index(data_source)]
+        return ((bitmap[doc_ids >> 3] >> (7 - (doc_ids & 7))) & 1).astype(bool)
+
+    def allowed_ids(
+        self,
+        data_source: Optional[str] = None,
+        date_range: Optional[Sequence[Union[str, datetime.date]]] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Sorted doc ids passing the filters, or None when nothing is filtered. The date range is
+        resolved first since it is usually the narrower one, and the source bitmap is only probed
+        for the ids inside it.
+        """
+        if date_range:
+            start, end = date_range[0], date_range[-1]
+            doc_ids = self.date_range_ids(start, end)
+            if data_source is not None:
+                doc_ids = doc_ids[self.in_source(data_source, doc_ids)]
+            return doc_ids.astype(np.int64)
+        if data_source is not None and len(self.sources) > 1:
+            return self.source_ids(data_source).astype(np.int64)
+        if data_source is not None and data_source not in self.sources:
+            return np.empty(0, dtype=np.int64)
+        return None
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        # replaced atomically since a running app may have the previous files memory-mapped
+        atomic_save(path / "dates.npy", self.dates)
+        atomic_save(path / "source_bitmaps.npy", self.source_bitmaps)
+        atomic_write_json(path / "sources.json", self.sources)
+
+    @classmethod
+    def load(cls, path: str) -> "FilterIndex":
+        path = Path(path)
+        with open(path / "sources.json") as f:
+            sources = json.load(f)
+        return cls(np.load(path / "dates.npy"), sources, np.load(path / "source_bitmaps.npy", mmap_mode="r"))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / "sources.json").exists()
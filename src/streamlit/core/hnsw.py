@@ -0,0 +1,384 @@
+import heapq
+import json
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+from core.bm25 import sorted_union
+from core.dense import DenseIndex, normalize, top_k_among
+from core.files import atomic_save, atomic_write_json
+from core.filters import EXACT_FILTER_SELECTIVITY, contains
+from core.ivfpq import kmeans, nearest_centroids
+
+# the build finds each node's candidate neighbours by exact search within this many k-means cells
+# around its own, with cells of about BUILD_CELL_SIZE nodes (layers of fewer cells are searched exactly)
+BUILD_PROBES = 8
+BUILD_CELL_SIZE = 512
+# elements per NumPy temporary during the build, bounding its memory
+BUILD_BLOCK_ELEMENTS = 1 << 23
+# candidate vector elements per block of the neighbour selection, which reads them once per kept
+# neighbour: small enough to stay in cache across those reads
+SELECT_BLOCK_ELEMENTS = 1 << 18
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph over L2-normalised embeddings (Malkov & Yashunin).
+
+    The graph is stored as one CSR (indptr, neighbors) pair per layer, which is what gets saved and
+    searched. It is built one layer at a time with batched NumPy instead of inserting node by node:
+    every node's candidates (its nearest nodes in the layer and in each layer above) come from
+    blocked matrix products, neighbours are picked with the usual selection heuristic for all nodes
+    at once, and links are made bidirectional and pruned back to the degree bound.
+    `M` bounds the out-degree (2 * M on layer 0) and `ef_search` is the search beam width;
+    raising either trades latency for recall.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        layer_indptrs: List[np.ndarray],
+        layer_neighbors: List[np.ndarray],
+        entry_point: int,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+    ):
+        self.embeddings = embeddings
+        self.layer_indptrs = layer_indptrs
+        self.layer_neighbors = layer_neighbors
+        self.entry_point = entry_point
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    @property
+    def num_docs(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def max_level(self) -> int:
+        return len(self.layer_indptrs) - 1
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        seed: int = 0,
+    ) -> "HNSWIndex":
+        index = cls(
+            embeddings=np.ascontiguousarray(normalize(np.asarray(embeddings, dtype=np.float32))),
+            layer_indptrs=[],
+            layer_neighbors=[],
+            entry_point=-1,
+            M=M,
+            ef_construction=ef_construction,
+            ef_search=ef_search,
+        )
+        if index.num_docs == 0:
+            return index
+        rng = np.random.default_rng(seed)
+        level_mult = 1 / math.log(M)
+        node_levels = np.floor(-np.log(1 - rng.random(index.num_docs)) * level_mult).astype(int)
+        for layer in range(node_levels.max() + 1):
+            nodes = np.flatnonzero(node_levels >= layer)
+            upper_layers = [np.flatnonzero(node_levels >= upper) for upper in range(layer + 1, node_levels.max() + 1)]
+            indptr, neighbors = index._build_layer(nodes, upper_layers, 2 * M if layer == 0 else M, rng)
+            index.layer_indptrs.append(indptr)
+            index.layer_neighbors.append(neighbors)
+        index.entry_point = int(np.argmax(node_levels))
+        return index
+
+    def _build_layer(self, nodes: np.ndarray, upper_layers: List[np.ndarray], max_degree: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        CSR adjacency (over all node ids) of the layer holding `nodes`. Besides their
+        `ef_construction` nearest neighbours, nodes are offered the `ef_construction // 2` nearest
+        of every layer above (nested uniform samples, sparser and sparser) as candidates: in
+        clustered data the nearest neighbours all lie in the node's own cluster, and these longer
+        links keep the clusters connected, like the links a node-by-node build makes while the
+        graph is still sparse.
+        """
+        candidates, sims = self._candidate_neighbors(nodes, nodes, self.ef_construction, rng)
+        if len(upper_layers):
+            upper = [self._candidate_neighbors(nodes, upper_nodes, self.ef_construction // 2, rng) for upper_nodes in upper_layers]
+            candidates = np.hstack([candidates] + [upper_candidates for upper_candidates, _ in upper])
+            sims = np.hstack([sims] + [upper_sims for _, upper_sims in upper])
+            # the layers are nested, so a node can be offered more than once
+            order = np.argsort(candidates, axis=1, kind="stable")
+            candidates, sims = np.take_along_axis(candidates, order, axis=1), np.take_along_axis(sims, order, axis=1)
+            duplicate = np.zeros(candidates.shape, dtype=bool)
+            duplicate[:, 1:] = (candidates[:, 1:] == candidates[:, :-1]) & (candidates[:, 1:] >= 0)
+            candidates[duplicate], sims[duplicate] = -1, -np.inf
+            order = np.argsort(-sims, axis=1, kind="stable")
+            candidates, sims = np.take_along_axis(candidates, order, axis=1), np.take_along_axis(sims, order, axis=1)
+        selected = self._select_neighbors(candidates, sims, self.M)
+        sources = np.repeat(nodes, selected.shape[1])
+        targets = selected.ravel()
+        keep = targets >= 0
+        # every selected link is made bidirectional, like the reverse links of an insertion
+        edges = sorted_union([sources[keep] * self.num_docs + targets[keep], targets[keep] * self.num_docs + sources[keep]])
+        sources, targets = edges // self.num_docs, edges % self.num_docs
+        edge_sims = self._pair_similarities(sources, targets)
+        order = np.lexsort((-edge_sims, sources))
+        sources, targets, edge_sims = sources[order], targets[order], edge_sims[order]
+
+        # nodes left with more than `max_degree` links re-select among them, closest first
+        degrees = np.bincount(sources, minlength=self.num_docs)
+        overfull = np.flatnonzero(degrees > max_degree)
+        if len(overfull):
+            starts = np.cumsum(degrees) - degrees
+            ranks = np.arange(len(sources)) - starts[sources]
+            width = min(int(degrees.max()), max(self.ef_construction, max_degree))
+            rows = np.full(self.num_docs, -1, dtype=np.int64)
+            rows[overfull] = np.arange(len(overfull))
+            in_overfull = (rows[sources] >= 0) & (ranks < width)
+            links = np.full((len(overfull), width), -1, dtype=np.int64)
+            link_sims = np.full((len(overfull), width), -np.inf, dtype=np.float32)
+            links[rows[sources[in_overfull]], ranks[in_overfull]] = targets[in_overfull]
+            link_sims[rows[sources[in_overfull]], ranks[in_overfull]] = edge_sims[in_overfull]
+            pruned = self._select_neighbors(links, link_sims, max_degree).ravel()
+            keep = degrees[sources] <= max_degree
+            sources = np.concatenate([sources[keep], np.repeat(overfull, max_degree)[pruned >= 0]])
+            targets = np.concatenate([targets[keep], pruned[pruned >= 0]])
+            order = np.argsort(sources, kind="stable")
+            sources, targets = sources[order], targets[order]
+
+        indptr = np.zeros(self.num_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.num_docs), out=indptr[1:])
+        return indptr, targets.astype(np.int32)
+
+    def _candidate_neighbors(self, nodes: np.ndarray, pool: np.ndarray, k: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The (approximately) k nodes of `pool` most similar to every node, best first and excluding
+        the node itself, as node ids and similarities padded with -1 / -inf. Large pools are split
+        into k-means cells and each node is compared with the pool nodes of the `BUILD_PROBES`
+        cells closest to its own.
+        """
+        k = min(k, len(pool))
+        candidates = np.full((len(nodes), k), -1, dtype=np.int64)
+        sims = np.full((len(nodes), k), -np.inf, dtype=np.float32)
+        if k == 0:
+            return candidates, sims
+        num_cells = len(pool) // BUILD_CELL_SIZE
+        if num_cells <= BUILD_PROBES:
+            cells = [(np.arange(len(nodes)), pool)]
+        else:
+            pool_vectors = self.embeddings[pool]
+            sample = pool_vectors[rng.choice(len(pool), min(len(pool), 64 * num_cells), replace=False)]
+            centroids = kmeans(sample, num_cells, iterations=10, seed=int(rng.integers(1 << 31)))
+            node_cells = nearest_centroids(self.embeddings[nodes], centroids)
+            pool_cells = nearest_centroids(pool_vectors, centroids)
+            node_order, pool_order = np.argsort(node_cells, kind="stable"), np.argsort(pool_cells, kind="stable")
+            node_bounds = np.searchsorted(node_cells[node_order], np.arange(num_cells + 1))
+            pool_bounds = np.searchsorted(pool_cells[pool_order], np.arange(num_cells + 1))
+            centroid_norms = (centroids ** 2).sum(axis=1)
+            probes = np.argpartition(centroid_norms[None, :] - 2 * centroids @ centroids.T, BUILD_PROBES - 1, axis=1)[:, :BUILD_PROBES]
+            cells = (
+                (
+                    node_order[node_bounds[cell]:node_bounds[cell + 1]],
+                    pool[np.concatenate([pool_order[pool_bounds[probe]:pool_bounds[probe + 1]] for probe in probes[cell]])],
+                )
+                for cell in range(num_cells)
+            )
+
+        for rows, cell_pool in cells:
+            pool_vectors = self.embeddings[cell_pool]
+            # one extra in case the node itself is among its most similar
+            num_best = min(k + 1, len(cell_pool))
+            block_size = max(1, BUILD_BLOCK_ELEMENTS // max(len(cell_pool), 1))
+            for start in range(0, len(rows), block_size):
+                block = rows[start:start + block_size]
+                block_sims = self.embeddings[nodes[block]] @ pool_vectors.T
+                if num_best < len(cell_pool):
+                    best = np.argpartition(block_sims, len(cell_pool) - num_best, axis=1)[:, -num_best:]
+                else:
+                    best = np.broadcast_to(np.arange(len(cell_pool)), block_sims.shape)
+                best_ids, best_sims = cell_pool[best], np.take_along_axis(block_sims, best, axis=1)
+                best_sims[best_ids == nodes[block][:, None]] = -np.inf
+                ranked = np.argsort(-best_sims, axis=1, kind="stable")[:, :k]
+                best_ids, best_sims = np.take_along_axis(best_ids, ranked, axis=1), np.take_along_axis(best_sims, ranked, axis=1)
+                candidates[block, :best_ids.shape[1]] = np.where(np.isfinite(best_sims), best_ids, -1)
+                sims[block, :best_ids.shape[1]] = best_sims
+        return candidates, sims
+
+    def _pair_similarities(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """Similarity of every (source, target) node pair, computed in blocks."""
+        sims = np.empty(len(sources), dtype=np.float32)
+        block_size = max(1, BUILD_BLOCK_ELEMENTS // self.embeddings.shape[1])
+        for start in range(0, len(sources), block_size):
+            block = slice(start, start + block_size)
+            sims[block] = np.einsum("ij,ij->i", self.embeddings[sources[block]], self.embeddings[targets[block]])
+        return sims
+
+    def _select_neighbors(self, candidates: np.ndarray, sims: np.ndarray, m: int) -> np.ndarray:
+        """
+        Neighbour selection heuristic, for many nodes at once: walking each row of `candidates`
+        (similarity `sims` to that row's node, best first, -1 padded), keep a candidate only if it
+        is closer to the node than to every neighbour already kept, then top up with the closest
+        pruned candidates. Returns up to `m` neighbours per row, -1 padded.
+        """
+        num_rows, width = candidates.shape
+        selected = np.full((num_rows, m), -1, dtype=np.int64)
+        if width == 0:
+            return selected
+        block_size = max(1, SELECT_BLOCK_ELEMENTS // (width * self.embeddings.shape[1]))
+        columns = np.arange(width)
+        for start in range(0, num_rows, block_size):
+            block_candidates = candidates[start:start + block_size]
+            valid = block_candidates >= 0
+            kept = np.zeros(valid.shape, dtype=bool)
+            # state of the rows still selecting: their candidates' highest similarity to a neighbour
+            # kept so far, and the first column not walked yet (a candidate passed over stays
+            # pruned, as that similarity only grows)
+            active = np.arange(len(block_candidates))
+            active_valid = valid
+            block_sims = sims[start:start + block_size]
+            vectors = self.embeddings[np.maximum(block_candidates, 0)]
+            closest_kept = np.full(valid.shape, -np.inf, dtype=np.float32)
+            next_column = np.zeros(len(valid), dtype=np.int64)
+            for _ in range(m):
+                eligible = active_valid & (columns >= next_column[:, None]) & (closest_kept < block_sims)
+                found = eligible.any(axis=1)
+                if not found.any():
+                    break
+                if found.sum() < 0.75 * len(found):
+                    # rows with nothing left to keep drop out
+                    active, active_valid, block_sims, vectors, closest_kept, eligible, found = (
+                        array[found] for array in (active, active_valid, block_sims, vectors, closest_kept, eligible, found)
+                    )
+                column = np.argmax(eligible, axis=1)
+                kept[active[found], column[found]] = True
+                next_column = np.where(found, column + 1, width)
+                kept_vectors = vectors[np.arange(len(active)), column]
+                np.maximum(closest_kept, np.matmul(vectors, kept_vectors[:, :, None])[:, :, 0], out=closest_kept)
+            # kept candidates first, then pruned ones, both best first
+            priority = np.where(kept, columns, np.where(valid, width + columns, 2 * width + columns))
+            order = np.argsort(priority, axis=1, kind="stable")[:, :m]
+            chosen = np.take_along_axis(block_candidates, order, axis=1)
+            selected[start:start + len(chosen), :chosen.shape[1]] = chosen
+        return selected
+
+    def _neighbors(self, node: int, layer: int) -> List[int]:
+        indptr = self.layer_indptrs[layer]
+        return self.layer_neighbors[layer][indptr[node]:indptr[node + 1]].tolist()
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int, layer: int) -> List[Tuple[float, int]]:
+        """Beam search of width `ef` on one layer, returning (similarity, node) pairs best first."""
+        visited = set(entry_points)
+        sims = (self.embeddings[entry_points] @ query).tolist()
+        candidates = [(-sim, node) for sim, node in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(sim, node) for sim, node in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [neighbor for neighbor in self._neighbors(node, layer) if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for sim, neighbor in zip((self.embeddings[neighbors] @ query).tolist(), neighbors):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, neighbor))
+                    heapq.heappush(results, (sim, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def top_k(
+        self,
+        query_vector: np.ndarray,
+        k: int,
+        ef_search: Optional[int] = None,
+        allowed_ids: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids and cosine similarities of the (approximately) k nearest documents, best first."""
+        if self.entry_point < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        if allowed_ids is not None:
+            return self._filtered_top_k(query, k, ef_search, allowed_ids)
+        entry_point = self.entry_point
+        for layer in range(self.max_level, 0, -1):
+            entry_point = self._search_layer(query, [entry_point], 1, layer)[0][1]
+        ef = max(ef_search or self.ef_search, k)
+        results = self._search_layer(query, [entry_point], ef, 0)[:k]
+        return (
+            np.array([node for _, node in results], dtype=np.int64),
+            np.array([sim for sim, _ in results], dtype=np.float32),
+        )
+
+    def _filtered_top_k(self, query: np.ndarray, k: int, ef_search: Optional[int], allowed_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Selective filters are answered exactly over the allowed rows, which is cheaper than walking a
+        graph whose nodes are mostly filtered out. Broad filters widen the beam by the inverse
+        selectivity and drop disallowed nodes, falling back to exact search if too few survive.
+        """
+        selectivity = len(allowed_ids) / max(self.num_docs, 1)
+        if selectivity < EXACT_FILTER_SELECTIVITY:
+            return top_k_among(self.embeddings, query, k, allowed_ids)
+        widened_k = int(math.ceil(k / selectivity))
+        doc_ids, sims = self.top_k(query, widened_k, ef_search=max(ef_search or self.ef_search, widened_k))
+        keep = contains(allowed_ids, doc_ids)
+        if keep.sum() < min(k, len(allowed_ids)):
+            return top_k_among(self.embeddings, query, k, allowed_ids)
+        return doc_ids[keep][:k], sims[keep][:k]
+
+    def recall(self, exact: DenseIndex, query_vectors: np.ndarray, k: int, ef_search: Optional[int] = None) -> float:
+        """Mean recall@k of this index against exact search over the same embeddings."""
+        hits = 0
+        for query_vector in query_vectors:
+            approx_ids, _ = self.top_k(query_vector, k, ef_search=ef_search)
+            exact_ids, _ = exact.top_k(query_vector, k)
+            hits += len(np.intersect1d(approx_ids, exact_ids))
+        return hits / (k * len(query_vectors))
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        # replaced rather than rewritten, apps may still have the previous graph memory-mapped
+        for layer, (indptr, neighbors) in enumerate(zip(self.layer_indptrs, self.layer_neighbors)):
+            atomic_save(path / f"layer_{layer}_indptr.npy", indptr)
+            atomic_save(path / f"layer_{layer}_neighbors.npy", neighbors)
+        atomic_write_json(path / "hnsw.json", {
+            "num_layers": len(self.layer_indptrs),
+            "num_docs": self.num_docs,
+            "entry_point": self.entry_point,
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+        })
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / "hnsw.json").exists()
+
+    @staticmethod
+    def read_num_docs(path: str) -> Optional[int]:
+        """Node count of a saved graph, or None if it was saved before it was recorded."""
+        with open(Path(path) / "hnsw.json") as f:
+            return json.load(f).get("num_docs")
+
+    @classmethod
+    def load(cls, path: str, embeddings: np.ndarray, ef_search: int = 64) -> "HNSWIndex":
+        """Loads a graph saved with `save` on top of the (normalised) embeddings it was built from."""
+        path = Path(path)
+        with open(path / "hnsw.json") as f:
+            params = json.load(f)
+        if params.get("num_docs", len(embeddings)) != len(embeddings):
+            raise ValueError(f"HNSW graph at '{path}' has {params['num_docs']} nodes, the embeddings {len(embeddings)} rows.")
+        return cls(
+            embeddings=embeddings,
+            layer_indptrs=[np.load(path / f"layer_{layer}_indptr.npy", mmap_mode="r") for layer in range(params["num_layers"])],
+            layer_neighbors=[np.load(path / f"layer_{layer}_neighbors.npy", mmap_mode="r") for layer in range(params["num_layers"])],
+            entry_point=params["entry_point"],
+            M=params["M"],
+            ef_construction=params["ef_construction"],
+            ef_search=ef_search,
+        )
@@ -0,0 +1,248 @@
+import datetime
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+from loguru import logger
+
+from core.files import atomic_write_json, file_signature
+
+PUBLISH_FILENAME = "index.json"
+
+def publish(index_dir: Union[str, Path], components: Optional[Dict[str, int]] = None) -> int:
+    """
+    Bumps the published generation of an index directory once a writer has committed every file,
+    which is what running apps watch for: files changed before that are never swapped in half-written.
+    `components` records the generation of components that commit on their own while being written
+    (the segmented lexical index), so readers open the published one rather than the latest.
+    """
+    path = Path(index_dir) / PUBLISH_FILENAME
+    generation = read_published_generation(index_dir) + 1
+    atomic_write_json(path, {
+        "generation": generation,
+        "published_at": datetime.datetime.now().isoformat(),
+        "components": components or {},
+    })
+    return generation
+
+def read_published(index_dir: Union[str, Path]) -> dict:
+    path = Path(index_dir) / PUBLISH_FILENAME
+    if not path.exists():
+        return {"generation": 0}
+    with open(path) as f:
+        return json.load(f)
+
+def read_published_generation(index_dir: Union[str, Path]) -> int:
+    return read_published(index_dir)["generation"]
+
+def read_published_component_generation(index_dir: Union[str, Path], name: str) -> Optional[int]:
+    """Published generation of a component, or None if it was published before components were recorded."""
+    return read_published(index_dir).get("components", {}).get(name)
+
+class IndexGeneration:
+    """
+    One immutable set of loaded index components. Searches hold it through `IndexHandle.acquire`;
+    once it is replaced and its last search has finished, its components are released.
+    """
+
+    def __init__(self, number: int, components: Dict[str, Any], signatures: Dict[str, Any]):
+        self.number = number
+        self.components = components
+        self.signatures = signatures
+        self.readers = 0
+        self.retired = False
+        self.released = False
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Any:
+        return self.components[name]
+
+    def _enter(self) -> bool:
+        with self._lock:
+            if self.released:
+                return False
+            self.readers += 1
+            return True
+
+    def _exit(self) -> bool:
+        """Returns whether this was the last reader of a retired generation."""
+        with self._lock:
+            self.readers -= 1
+            return self._try_release()
+
+    def _retire(self) -> bool:
+        with self._lock:
+            self.retired = True
+            return self._try_release()
+
+    def _try_release(self) -> bool:
+        if self.retired and self.readers == 0 and not self.released:
+            self.released = True
+            return True
+        return False
+
+class IndexHandle:
+    """
+    Read-copy-update handle on a set of index components, each given as a name mapped to a
+    (signature, load) pair of functions. `open_shared` opens what the loaders share (the index
+    snapshot), once per reload that loads anything, and every `load` is called with it (None
+    without `open_shared`). `reload` loads a new generation off to the side, reusing
+    the components whose on-disk signature did not change, and swaps it in with a single reference
+    assignment: searches that already acquired the old generation finish on it, new ones see the
+    new one, and the old generation is dropped (and its components closed) when its last search ends.
+    `close` does the same to the current generation, for an index that is no longer served.
+    """
+
+    def __init__(
+        self,
+        components: Dict[str, Tuple[Callable[[], Any], Callable[[Any], Any]]],
+        marker: Optional[Union[str, Path]] = None,
+        open_shared: Optional[Callable[[], Any]] = None,
+    ):
+        self.components = components
+        self.marker = Path(marker) if marker is not None else None
+        self.open_shared = open_shared
+        self._current: Optional[IndexGeneration] = None
+        self._reload_lock = threading.Lock()
+        self._num_generations = 0
+        self._retired_in_flight: Dict[int, IndexGeneration] = {}
+        self._retired_lock = threading.Lock()
+        self._last_reload_duration: Optional[float] = None
+        self._last_reload_at: Optional[float] = None
+        self._num_reloads = 0
+        self._marker_signature = None
+        self._watch_thread: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+        self._closed = False
+
+    @property
+    def current(self) -> IndexGeneration:
+        generation = self._current
+        if generation is None:
+            self.reload()
+            generation = self._current
+        return generation
+
+    def enter(self) -> Optional[IndexGeneration]:
+        """Pins the current generation until `exit`, or returns None once the handle is closed."""
+        while not self._closed:
+            generation = self.current
+            # a reload can retire and release the generation between reading and pinning it
+            if generation is not None and generation._enter():
+                return generation
+        return None
+
+    def exit(self, generation: IndexGeneration):
+        if generation._exit():
+            self._release(generation)
+
+    @contextmanager
+    def acquire(self) -> Iterator[IndexGeneration]:
+        """Pins the current generation for the duration of the block."""
+        generation = self.enter()
+        if generation is None:
+            raise RuntimeError("The index handle is closed.")
+        try:
+            yield generation
+        finally:
+            self.exit(generation)
+
+    def reload(self, force: bool = False) -> bool:
+        """Loads and swaps in a new generation if any component changed on disk, returning whether it did."""
+        with self._reload_lock:
+            if self._closed:
+                return False
+            start_time = time.time()
+            self._marker_signature = file_signature(self.marker) if self.marker is not None else None
+            previous = self._current
+            signatures = {name: signature() for name, (signature, _) in self.components.items()}
+            if previous is not None and not force and signatures == previous.signatures:
+                return False
+            components = {}
+            shared, opened = None, False
+            for name, (_, load) in self.components.items():
+                if previous is not None and not force and signatures[name] == previous.signatures[name]:
+                    components[name] = previous.components[name]
+                    continue
+                if not opened and self.open_shared is not None:
+                    shared, opened = self.open_shared(), True
+                components[name] = load(shared)
+            self._num_generations += 1
+            self._current = IndexGeneration(self._num_generations, components, signatures)
+            self._last_reload_duration = time.time() - start_time
+            self._last_reload_at = time.time()
+            if previous is not None:
+                self._num_reloads += 1
+                reloaded = sorted(name for name in components if components[name] is not previous.components.get(name))
+                logger.info(f"Swapped in index generation {self._num_generations} in {self._last_reload_duration:.2f}s (reloaded {', '.join(reloaded)})")
+                with self._retired_lock:
+                    self._retired_in_flight[previous.number] = previous
+                if previous._retire():
+                    self._release(previous)
+            return True
+
+    def close(self):
+        """Stops watching and retires the current generation: it is released once its in-flight searches end."""
+        self.stop_watching()
+        with self._reload_lock:
+            self._closed = True
+            generation, self._current = self._current, None
+        if generation is not None:
+            with self._retired_lock:
+                self._retired_in_flight[generation.number] = generation
+            if generation._retire():
+                self._release(generation)
+
+    def _release(self, generation: IndexGeneration):
+        with self._retired_lock:
+            self._retired_in_flight.pop(generation.number, None)
+            live = [self._current, *self._retired_in_flight.values()]
+        for name, component in generation.components.items():
+            # components carried over to a newer generation are still in use
+            if any(other is not None and other.components.get(name) is component for other in live):
+                continue
+            close = getattr(component, "close", None)
+            if callable(close):
+                close()
+        generation.components = {}
+        logger.debug(f"Released index generation {generation.number}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Reload metrics: the live generation, how long its load took and how many old generations still serve searches."""
+        return {
+            "generation": self._num_generations,
+            "num_reloads": self._num_reloads,
+            "last_reload_duration": self._last_reload_duration,
+            "last_reload_at": self._last_reload_at,
+            "retired_in_flight": len(self._retired_in_flight),
+        }
+
+    def check(self) -> bool:
+        """Reloads if the marker file was replaced since the last load."""
+        if self.marker is not None and file_signature(self.marker) == self._marker_signature:
+            return False
+        return self.reload()
+
+    def start_watching(self, interval: float):
+        """Checks the marker every `interval` seconds in a daemon thread."""
+        if self._watch_thread is not None:
+            return
+        self._stop_watching.clear()
+
+        def loop():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f"Index reload failed, keeping generation {self._num_generations}: {e}")
+
+        self._watch_thread = threading.Thread(target=loop, name="index-reload", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+            self._watch_thread = None
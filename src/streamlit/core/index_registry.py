@@ -0,0 +1,259 @@
+import json
+import mmap
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+from loguru import logger
+
+from core.doc_table import DOC_TABLE_FILENAME
+from core.index_handle import IndexGeneration, IndexHandle
+
+# containers with more items than this are measured on a sample of them and extrapolated
+SIZE_SAMPLE = 1000
+
+def discover_sources(root: Union[str, Path], default_source: str) -> Dict[str, Path]:
+    """
+    Data sources of the indexes in `root` and in its direct subdirectories (one per ingestion
+    `--index-dir`), named after the sources recorded in their filter index. An index holding
+    several sources serves all of them; with no index yet, `root` serves `default_source`.
+    """
+    root = Path(root)
+    index_dirs = [root] + (sorted(path for path in root.iterdir() if path.is_dir()) if root.is_dir() else [])
+    sources: Dict[str, Path] = {}
+    for index_dir in index_dirs:
+        if not (index_dir / DOC_TABLE_FILENAME).exists():
+            continue
+        names = [index_dir.name]
+        if (index_dir / "filters" / "sources.json").exists():
+            with open(index_dir / "filters" / "sources.json") as f:
+                names = [name for name in json.load(f) if name] or names
+        for name in names:
+            if name in sources:
+                logger.warning(f"Data source '{name}' is indexed in both '{sources[name]}' and '{index_dir}', serving the first")
+                continue
+            sources[name] = index_dir
+    return sources or {default_source: root}
+
+def buffer_owner(array: np.ndarray) -> Any:
+    """The object holding an array's data: the owning array, an mmap, bytes..., or a np.memmap if it is file-backed."""
+    owner = array
+    while isinstance(owner, np.ndarray) and not isinstance(owner, np.memmap) and owner.base is not None:
+        owner = owner.base
+    return owner.obj if isinstance(owner, memoryview) else owner
+
+def resident_size(root: Any) -> int:
+    """
+    Estimated bytes `root` keeps on the heap: numpy arrays owning their data, and Python containers
+    and scalars with their contents. Memory-mapped arrays do not count, their pages belong to the
+    page cache, shared between processes and reclaimed by the kernel under memory pressure. Objects
+    of the app's classes (`core.*`) are measured through their attributes, other objects only by
+    their own size.
+    """
+    size = 0.0
+    seen = set()
+    # (object, how many objects it stands for when extrapolating a sample)
+    stack: List[Tuple[Any, float]] = [(root, 1.0)]
+    while stack:
+        obj, weight = stack.pop()
+        if isinstance(obj, np.ndarray):
+            obj = buffer_owner(obj)
+            if isinstance(obj, (np.memmap, mmap.mmap)):
+                continue
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            size += weight * obj.nbytes
+            continue
+        size += weight * sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            children = obj.items()
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            children = obj
+        elif type(obj).__module__.startswith("core."):
+            children = vars(obj).values() if hasattr(obj, "__dict__") else ()
+        else:
+            continue
+        sample = list(islice(children, SIZE_SAMPLE))
+        child_weight = weight * len(children) / len(sample) if sample else weight
+        for child in sample:
+            if isinstance(obj, dict):
+                stack.extend(((child[0], child_weight), (child[1], child_weight)))
+            else:
+                stack.append((child, child_weight))
+    return int(size)
+
+def index_size(handle: IndexHandle) -> int:
+    """Estimated heap bytes of the components of an index's current generation, see `resident_size`."""
+    return resident_size(handle.current.components)
+
+class IndexEntry:
+    def __init__(self, handle: IndexHandle, size: int, load_duration: float):
+        self.handle = handle
+        self.size = size
+        self.load_duration = load_duration
+        self.generation = handle.stats()["generation"]
+
+class IndexRegistry:
+    """
+    The index of every data source, opened on its first search by `open_index(index_dir)` (which
+    returns a loaded `IndexHandle`) and kept in an LRU bounded by `max_bytes` of their estimated
+    resident memory (see `resident_size`, memory-mapped files are left to the page cache): beyond
+    it, the least recently searched indexes are handed to `close_index(index_dir, handle)`, which
+    closes them once their in-flight searches end. The index just opened is always kept, even if it
+    alone exceeds the budget. Sources are rediscovered on every `sources()` call, so indexes
+    ingested after startup show up without a restart.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        open_index: Callable[[Path], IndexHandle],
+        close_index: Callable[[Path, IndexHandle], None],
+        max_bytes: int,
+        default_source: str,
+    ):
+        self.root = Path(root)
+        self.open_index = open_index
+        self.close_index = close_index
+        self.max_bytes = max_bytes
+        self.default_source = default_source
+        self._sources = discover_sources(self.root, default_source)
+        self._entries: "OrderedDict[Path, IndexEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._open_locks: Dict[Path, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_load_duration = 0.0
+
+    def sources(self) -> List[str]:
+        sources = discover_sources(self.root, self.default_source)
+        with self._lock:
+            self._sources = sources
+        return list(sources)
+
+    def index_dir(self, data_source: Optional[str] = None) -> Path:
+        """The index serving `data_source`, the first discovered one without a source."""
+        with self._lock:
+            sources = self._sources
+        if data_source is None:
+            return next(iter(sources.values()))
+        if data_source not in sources:
+            sources = discover_sources(self.root, self.default_source)
+            with self._lock:
+                self._sources = sources
+            if data_source not in sources:
+                raise ValueError(f"No index for data source '{data_source}' in '{self.root}'")
+        return sources[data_source]
+
+    def get(self, data_source: Optional[str] = None) -> IndexHandle:
+        """The loaded index of a data source, opening it (and evicting others) if it is not open."""
+        index_dir = self.index_dir(data_source)
+        with self._lock:
+            entry = self._entries.get(index_dir)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(index_dir)
+                evicted = self._resize(index_dir, entry)
+            else:
+                open_lock = self._open_locks.setdefault(index_dir, threading.Lock())
+        if entry is not None:
+            for evicted_dir, evicted_entry in evicted:
+                self.close_index(evicted_dir, evicted_entry.handle)
+            return entry.handle
+
+        # loaded outside the registry lock, so searches on open indexes are not held up by it
+        with open_lock:
+            with self._lock:
+                entry = self._entries.get(index_dir)
+                if entry is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(index_dir)
+                    return entry.handle
+                self.misses += 1
+            start_time = time.time()
+            handle = self.open_index(index_dir)
+            entry = IndexEntry(handle, index_size(handle), time.time() - start_time)
+            logger.info(f"Opened index '{index_dir}' ({entry.size / 2**20:.1f} MiB) in {entry.load_duration:.2f}s")
+            with self._lock:
+                self.total_load_duration += entry.load_duration
+                self._entries[index_dir] = entry
+                evicted = self._evict(keep=index_dir)
+        for evicted_dir, evicted_entry in evicted:
+            self.close_index(evicted_dir, evicted_entry.handle)
+        return handle
+
+    @contextmanager
+    def acquire(self, data_source: Optional[str] = None) -> Iterator[IndexGeneration]:
+        """Pins the current generation of a data source's index for the duration of the block."""
+        while True:
+            handle = self.get(data_source)
+            generation = handle.enter()
+            # None if the index was evicted between the lookup and pinning it
+            if generation is not None:
+                break
+        try:
+            yield generation
+        finally:
+            handle.exit(generation)
+
+    def _resize(self, index_dir: Path, entry: IndexEntry) -> List[tuple]:
+        """Re-measures an index once a newer generation of it was swapped in, evicting others if it grew."""
+        generation = entry.handle.stats()["generation"]
+        if generation == entry.generation:
+            return []
+        entry.size, entry.generation = index_size(entry.handle), generation
+        return self._evict(keep=index_dir)
+
+    def _evict(self, keep: Path) -> List[tuple]:
+        evicted = []
+        while sum(entry.size for entry in self._entries.values()) > self.max_bytes:
+            index_dir = next(iter(self._entries))
+            if index_dir == keep:
+                break
+            evicted.append((index_dir, self._entries.pop(index_dir)))
+            self.evictions += 1
+            logger.info(f"Evicting index '{index_dir}' to stay within {self.max_bytes / 2**20:.0f} MiB")
+        return evicted
+
+    def close(self):
+        with self._lock:
+            entries, self._entries = list(self._entries.items()), OrderedDict()
+        for index_dir, entry in entries:
+            self.close_index(index_dir, entry.handle)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counts, load times and the open indexes (most recently used last) with their sizes."""
+        with self._lock:
+            sources_by_dir: Dict[Path, List[str]] = {}
+            for source, index_dir in self._sources.items():
+                sources_by_dir.setdefault(index_dir, []).append(source)
+            open_indexes = [
+                {
+                    "index_dir": str(index_dir),
+                    "sources": sources_by_dir.get(index_dir, []),
+                    "size": entry.size,
+                    "load_duration": entry.load_duration,
+                    **entry.handle.stats(),
+                }
+                for index_dir, entry in self._entries.items()
+            ]
+            lookups = self.hits + self.misses
+            return {
+                "num_sources": len(self._sources),
+                "open_indexes": open_indexes,
+                "size": sum(index["size"] for index in open_indexes),
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "mean_load_duration": self.total_load_duration / self.misses if self.misses else None,
+            }
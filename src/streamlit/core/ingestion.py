@@ -0,0 +1,641 @@
+import asyncio
+import datetime
+import json
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
+from loguru import logger
+
+from core.dedup import DedupWriter, cluster_stats
+from core.doc_table import DOC_TABLE_FILENAME, DOC_UPDATES_FILENAME, DocTable, read_doc_table, write_doc_store
+from core.embedding_store import EmbeddingStore
+from core.filters import FilterIndex, to_day
+from core.hnsw import HNSWIndex
+from core.index_handle import publish, read_published_component_generation, read_published_generation
+from core.ivfpq import IVFPQIndex
+from core.manifest import HASH_VERSION, MANIFEST_FILENAME, ChunkManifest
+from core.segments import SegmentedIndex, TieredMergePolicy
+from core.snapshot import write_index_snapshot
+from core.tokens import Tokenizer, load_tokenizer
+
+DEFAULT_DATA_SOURCE = "Confluence (Policies & Circulars)"
+# indexes the app can search the embeddings with (DENSE_INDEX_TYPE), all but flat are built on `IndexWriter.close`
+DENSE_INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+# embeddings encoded into the IVF-PQ lists per batch, bounding the float32 copy of the store
+IVFPQ_ADD_BATCH_SIZE = 1 << 16
+# embeddings sampled to train the IVF-PQ centroids and codebooks
+IVFPQ_TRAINING_SIZE = 100000
+# tags whose end starts a new line of text
+BLOCK_TAGS = {
+    "p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote",
+    "table", "ul", "ol", "section", "article", "hr", "td", "th",
+}
+SKIPPED_TAGS = {"script", "style", "noscript"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+LAST_MODIFIED_PATTERN = re.compile(r"(?:last modified|created)(?: by .+?)? on (\w{3} \d{1,2}, \d{4})")
+PAGE_ID_PATTERN = re.compile(r"_(\d+)$")
+
+class RawPage(NamedTuple):
+    """One exported page: its body inline (XML export) or a file the worker reads itself (HTML export)."""
+    page_id: str
+    link: str
+    title: Optional[str] = None
+    date: Optional[str] = None
+    html: Optional[str] = None
+    path: Optional[str] = None
+
+class PageText(HTMLParser):
+    """
+    Text of an exported page, keeping line breaks at block elements. When the page has an element
+    with id "main-content" (Confluence HTML exports) only its content is kept, which drops the
+    breadcrumbs, attachment lists and footer around it.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.metadata_text = ""
+        self.parts: List[str] = []
+        self.main_parts: List[str] = []
+        self._stack: List[Tuple[str, Optional[str]]] = []
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        if tag == "title":
+            self._in_title = True
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS:
+                self._append("\n")
+            return
+        attrs = dict(attrs)
+        role = None
+        if attrs.get("id") == "main-content":
+            role = "main"
+        elif "page-metadata" in (attrs.get("class") or ""):
+            role = "metadata"
+        self._stack.append((tag, role))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        if tag == "title":
+            self._in_title = False
+        if tag in VOID_TAGS:
+            return
+        # pop up to the matching start tag, tolerating unclosed elements
+        for depth in range(len(self._stack) - 1, -1, -1):
+            if self._stack[depth][0] == tag:
+                del self._stack[depth:]
+                break
+        if tag in BLOCK_TAGS:
+            self._append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            if any(role == "metadata" for _, role in self._stack):
+                self.metadata_text += data
+            self._append(data)
+
+    def _append(self, text: str):
+        self.parts.append(text)
+        if any(role == "main" for _, role in self._stack):
+            self.main_parts.append(text)
+
+    @property
+    def text(self) -> str:
+        text = "".join(self.main_parts or self.parts)
+        lines = (" ".join(line.split()) for line in text.splitlines())
+        return "\n".join(line for line in lines if line)
+
+def strip_markup(html: str) -> PageText:
+    parser = PageText()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+def pack_lines(lines: List[list], chunk_size: int = 300, chunk_overlap: int = 50) -> List[list]:
+    """
+    Packs whole lines (paragraphs) of units (words or tokens) into chunks of at most `chunk_size`
+    units, splitting only lines that are longer than a chunk. Each chunk starts with up to
+    `chunk_overlap` units of the previous one.
+    """
+    chunks, current, fresh_units = [], [], 0
+    for units in lines:
+        for start in range(0, len(units), chunk_size):
+            piece = units[start:start + chunk_size]
+            if fresh_units and len(current) + len(piece) > chunk_size:
+                chunks.append(current)
+                overlap = min(chunk_overlap, chunk_size - len(piece))
+                current = current[-overlap:] if overlap > 0 else []
+                fresh_units = 0
+            current = current + piece
+            fresh_units += len(piece)
+    if fresh_units:
+        chunks.append(current)
+    return chunks
+
+def chunk_text(text: str, chunk_size: int = 300, chunk_overlap: int = 50) -> List[str]:
+    """Chunks of at most `chunk_size` words, see `pack_lines`."""
+    return [" ".join(chunk) for chunk in pack_lines([line.split() for line in text.splitlines()], chunk_size, chunk_overlap)]
+
+def chunk_tokens(text: str, tokenizer: Tokenizer, chunk_size: int = 300, chunk_overlap: int = 50) -> List[str]:
+    """Chunks of at most about `chunk_size` tokens of `tokenizer`, packed like `chunk_text`."""
+    spans = tokenizer.spans(text)
+    line_ends = np.cumsum([len(line) + 1 for line in text.split("\n")])
+    lines: List[list] = [[] for _ in range(len(line_ends))]
+    for span, line in zip(spans, np.searchsorted(line_ends, [start for start, _ in spans], side="right").tolist()):
+        lines[line].append(span)
+    return [" ".join(text[chunk[0][0]:chunk[-1][1]].split()) for chunk in pack_lines(lines, chunk_size, chunk_overlap)]
+
+def process_pages(
+    pages: List[RawPage],
+    data_source: str = DEFAULT_DATA_SOURCE,
+    chunk_size: int = 300,
+    chunk_overlap: int = 50,
+    tokenizer: Optional[Tuple[str, Optional[str]]] = None,
+) -> List[Tuple[str, dict]]:
+    """
+    Strips and chunks a batch of pages (runs in the worker processes), returning (text, metadata) per
+    chunk. Given a tokenizer's (model id, revision), chunk sizes are in its tokens and every chunk
+    records its token count under the tokenizer's name, otherwise they are in words.
+    """
+    chunks = []
+    loaded_tokenizer = load_tokenizer(*tokenizer) if tokenizer is not None else None
+    for page in pages:
+        html = page.html
+        if html is None:
+            with open(page.path, encoding="utf-8", errors="replace") as f:
+                html = f.read()
+        parsed = strip_markup(html)
+        title = page.title or parsed.title.split(" : ", 1)[-1].strip() or page.page_id
+        date = page.date
+        if date is None:
+            match = LAST_MODIFIED_PATTERN.search(" ".join(parsed.metadata_text.split()))
+            if match:
+                date = datetime.datetime.strptime(match.group(1), "%b %d, %Y").date().isoformat()
+        if loaded_tokenizer is not None:
+            page_chunks = chunk_tokens(parsed.text, loaded_tokenizer, chunk_size, chunk_overlap)
+        else:
+            page_chunks = chunk_text(parsed.text, chunk_size, chunk_overlap)
+        for chunk_index, chunk in enumerate(page_chunks):
+            metadata = {
+                "title": title,
+                "link": page.link,
+                "date": date,
+                "data_source": data_source,
+                "page_id": page.page_id,
+                "chunk": chunk_index,
+            }
+            if loaded_tokenizer is not None:
+                metadata["token_counts"] = {loaded_tokenizer.name: loaded_tokenizer.count(chunk)}
+            chunks.append((chunk, metadata))
+    return chunks
+
+def process_batch(pages: List[RawPage], **options) -> Tuple[int, List[Tuple[str, dict]]]:
+    return len(pages), process_pages(pages, **options)
+
+def read_html_export(export_dir: str, base_url: str = "") -> Iterator[RawPage]:
+    """Pages of a Confluence HTML export (one .html file per page); the files are read by the workers."""
+    export_dir = Path(export_dir)
+    for path in sorted(export_dir.rglob("*.html")):
+        if path.name == "index.html" or "attachments" in path.relative_to(export_dir).parts:
+            continue
+        match = PAGE_ID_PATTERN.search(path.stem)
+        relative_path = path.relative_to(export_dir).as_posix()
+        yield RawPage(
+            page_id=match.group(1) if match else path.stem,
+            link=f"{base_url.rstrip('/')}/{relative_path}" if base_url else relative_path,
+            path=str(path),
+        )
+
+def iter_objects(xml_path: str, object_class: str) -> Iterator[ET.Element]:
+    """Streams the top-level `<object class=...>` elements of an `entities.xml`, freeing each one after use."""
+    context = ET.iterparse(xml_path, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if element.tag != "object":
+            continue
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            if element.get("class") == object_class:
+                yield element
+            root.clear()
+
+def xml_property(element: ET.Element, name: str) -> Optional[str]:
+    for prop in element.findall("property"):
+        if prop.get("name") == name:
+            return prop.text
+    return None
+
+def read_xml_export(export_path: str, base_url: str = "") -> Iterator[RawPage]:
+    """
+    Current pages of a Confluence XML export (`entities.xml`). A first streaming pass collects the
+    title and date of every current page; a second one joins them with the page bodies, so only
+    that per-page metadata is ever held in memory.
+    """
+    xml_path = Path(export_path)
+    if xml_path.is_dir():
+        xml_path = xml_path / "entities.xml"
+    pages: Dict[str, Tuple[str, Optional[str]]] = {}
+    for element in iter_objects(xml_path, "Page"):
+        if xml_property(element, "contentStatus") not in (None, "current") or element.find("property[@name='originalVersion']") is not None:
+            continue
+        modified = xml_property(element, "lastModificationDate") or xml_property(element, "creationDate")
+        pages[element.findtext("id")] = (xml_property(element, "title") or "", modified[:10] if modified else None)
+
+    for element in iter_objects(xml_path, "BodyContent"):
+        content = element.find("property[@name='content']")
+        if content is None or content.get("class") != "Page":
+            continue
+        page_id = content.findtext("id")
+        if page_id not in pages:
+            continue
+        title, date = pages[page_id]
+        yield RawPage(
+            page_id=page_id,
+            link=f"{base_url.rstrip('/')}/pages/viewpage.action?pageId={page_id}" if base_url else page_id,
+            title=title,
+            date=date,
+            html=xml_property(element, "body") or "",
+        )
+
+def read_export(export_path: str, base_url: str = "") -> Iterator[RawPage]:
+    path = Path(export_path)
+    if path.suffix == ".xml" or (path / "entities.xml").exists():
+        return read_xml_export(export_path, base_url)
+    return read_html_export(export_path, base_url)
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bounded_map(executor: Optional[Executor], fn: Callable, items: Iterable, max_in_flight: int) -> Iterator:
+    """
+    Like `executor.map`, in order, but only submits `max_in_flight` items ahead of the consumer
+    (Executor.map submits the whole input up front). Runs inline without an executor.
+    """
+    if executor is None:
+        yield from map(fn, items)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+class IngestionStats(NamedTuple):
+    num_pages: int
+    num_chunks: int
+    duration: float
+    num_added: int = 0
+    num_deleted: int = 0
+    num_updated: int = 0
+
+    @property
+    def num_unchanged(self) -> int:
+        return self.num_chunks - self.num_added
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.num_pages / max(self.duration, 1e-9)
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.num_chunks / max(self.duration, 1e-9)
+
+class IndexWriter:
+    """
+    Streams chunks into the index files read by `core.search`: the doc table (whose new rows are
+    compressed into the doc store on `close`), a segmented lexical index (one flush per `segment_size` chunks), the
+    filter attributes and, when embeddings are given, a memory-mapped embedding store, recording
+    every chunk in the `ChunkManifest`. Lexical segments are merged on `close` as the tiered merge
+    policy (`merge_factor`, `max_segments`) asks, the app only reads them. With
+    `dedup`, chunks are also MinHashed and clustered with their near-duplicates. With a
+    `dense_index` other than flat, it is built over the whole embedding store on `close`, and kept
+    up to date by later runs once it exists.
+    With `append`, new chunks get doc ids after those of the existing index, and whatever an
+    interrupted run wrote past the last `close` (which records the committed document count, doc
+    table size and lexical generation in the manifest) is dropped first. With `snapshot`, the
+    finished index is also packed into a single snapshot file for fast cold starts.
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        segment_size: int = 20000,
+        positions: bool = False,
+        merge_factor: int = 4,
+        max_segments: int = 64,
+        store_dtype: str = "float32",
+        embeddings: bool = True,
+        append: bool = False,
+        snapshot: bool = False,
+        dedup: bool = True,
+        dedup_threshold: float = 0.8,
+        dense_index: str = "flat",
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 200,
+        ivfpq_lists: int = 1024,
+        ivfpq_subquantizers: int = 32,
+    ):
+        if dense_index not in DENSE_INDEX_TYPES:
+            raise ValueError(f"Dense index type '{dense_index}' not supported.")
+        self.index_dir = Path(index_dir)
+        self.segment_size = segment_size
+        self.snapshot = snapshot
+        self.dense_index = dense_index
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.ivfpq_lists = ivfpq_lists
+        self.ivfpq_subquantizers = ivfpq_subquantizers
+        if not append:
+            (self.index_dir / MANIFEST_FILENAME).unlink(missing_ok=True)
+        self.manifest = ChunkManifest(index_dir)
+        committed = {key: self.manifest.get_meta(key) for key in ("num_docs", "doc_table_offset", "doc_updates_offset")}
+        committed = {key: int(value) if append and value is not None else None for key, value in committed.items()}
+        committed_docs = committed["num_docs"]
+        self.doc_table = DocTable.writer(
+            index_dir,
+            append=append,
+            num_docs=committed_docs,
+            offset=committed["doc_table_offset"],
+            updates_offset=committed["doc_updates_offset"],
+        )
+        # the doc store already holds the existing rows, only the new ones are compressed on `close`
+        self._stored_docs, self._stored_offset, self._stored_updates = self.doc_table.num_docs, self.doc_table.offset, self.doc_table.updates_offset
+        if append and self.manifest.needs_rehash():
+            logger.info("Rehashing the indexed chunks, metadata changes no longer count as content changes")
+            self.manifest.rehash((doc_id, row["page_content"], row["metadata"]) for doc_id, row in enumerate(read_doc_table(index_dir)))
+        self.lexical_index = SegmentedIndex.create(
+            self.index_dir / "lexical",
+            TieredMergePolicy(merge_factor=merge_factor, max_segments=max_segments),
+            positions=positions,
+        )
+        lexical_generation = self.manifest.get_meta("lexical_generation")
+        if append and lexical_generation is not None:
+            self.lexical_index.rollback(int(lexical_generation))
+        self.embedding_store = (
+            EmbeddingStore.writer(self.index_dir / "dense", store_dtype, append=append, num_docs=committed_docs)
+            if embeddings else None
+        )
+        # rows past these were embedded by this run (or by an interrupted one, and dropped)
+        self._stored_embeddings = self.embedding_store.num_docs if self.embedding_store is not None else 0
+        self.dates: List[int] = []
+        self.doc_sources: List[int] = []
+        self.source_ids: Dict[str, int] = {}
+        if append and FilterIndex.exists(self.index_dir / "filters"):
+            filter_index = FilterIndex.load(self.index_dir / "filters")
+            self.dates = filter_index.dates.tolist()
+            self.source_ids = {source: source_id for source_id, source in enumerate(filter_index.sources)}
+            doc_sources = np.zeros(filter_index.num_docs, dtype=np.int32)
+            for source_id, source in enumerate(filter_index.sources):
+                doc_sources[filter_index.source_ids(source)] = source_id
+            self.doc_sources = doc_sources.tolist()
+            # saved before the manifest was committed by an interrupted run
+            del self.dates[self.num_docs:], self.doc_sources[self.num_docs:]
+        self.dedup = (
+            DedupWriter(self.index_dir / "dedup", append=append, num_docs=committed_docs, threshold=dedup_threshold)
+            if dedup else None
+        )
+        if self.dedup is None and (self.index_dir / "dedup").exists():
+            # clusters that would not cover the new chunks
+            shutil.rmtree(self.index_dir / "dedup")
+        if self.dedup is not None and self.dedup.num_docs < self.num_docs:
+            # index written before signatures were recorded
+            with open(self.index_dir / DOC_TABLE_FILENAME) as f:
+                rows = [json.loads(line)["page_content"] for doc_id, line in enumerate(f) if doc_id >= self.dedup.num_docs]
+            self.dedup.add(rows)
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._doc_ids: List[int] = []
+        self._updated_dates: Dict[int, int] = {}
+
+    @property
+    def num_docs(self) -> int:
+        return self.doc_table.num_docs
+
+    def add(self, chunks: List[Tuple[str, dict]]) -> List[int]:
+        """Writes chunks, returning their doc ids."""
+        doc_ids = []
+        for text, metadata in chunks:
+            doc_ids.append(self.doc_table.add(text, metadata))
+            self._texts.append(text)
+            self._metadatas.append({"date": metadata.get("date")})
+            self.dates.append(to_day(metadata.get("date")))
+            self.doc_sources.append(self.source_ids.setdefault(metadata.get("data_source", ""), len(self.source_ids)))
+        self._doc_ids += doc_ids
+        if self.dedup is not None:
+            self.dedup.add([text for text, _ in chunks])
+        if len(self._texts) >= self.segment_size:
+            self.flush()
+        return doc_ids
+
+    def update(self, doc_id: int, metadata: dict):
+        """Replaces the metadata of an indexed chunk whose text did not change, without re-indexing or re-embedding it."""
+        self.doc_table.update(doc_id, metadata)
+        day = to_day(metadata.get("date"))
+        if day != self.dates[doc_id]:
+            self.dates[doc_id] = self._updated_dates[doc_id] = day
+        self.doc_sources[doc_id] = self.source_ids.setdefault(metadata.get("data_source", ""), len(self.source_ids))
+
+    def add_embeddings(self, embeddings: np.ndarray):
+        self.embedding_store.append(embeddings)
+
+    def flush(self):
+        if self._texts:
+            self.lexical_index.add(self._texts, self._metadatas, np.array(self._doc_ids, dtype=np.int64))
+            self._texts, self._metadatas, self._doc_ids = [], [], []
+
+    def write_dense_index(self, store: EmbeddingStore):
+        """Updates the approximate indexes asked for or built by an earlier run over the embedding store."""
+        if self.dense_index == "hnsw" or HNSWIndex.exists(self.index_dir / "dense" / "hnsw"):
+            self.write_hnsw(store)
+        if self.dense_index == "ivfpq" or IVFPQIndex.exists(self.index_dir / "dense" / "ivfpq"):
+            self.write_ivfpq(store)
+
+    def write_hnsw(self, store: EmbeddingStore):
+        """Builds the HNSW graph over every stored embedding, unless the saved one already covers them all."""
+        hnsw_dir = self.index_dir / "dense" / "hnsw"
+        if HNSWIndex.exists(hnsw_dir) and HNSWIndex.read_num_docs(hnsw_dir) == store.num_docs == self._stored_embeddings:
+            return
+        start_time = time.perf_counter()
+        # the batched build has no incremental insert, appended rows are linked by rebuilding the graph
+        index = HNSWIndex.build(store[:], M=self.hnsw_m, ef_construction=self.hnsw_ef_construction)
+        index.save(hnsw_dir)
+        logger.info(f"Built the HNSW graph over {index.num_docs} embeddings in {time.perf_counter() - start_time:.1f}s")
+
+    def write_ivfpq(self, store: EmbeddingStore):
+        """
+        Encodes the embeddings appended since the last run into the IVF-PQ lists, first training the
+        coarse centroids and PQ codebooks on a sample of the store if there is no index yet.
+        """
+        ivfpq_dir = self.index_dir / "dense" / "ivfpq"
+        start_time = time.perf_counter()
+        if IVFPQIndex.exists(ivfpq_dir):
+            index = IVFPQIndex.load(ivfpq_dir)
+            # codes of rows written by an interrupted run after the last close
+            index.truncate(self._stored_embeddings)
+            if index.num_docs == store.num_docs:
+                return
+        else:
+            # every PQ codebook has 256 centroids
+            min_training_size = max(self.ivfpq_lists, 256)
+            if store.num_docs < min_training_size:
+                logger.warning(f"IVF-PQ needs at least {min_training_size} embeddings to train, got {store.num_docs}: the app searches the embedding store until then")
+                return
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(store.num_docs, min(IVFPQ_TRAINING_SIZE, store.num_docs), replace=False))
+            index = IVFPQIndex.train(store[sample], num_lists=self.ivfpq_lists, num_subquantizers=self.ivfpq_subquantizers)
+        num_encoded = index.num_docs
+        for start in range(num_encoded, store.num_docs, IVFPQ_ADD_BATCH_SIZE):
+            end = min(start + IVFPQ_ADD_BATCH_SIZE, store.num_docs)
+            index.add(store[start:end], np.arange(start, end, dtype=np.int64))
+        index.save(ivfpq_dir)
+        logger.info(f"Encoded {index.num_docs - num_encoded} embeddings into the IVF-PQ lists in {time.perf_counter() - start_time:.1f}s")
+
+    def close(self, embedding_model: str = ""):
+        self.flush()
+        if self._updated_dates:
+            self.lexical_index.update_dates(np.fromiter(self._updated_dates, dtype=np.int64), np.fromiter(self._updated_dates.values(), dtype=np.int64))
+        # merged segments no longer hold the deleted and replaced chunks
+        self.lexical_index.maybe_merge(deleted=self.manifest.tombstones())
+        self.doc_table.close()
+        write_doc_store(self.index_dir, num_docs=self._stored_docs, offset=self._stored_offset, updates_offset=self._stored_updates)
+        FilterIndex.from_arrays(
+            np.array(self.dates, dtype=np.int32),
+            np.array(self.doc_sources, dtype=np.int32),
+            list(self.source_ids),
+        ).save(self.index_dir / "filters")
+        if self.embedding_store is not None:
+            self.write_dense_index(self.embedding_store.close())
+        if self.dedup is not None:
+            stats = cluster_stats(self.dedup.close(tombstones=self.manifest.tombstones()))
+            logger.info(f"{stats['num_duplicates']} of {stats['num_docs']} chunks are near-duplicates ({stats['num_clusters']} clusters)")
+        # the manifest is committed last, once every index file it describes has been written
+        self.manifest.set_meta("embedding_model", embedding_model)
+        self.manifest.set_meta("num_docs", str(self.num_docs))
+        self.manifest.set_meta("doc_table_offset", str((self.index_dir / DOC_TABLE_FILENAME).stat().st_size))
+        self.manifest.set_meta("doc_updates_offset", str((self.index_dir / DOC_UPDATES_FILENAME).stat().st_size))
+        self.manifest.set_meta("hash_version", HASH_VERSION)
+        self.manifest.set_meta("lexical_generation", str(self.lexical_index.generation))
+        self.manifest.commit()
+        self.manifest.close()
+        if self.snapshot:
+            write_index_snapshot(self.index_dir, generation=read_published_generation(self.index_dir) + 1)
+        # running apps swap in the new index once it is published, pinning the lexical generation
+        # committed by now rather than whichever a later flush commits
+        previous_lexical_generation = read_published_component_generation(self.index_dir, "lexical")
+        publish(self.index_dir, {"lexical": self.lexical_index.generation})
+        # apps still loading the previously published generation may need its segments
+        self.lexical_index.collect_garbage(keep_generations=[
+            generation for generation in (previous_lexical_generation,) if generation is not None
+        ])
+
+async def ingest(
+    pages: Iterable[RawPage],
+    writer: IndexWriter,
+    workers: int = 4,
+    pages_per_task: int = 16,
+    data_source: str = DEFAULT_DATA_SOURCE,
+    chunk_size: int = 300,
+    chunk_overlap: int = 50,
+    tokenizer: Optional[Tuple[str, Optional[str]]] = None,
+    embed: Optional[Callable] = None,
+    embedding_model: str = "",
+    embedding_batch_size: int = 64,
+    embedding_concurrency: int = 4,
+    delete_missing_pages: bool = True,
+) -> IngestionStats:
+    """
+    Streams `pages` through a process pool that strips and chunks them, then writes the chunks and,
+    with `embed` (an async texts -> matrix function), their embeddings. At most two tasks per worker
+    and `embedding_batch_size * embedding_concurrency` unembedded chunks are pending at any time, so
+    memory stays bounded whatever the export size. With a `tokenizer` (model id, revision), chunks
+    are sized in its tokens and carry their token counts, see `process_pages`.
+
+    Chunks already in the writer's manifest with the same text and `embedding_model` are skipped,
+    or only get their doc table row and filter attributes updated if their metadata changed, so
+    re-ingesting an export only writes and embeds what changed. Indexed chunks of a
+    page that are gone are tombstoned, as are all chunks of pages missing from the export unless
+    `delete_missing_pages` is off (for partial exports).
+    """
+    start_time = time.perf_counter()
+    num_pages = num_chunks = num_added = num_deleted = num_updated = 0
+    seen_pages: Set[str] = set()
+    pending_texts: List[str] = []
+
+    async def embed_pending(flush_all: bool = False):
+        nonlocal pending_texts
+        window = embedding_batch_size * embedding_concurrency
+        while len(pending_texts) >= window or (flush_all and pending_texts):
+            batches = [
+                pending_texts[start:start + embedding_batch_size]
+                for start in range(0, min(window, len(pending_texts)), embedding_batch_size)
+            ]
+            pending_texts = pending_texts[sum(len(batch) for batch in batches):]
+            for embeddings in await asyncio.gather(*(embed(batch) for batch in batches)):
+                writer.add_embeddings(embeddings)
+
+    task = partial(process_batch, data_source=data_source, chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=tokenizer)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = bounded_map(executor, task, batched(pages, pages_per_task), max_in_flight=2 * workers)
+        for num_tasks, (batch_pages, chunks) in enumerate(results, start=1):
+            num_pages += batch_pages
+            num_chunks += len(chunks)
+            for page_id, page_chunks in groupby(chunks, key=lambda chunk: chunk[1]["page_id"]):
+                seen_pages.add(page_id)
+                changed, updated, deleted = writer.manifest.diff_page(page_id, list(page_chunks), embedding_model)
+                doc_ids = writer.add([(text, metadata) for text, metadata, _, _ in changed])
+                writer.manifest.add(
+                    (doc_id, page_id, content_hash, metadata_hash, embedding_model)
+                    for doc_id, (_, _, content_hash, metadata_hash) in zip(doc_ids, changed)
+                )
+                for doc_id, metadata, _ in updated:
+                    writer.update(doc_id, metadata)
+                writer.manifest.update_metadata((doc_id, metadata_hash) for doc_id, _, metadata_hash in updated)
+                writer.manifest.delete(deleted)
+                num_added += len(changed)
+                num_updated += len(updated)
+                num_deleted += len(deleted)
+                if embed is not None:
+                    pending_texts.extend(text for text, _, _, _ in changed)
+            if embed is not None:
+                await embed_pending()
+            if num_tasks % 100 == 0:
+                logger.info(f"Ingested {num_pages} pages, {num_chunks} chunks ({num_pages / (time.perf_counter() - start_time):.1f} pages/s)")
+        if embed is not None:
+            await embed_pending(flush_all=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if delete_missing_pages:
+        num_deleted += writer.manifest.delete_pages(writer.manifest.page_ids() - seen_pages)
+    writer.close(embedding_model)
+    return IngestionStats(num_pages, num_chunks, time.perf_counter() - start_time, num_added, num_deleted, num_updated)
@@ -0,0 +1,259 @@
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+from core.dense import normalize, top_k_among
+from core.embedding_store import EmbeddingStore
+from core.files import atomic_save, atomic_write_json
+from core.filters import EXACT_FILTER_SELECTIVITY, contains
+from core.ranking import top_k
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 16384) -> np.ndarray:
+    """Index of the closest (squared L2) centroid for every row, computed in blocks."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return assignments
+
+def kmeans(vectors: np.ndarray, num_clusters: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) < num_clusters:
+        raise ValueError(f"Need at least {num_clusters} training vectors, got {len(vectors)}.")
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=num_clusters)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(vectors[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+class IVFPQIndex:
+    """
+    Inverted-file index with product-quantized residuals (Jégou et al.).
+
+    Vectors are assigned to one of `num_lists` coarse centroids and their residual is split into
+    `num_subquantizers` sub-vectors, each encoded as one byte, so a vector costs
+    `num_subquantizers` bytes (16–64 in practice). At query time an asymmetric distance table of
+    shape (num_subquantizers, 256) is computed once and candidate scores become table lookups.
+    Optionally the best `rerank_k` candidates are re-scored exactly from a memory-mapped
+    `EmbeddingStore` holding the full vectors.
+    """
+
+    def __init__(
+        self,
+        coarse_centroids: np.ndarray,
+        codebooks: np.ndarray,
+        list_indptr: Optional[np.ndarray] = None,
+        list_ids: Optional[np.ndarray] = None,
+        list_codes: Optional[np.ndarray] = None,
+        nprobe: int = 16,
+        rerank_store: Optional[EmbeddingStore] = None,
+        rerank_k: int = 0,
+    ):
+        num_lists = len(coarse_centroids)
+        num_subquantizers = codebooks.shape[0]
+        self.coarse_centroids = coarse_centroids
+        self.codebooks = codebooks
+        self.list_indptr = list_indptr if list_indptr is not None else np.zeros(num_lists + 1, dtype=np.int64)
+        self.list_ids = list_ids if list_ids is not None else np.empty(0, dtype=np.int64)
+        self.list_codes = list_codes if list_codes is not None else np.empty((0, num_subquantizers), dtype=np.uint8)
+        self.nprobe = nprobe
+        self.rerank_store = rerank_store
+        self.rerank_k = rerank_k
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.coarse_centroids)
+
+    @property
+    def num_subquantizers(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.coarse_centroids.shape[1]
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.list_ids)
+
+    @property
+    def bytes_per_vector(self) -> float:
+        """Code bytes plus the doc id stored alongside each code."""
+        return self.num_subquantizers + self.list_ids.itemsize
+
+    @classmethod
+    def train(
+        cls,
+        training_vectors: np.ndarray,
+        num_lists: int = 1024,
+        num_subquantizers: int = 32,
+        iterations: int = 20,
+        seed: int = 0,
+    ) -> "IVFPQIndex":
+        """Learns the coarse centroids and the per-subspace codebooks from a sample of embeddings."""
+        vectors = normalize(np.asarray(training_vectors, dtype=np.float32))
+        dim = vectors.shape[1]
+        if dim % num_subquantizers != 0:
+            raise ValueError(f"Embedding dim {dim} is not divisible by {num_subquantizers} subquantizers.")
+        coarse_centroids = kmeans(vectors, num_lists, iterations=iterations, seed=seed)
+        residuals = vectors - coarse_centroids[nearest_centroids(vectors, coarse_centroids)]
+        sub_dim = dim // num_subquantizers
+        codebooks = np.stack([
+            kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], 256, iterations=iterations, seed=seed + j)
+            for j in range(num_subquantizers)
+        ])
+        return cls(coarse_centroids, codebooks)
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Coarse list assignment and PQ codes of the residuals for normalised `vectors`."""
+        assignments = nearest_centroids(vectors, self.coarse_centroids)
+        residuals = vectors - self.coarse_centroids[assignments]
+        sub_dim = self.dim // self.num_subquantizers
+        codes = np.empty((len(vectors), self.num_subquantizers), dtype=np.uint8)
+        for j in range(self.num_subquantizers):
+            codes[:, j] = nearest_centroids(residuals[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j])
+        return assignments, codes
+
+    def add(self, embeddings: np.ndarray, doc_ids: Optional[np.ndarray] = None):
+        """Encodes and appends vectors; doc ids default to consecutive ids after the current ones."""
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        if doc_ids is None:
+            start = int(self.list_ids.max()) + 1 if self.num_docs else 0
+            doc_ids = np.arange(start, start + len(vectors), dtype=np.int64)
+        assignments, codes = self.encode(vectors)
+
+        old_lists = np.repeat(np.arange(self.num_lists), np.diff(self.list_indptr))
+        all_lists = np.concatenate([old_lists, assignments])
+        order = np.argsort(all_lists, kind="stable")
+        self.list_ids = np.concatenate([self.list_ids, np.asarray(doc_ids, dtype=np.int64)])[order]
+        self.list_codes = np.concatenate([self.list_codes, codes])[order]
+        self.list_indptr = np.zeros(self.num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_lists, minlength=self.num_lists), out=self.list_indptr[1:])
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        num_lists: int = 1024,
+        num_subquantizers: int = 32,
+        training_size: int = 100000,
+        seed: int = 0,
+    ) -> "IVFPQIndex":
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(len(embeddings), min(training_size, len(embeddings)), replace=False))]
+        index = cls.train(sample, num_lists=num_lists, num_subquantizers=num_subquantizers, seed=seed)
+        index.add(embeddings)
+        return index
+
+    def distance_table(self, query: np.ndarray) -> np.ndarray:
+        """Inner products between each query sub-vector and its 256 sub-centroids: shape (m, 256)."""
+        sub_dim = self.dim // self.num_subquantizers
+        return np.einsum("jcd,jd->jc", self.codebooks, query.reshape(self.num_subquantizers, sub_dim))
+
+    def top_k(
+        self,
+        query_vector: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+        allowed_ids: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Doc ids and (approximate, or exact when re-ranked) cosine similarities, best first.
+        With `allowed_ids`, disallowed postings are dropped from the probed lists before any
+        distance-table lookups.
+        """
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, self.num_lists)
+        rerank_k = self.rerank_k if rerank_k is None else rerank_k
+
+        if allowed_ids is not None and self.rerank_store is not None and len(allowed_ids) < EXACT_FILTER_SELECTIVITY * self.num_docs:
+            # a narrow filter leaves few allowed docs in the probed lists; scoring them exactly is cheaper and exhaustive
+            return top_k_among(self.rerank_store, query, k, allowed_ids)
+
+        coarse_scores = self.coarse_centroids @ query
+        probed = top_k(coarse_scores, nprobe)
+        table = self.distance_table(query)
+        subquantizers = np.arange(self.num_subquantizers)
+
+        candidate_ids, candidate_scores = [], []
+        for list_id in probed:
+            start, end = self.list_indptr[list_id], self.list_indptr[list_id + 1]
+            if start == end:
+                continue
+            list_ids = self.list_ids[start:end]
+            codes = self.list_codes[start:end]
+            if allowed_ids is not None:
+                keep = contains(allowed_ids, list_ids)
+                list_ids, codes = list_ids[keep], codes[keep]
+            candidate_ids.append(list_ids)
+            candidate_scores.append(coarse_scores[list_id] + table[subquantizers, codes].sum(axis=1))
+        if not candidate_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidate_ids = np.concatenate(candidate_ids)
+        candidate_scores = np.concatenate(candidate_scores).astype(np.float32)
+
+        if self.rerank_store is not None and rerank_k > 0:
+            shortlist = top_k(candidate_scores, max(rerank_k, k))
+            candidate_ids = candidate_ids[shortlist]
+            # rows are read in id order to keep the memory-mapped reads sequential
+            read_order = np.argsort(candidate_ids)
+            exact_scores = np.empty(len(candidate_ids), dtype=np.float32)
+            exact_scores[read_order] = self.rerank_store[candidate_ids[read_order]] @ query
+            candidate_scores = exact_scores
+
+        best = top_k(candidate_scores, k)
+        return candidate_ids[best], candidate_scores[best]
+
+    def truncate(self, num_docs: int):
+        """Drops the vectors with doc ids from `num_docs` on, keeping the others in their lists."""
+        lists = np.repeat(np.arange(self.num_lists), np.diff(self.list_indptr))
+        keep = np.asarray(self.list_ids) < num_docs
+        self.list_ids, self.list_codes = self.list_ids[keep], self.list_codes[keep]
+        self.list_indptr = np.zeros(self.num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists[keep], minlength=self.num_lists), out=self.list_indptr[1:])
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        # replaced rather than rewritten, apps may still have the previous lists memory-mapped
+        atomic_save(path / "coarse_centroids.npy", self.coarse_centroids)
+        atomic_save(path / "codebooks.npy", self.codebooks)
+        atomic_save(path / "list_indptr.npy", self.list_indptr)
+        atomic_save(path / "list_ids.npy", self.list_ids)
+        atomic_save(path / "list_codes.npy", self.list_codes)
+        atomic_write_json(path / "ivfpq.json", {"num_lists": self.num_lists, "num_subquantizers": self.num_subquantizers, "dim": self.dim})
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / "ivfpq.json").exists()
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        nprobe: int = 16,
+        rerank_store: Optional[EmbeddingStore] = None,
+        rerank_k: int = 0,
+    ) -> "IVFPQIndex":
+        """Loads an index saved with `save`, memory-mapping the inverted lists."""
+        path = Path(path)
+        return cls(
+            coarse_centroids=np.load(path / "coarse_centroids.npy"),
+            codebooks=np.load(path / "codebooks.npy"),
+            list_indptr=np.load(path / "list_indptr.npy"),
+            list_ids=np.load(path / "list_ids.npy", mmap_mode="r"),
+            list_codes=np.load(path / "list_codes.npy", mmap_mode="r"),
+            nprobe=nprobe,
+            rerank_store=rerank_store,
+            rerank_k=rerank_k,
+        )
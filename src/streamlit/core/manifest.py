@@ -0,0 +1,149 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+MANIFEST_FILENAME = "manifest.sqlite"
+# content hashes covered the metadata before version 2
+HASH_VERSION = "2"
+
+def chunk_hash(page_content: str, embedding_model: str) -> str:
+    """Hash of what a chunk's index entries are computed from: its text and the model that embeds it."""
+    payload = json.dumps({"page_content": page_content, "embedding_model": embedding_model}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def metadata_hash(metadata: dict) -> str:
+    """Hash of a chunk's metadata, which is only stored in its doc table row and filter attributes."""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode("utf-8")).hexdigest()
+
+class ChunkManifest:
+    """
+    SQLite record of every indexed chunk: its page, content and metadata hashes, the embedding model
+    its vector came from and its doc id, plus the tombstoned doc ids of chunks that were changed or
+    deleted.
+    Index files are append-only, so a tombstoned doc id stays in them and is skipped at search time.
+    Changes are only visible to other connections once `commit` is called.
+    """
+
+    def __init__(self, index_dir: str):
+        self.path = Path(index_dir) / MANIFEST_FILENAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                doc_id INTEGER PRIMARY KEY,
+                page_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                embedding_model TEXT NOT NULL,
+                metadata_hash TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS chunks_page_id ON chunks (page_id);
+            CREATE TABLE IF NOT EXISTS tombstones (doc_id INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(chunks)")}
+        if "metadata_hash" not in columns:
+            self.connection.execute("ALTER TABLE chunks ADD COLUMN metadata_hash TEXT NOT NULL DEFAULT ''")
+            self.connection.commit()
+
+    @staticmethod
+    def exists(index_dir: str) -> bool:
+        return (Path(index_dir) / MANIFEST_FILENAME).exists()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def needs_rehash(self) -> bool:
+        """Whether the chunks were hashed by an older version of `chunk_hash`, see `rehash`."""
+        if self.get_meta("hash_version") == HASH_VERSION:
+            return False
+        return self.connection.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is not None
+
+    def rehash(self, rows: Iterable[Tuple[int, str, dict]]):
+        """Recomputes the hashes of indexed chunks from their (doc id, text, metadata) doc table rows."""
+        models = dict(self.connection.execute("SELECT doc_id, embedding_model FROM chunks"))
+        self.connection.executemany(
+            "UPDATE chunks SET content_hash = ?, metadata_hash = ? WHERE doc_id = ?",
+            (
+                (chunk_hash(text, models[doc_id]), metadata_hash(metadata), doc_id)
+                for doc_id, text, metadata in rows if doc_id in models
+            ),
+        )
+        self.set_meta("hash_version", HASH_VERSION)
+
+    def page_ids(self) -> Set[str]:
+        return {row[0] for row in self.connection.execute("SELECT DISTINCT page_id FROM chunks")}
+
+    def diff_page(
+        self,
+        page_id: str,
+        chunks: List[Tuple[str, dict]],
+        embedding_model: str,
+    ) -> Tuple[List[Tuple[str, dict, str, str]], List[Tuple[int, dict, str]], List[int]]:
+        """
+        Compares a page's fresh chunks with the indexed ones: returns the (text, metadata, content
+        hash, metadata hash) of chunks that are new, changed or embedded with another model, the
+        (doc id, metadata, metadata hash) of indexed chunks whose text is unchanged but whose
+        metadata is not, and the doc ids of indexed chunks that no longer exist. Other chunks keep
+        their doc id and are not returned.
+        """
+        indexed: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        for doc_id, content_hash, model, indexed_metadata_hash in self.connection.execute(
+            "SELECT doc_id, content_hash, embedding_model, metadata_hash FROM chunks WHERE page_id = ? ORDER BY doc_id", (page_id,)
+        ):
+            indexed.setdefault((content_hash, model), []).append((doc_id, indexed_metadata_hash))
+
+        changed, updated = [], []
+        for text, metadata in chunks:
+            content_hash, chunk_metadata_hash = chunk_hash(text, embedding_model), metadata_hash(metadata)
+            # a repeated chunk needs as many indexed copies as it has occurrences
+            copies = indexed.get((content_hash, embedding_model))
+            if not copies:
+                changed.append((text, metadata, content_hash, chunk_metadata_hash))
+                continue
+            same = [i for i, (_, copy_hash) in enumerate(copies) if copy_hash == chunk_metadata_hash]
+            doc_id, copy_hash = copies.pop(same[0] if same else 0)
+            if copy_hash != chunk_metadata_hash:
+                updated.append((doc_id, metadata, chunk_metadata_hash))
+        deleted = [doc_id for copies in indexed.values() for doc_id, _ in copies]
+        return changed, updated, deleted
+
+    def add(self, rows: Iterable[Tuple[int, str, str, str, str]]):
+        """Records (doc id, page id, content hash, metadata hash, embedding model) rows."""
+        self.connection.executemany(
+            "INSERT INTO chunks (doc_id, page_id, content_hash, metadata_hash, embedding_model) VALUES (?, ?, ?, ?, ?)", rows,
+        )
+
+    def update_metadata(self, rows: Iterable[Tuple[int, str]]):
+        """Records the new metadata hash of (doc id, metadata hash) rows updated in place."""
+        self.connection.executemany("UPDATE chunks SET metadata_hash = ? WHERE doc_id = ?", ((row_hash, doc_id) for doc_id, row_hash in rows))
+
+    def delete(self, doc_ids: Iterable[int]):
+        """Tombstones doc ids, dropping their chunks from the manifest."""
+        doc_ids = [(int(doc_id),) for doc_id in doc_ids]
+        self.connection.executemany("DELETE FROM chunks WHERE doc_id = ?", doc_ids)
+        self.connection.executemany("INSERT OR IGNORE INTO tombstones (doc_id) VALUES (?)", doc_ids)
+
+    def delete_pages(self, page_ids: Iterable[str]) -> int:
+        """Tombstones every chunk of the given pages, returning how many were deleted."""
+        doc_ids = []
+        for page_id in page_ids:
+            doc_ids += [row[0] for row in self.connection.execute("SELECT doc_id FROM chunks WHERE page_id = ?", (page_id,))]
+        self.delete(doc_ids)
+        return len(doc_ids)
+
+    def tombstones(self) -> np.ndarray:
+        """Sorted tombstoned doc ids."""
+        return np.array([row[0] for row in self.connection.execute("SELECT doc_id FROM tombstones ORDER BY doc_id")], dtype=np.int64)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,147 @@
+import re
+from pathlib import Path
+from typing import List, NamedTuple, Sequence, Tuple
+import numpy as np
+
+QUOTED_PATTERN = re.compile(r'"([^"]*)"')
+# the right operand is a lookahead so chained operators ("a NEAR/2 b NEAR/5 c") all match
+NEAR_PATTERN = re.compile(r"(\w+)\s+NEAR/(\d+)\s+(?=(\w+))")
+NEAR_OPERATOR_PATTERN = re.compile(r"\bNEAR/\d+\b")
+
+class ParsedQuery(NamedTuple):
+    text: str
+    phrases: List[str]
+    nears: List[Tuple[str, str, int]]
+
+    @property
+    def has_constraints(self) -> bool:
+        return bool(self.phrases or self.nears)
+
+def parse_query(query: str) -> ParsedQuery:
+    """
+    Splits `"exact phrase"` and `a NEAR/n b` constraints out of a query. `text` keeps every word
+    (without quotes and operators) for ranking; the constraints only decide which documents match.
+    """
+    phrases = [phrase for phrase in QUOTED_PATTERN.findall(query) if phrase.strip()]
+    unquoted = QUOTED_PATTERN.sub(" ", query)
+    nears = [(left, right, int(distance)) for left, distance, right in NEAR_PATTERN.findall(unquoted)]
+    text = NEAR_OPERATOR_PATTERN.sub(" ", query).replace('"', " ")
+    return ParsedQuery(text, phrases, nears)
+
+def occurrence_keys(doc_ids: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """One sortable int64 per (doc id, position), ordered by doc id then position."""
+    return (doc_ids.astype(np.int64) << 32) | positions.astype(np.int64)
+
+def phrase_matches(occurrences: Sequence[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """
+    Sorted doc ids where the terms occur at consecutive positions, given the (doc ids, positions)
+    occurrences of each phrase term in order. Shifting the i-th term's positions back by i turns the
+    phrase into an intersection of (doc, start position) keys.
+    """
+    keys = None
+    for offset, (doc_ids, positions) in enumerate(occurrences):
+        valid = positions >= offset
+        term_keys = np.sort(occurrence_keys(doc_ids[valid], positions[valid] - offset))
+        keys = term_keys if keys is None else np.intersect1d(keys, term_keys, assume_unique=True)
+        if len(keys) == 0:
+            break
+    if keys is None or len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(keys >> 32)
+
+def near_matches(left: Tuple[np.ndarray, np.ndarray], right: Tuple[np.ndarray, np.ndarray], distance: int) -> np.ndarray:
+    """Sorted doc ids where some occurrence of `left` is within `distance` positions of one of `right`, in either order."""
+    right_keys = np.sort(occurrence_keys(*right))
+    if len(right_keys) == 0 or len(left[0]) == 0:
+        return np.empty(0, dtype=np.int64)
+    left_keys = occurrence_keys(*left)
+    # the nearest right occurrence of each left one is either the next one or the previous one
+    following = np.searchsorted(right_keys, left_keys)
+    matched = np.zeros(len(left_keys), dtype=bool)
+    for neighbor in (following, following - 1):
+        in_range = (neighbor >= 0) & (neighbor < len(right_keys))
+        neighbor_keys = right_keys[np.clip(neighbor, 0, len(right_keys) - 1)]
+        same_doc = (neighbor_keys >> 32) == (left_keys >> 32)
+        matched |= in_range & same_doc & (np.abs(neighbor_keys - left_keys) <= distance)
+    return np.unique(left_keys[matched] >> 32)
+
+class PositionalPostings:
+    """
+    Token positions for every posting of a `BM25Index`, in the same order as its postings: the
+    positions of posting `p` are `deltas[indptr[p]:indptr[p + 1]]`, delta-encoded (the first one
+    absolute, then gaps) so they fit in uint16 for all but very long documents.
+    """
+
+    def __init__(self, indptr: np.ndarray, deltas: np.ndarray):
+        self.indptr = indptr
+        self.deltas = deltas
+
+    @property
+    def num_postings(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.deltas.nbytes
+
+    @classmethod
+    def encode(cls, positions: np.ndarray, counts: np.ndarray) -> "PositionalPostings":
+        """Encodes absolute `positions` grouped by posting (`counts` per posting), ascending within each group."""
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        positions = np.asarray(positions, dtype=np.int64)
+        deltas = np.diff(positions, prepend=0)
+        group_starts = indptr[:-1][counts > 0]
+        deltas[group_starts] = positions[group_starts]
+        dtype = np.uint16 if len(deltas) == 0 or deltas.max() <= np.iinfo(np.uint16).max else np.uint32
+        return cls(indptr, deltas.astype(dtype))
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["PositionalPostings"]) -> "PositionalPostings":
+        offsets = np.cumsum([0] + [len(part.deltas) for part in parts[:-1]])
+        indptr = np.concatenate([[0]] + [np.asarray(part.indptr[1:]) + offset for part, offset in zip(parts, offsets)])
+        dtype = np.result_type(*[part.deltas.dtype for part in parts])
+        return cls(indptr.astype(np.int64), np.concatenate([np.asarray(part.deltas, dtype=dtype) for part in parts]))
+
+    def _gather(self, postings: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Deltas of the selected postings, concatenated, with their group sizes and start offsets."""
+        starts = self.indptr[postings]
+        counts = self.indptr[postings + 1] - starts
+        group_starts = np.cumsum(counts) - counts
+        index = np.repeat(starts - group_starts, counts) + np.arange(counts.sum())
+        return self.deltas[index].astype(np.int64), counts, group_starts
+
+    def take(self, postings: np.ndarray) -> "PositionalPostings":
+        """The positions of `postings`, in that order (deltas are per posting, so they move as-is)."""
+        deltas, counts, _ = self._gather(np.asarray(postings))
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return PositionalPostings(indptr, deltas.astype(self.deltas.dtype))
+
+    def decode(self, postings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Absolute positions of `postings`, with the index into `postings` each position belongs to."""
+        deltas, counts, group_starts = self._gather(np.asarray(postings))
+        if len(deltas) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        running = np.cumsum(deltas)
+        nonempty = counts > 0
+        # subtracting the running total before each group restarts the prefix sum per posting
+        bases = np.zeros(len(counts), dtype=np.int64)
+        bases[nonempty] = running[group_starts[nonempty]] - deltas[group_starts[nonempty]]
+        owners = np.repeat(np.arange(len(counts)), counts)
+        return owners, running - bases[owners]
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "position_indptr.npy", self.indptr)
+        np.save(path / "position_deltas.npy", self.deltas)
+
+    @classmethod
+    def load(cls, path: str) -> "PositionalPostings":
+        path = Path(path)
+        return cls(np.load(path / "position_indptr.npy", mmap_mode="r"), np.load(path / "position_deltas.npy", mmap_mode="r"))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / "position_indptr.npy").exists()
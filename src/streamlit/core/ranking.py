@@ -0,0 +1,32 @@
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, ordered by descending score then ascending position."""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        # argpartition only gives us the k-th value, gather all ties so the ordering is deterministic
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return candidates[order]
+
+def reciprocal_rank_fusion(rankings: List[Sequence[int]], k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuses several best-first rankings of doc ids with RRF: score(d) = sum over rankings of 1 / (k + rank(d)).
+    Returns the fused doc ids and scores, best first.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank)
+    if not fused:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    doc_ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+    best = top_k(scores, len(scores))
+    return doc_ids[best], scores[best]
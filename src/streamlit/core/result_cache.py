@@ -0,0 +1,89 @@
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Mapping, Optional, Tuple
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace do not change what the retrievers match, so they do not change the cache key either."""
+    return " ".join(query.casefold().split())
+
+def freeze(value: Any) -> Hashable:
+    """Hashable, order-independent form of search params (dicts, lists of dates, ...)."""
+    if isinstance(value, Mapping):
+        return tuple(sorted((str(key), freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+def generation_key(signatures: Dict[str, Any]) -> str:
+    """
+    Digest of the file signatures an index generation was loaded from. Unlike the generation
+    number, which restarts whenever an index is reopened, it only changes with the index files.
+    """
+    return hashlib.blake2b(repr(sorted(signatures.items())).encode("utf-8"), digest_size=16).hexdigest()
+
+class ResultCache:
+    """
+    Search results shared by every session of the process, keyed by `(normalized query, search
+    params, index generation)`. Holds at most `max_entries`, evicting the least recently used, and
+    entries expire `ttl` seconds after they were stored (0 keeps them until evicted).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(query: str, search_params: Mapping[str, Any], generation: str) -> Hashable:
+        return normalize_query(query), freeze(search_params), generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
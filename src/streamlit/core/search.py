@@ -1,9 +1,54 @@
 import asyncio
+import datetime
 import random
-from typing import List
+import time
+from contextvars import ContextVar
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
 from langchain_core.documents import Document
+from loguru import logger
+from core.answer_cache import AnswerCache, answer_key
+from core.bm25 import BM25Index
 from core.conversation_handler import ConversationHandler
+from core.dedup import DedupWriter, live_top_k, load_cluster_ids
+from core.dense import DenseIndex
+from core.doc_table import DOC_STORE_DIRNAME, DOC_TABLE_FILENAME, DOC_UPDATES_FILENAME, METADATA_DIRNAME, DocTable
+from core.embedding_store import EmbeddingStore
+from core.embeddings import embed_query
+from core.files import file_signature
+from core.filters import FilterIndex
+from core.hnsw import HNSWIndex
+from core.index_handle import (
+    PUBLISH_FILENAME,
+    IndexGeneration,
+    IndexHandle,
+    read_published_component_generation,
+    read_published_generation,
+)
+from core.index_registry import IndexRegistry
+from core.ingestion import DEFAULT_DATA_SOURCE
+from core.ivfpq import IVFPQIndex
+from core.manifest import MANIFEST_FILENAME, ChunkManifest
+from core.ranking import reciprocal_rank_fusion
+from core.result_cache import ResultCache, generation_key
+from core.semantic_cache import SemanticCache
+from core.segments import Segment, SegmentedIndex, manifest_filename
 from core.settings import settings
+from core.sharding import ShardedLexicalIndex, ShardPool
+from core.snapshot import (
+    SNAPSHOT_FILENAME,
+    Snapshot,
+    open_index_snapshot,
+    snapshot_cluster_ids,
+    snapshot_doc_table,
+    snapshot_embeddings,
+    snapshot_filter_index,
+    snapshot_lexical_index,
+    snapshot_tombstones,
+)
+from schemas.search import SearchLeg, SearchResponse
 
 async def mock_get_source_documents(search: str) -> List[Document]:
     await asyncio.sleep(random.random() * 2)
@@ -17,6 +62,463 @@ async def mock_get_source_documents(search: str) -> List[Document]:
         ) for i in range(20)
     ]
 
+def load_snapshot(index_dir: Path) -> Optional[Snapshot]:
+    """
+    The index snapshot, if one was written for the published index: every component then maps it
+    instead of parsing files. Opened once per index generation and passed to each component loader.
+    """
+    try:
+        return open_index_snapshot(index_dir, read_published_generation(index_dir))
+    except ValueError as e:
+        logger.warning(f"Ignoring index snapshot: {e}")
+        return None
+
+def load_doc_table(index_dir: Path, snapshot: Optional[Snapshot]) -> DocTable:
+    if snapshot is not None:
+        logger.info(f"Mapping doc table from '{snapshot.path}'")
+        return snapshot_doc_table(snapshot, cache_blocks=settings.doc_store_cache_blocks)
+    logger.info(f"Loading doc table from '{index_dir}'")
+    return DocTable.load(index_dir, cache_blocks=settings.doc_store_cache_blocks)
+
+def load_lexical_index(index_dir: Path, snapshot: Optional[Snapshot]) -> Union[BM25Index, Segment, SegmentedIndex, ShardedLexicalIndex]:
+    # the ingestion job commits segments before it publishes them
+    generation = read_published_component_generation(index_dir, "lexical")
+    lexical_dir = index_dir / "lexical"
+    if settings.lexical_shards > 1 and SegmentedIndex.exists(lexical_dir):
+        # shards are served from the segment files, the snapshot only holds one compacted index
+        logger.info(f"Opening '{lexical_dir}' in {settings.lexical_shards} lexical shard workers")
+        return get_shard_pool().open(
+            lexical_dir,
+            generation,
+            # the shards filter and collapse their own results, so they are reloaded with them (see `lexical_signature`)
+            filters=load_filter_index(index_dir, snapshot),
+            tombstones=load_tombstones(index_dir, snapshot),
+            cluster_ids=load_cluster_ids_if_enabled(index_dir, snapshot),
+        )
+    index_dir = lexical_dir
+    if snapshot is not None:
+        logger.info(f"Mapping lexical index from '{snapshot.path}'")
+        return snapshot_lexical_index(snapshot)
+    if SegmentedIndex.exists(index_dir):
+        logger.info(f"Opening segmented lexical index at '{index_dir}'")
+        # pinned, so a generation keeps the segments it opened while the ingestion job merges them
+        return SegmentedIndex(index_dir).pin(generation)
+    logger.info(f"Loading lexical index from '{index_dir}'")
+    return BM25Index.load(index_dir)
+
+def load_dense_index(index_dir: Path, snapshot: Optional[Snapshot]) -> Union[DenseIndex, EmbeddingStore, HNSWIndex, IVFPQIndex]:
+    index_dir = index_dir / "dense"
+    snapshot_dense_index = snapshot_embeddings(snapshot) if snapshot is not None else None
+    if settings.dense_index_type == "ivfpq":
+        if isinstance(snapshot_dense_index, EmbeddingStore):
+            rerank_store = snapshot_dense_index
+        else:
+            rerank_store = EmbeddingStore.open(index_dir) if EmbeddingStore.exists(index_dir) else None
+        if not IVFPQIndex.exists(index_dir / "ivfpq"):
+            logger.warning(f"No IVF-PQ index at '{index_dir / 'ivfpq'}', searching the embeddings exhaustively: ingest with --dense-index ivfpq to build it")
+        else:
+            logger.info(f"Loading IVF-PQ index from '{index_dir / 'ivfpq'}'")
+            ivfpq_index = IVFPQIndex.load(
+                index_dir / "ivfpq",
+                nprobe=settings.ivfpq_nprobe,
+                # full vectors are only touched for the re-ranked shortlist, so they can stay on disk
+                rerank_store=rerank_store,
+                rerank_k=settings.ivfpq_rerank_k,
+            )
+            if rerank_store is None or ivfpq_index.num_docs == rerank_store.num_docs:
+                return ivfpq_index
+            # embeddings appended without encoding them, which would never be returned
+            logger.warning(f"Ignoring IVF-PQ index of {ivfpq_index.num_docs} embeddings, searching the {rerank_store.num_docs} stored exhaustively")
+    if snapshot_dense_index is not None:
+        logger.info(f"Mapping dense index from '{snapshot.path}'")
+        dense_index = snapshot_dense_index
+        embeddings = dense_index if isinstance(dense_index, EmbeddingStore) else dense_index.embeddings
+    elif EmbeddingStore.exists(index_dir):
+        logger.info(f"Loading dense index from '{index_dir}'")
+        # memory-mapped (optionally quantized) store, shared with other processes via the page cache
+        dense_index = EmbeddingStore.open(index_dir)
+        embeddings = dense_index
+    else:
+        logger.info(f"Loading dense index from '{index_dir}'")
+        dense_index = DenseIndex.load(index_dir)
+        embeddings = dense_index.embeddings
+    if settings.dense_index_type == "hnsw":
+        if not HNSWIndex.exists(index_dir / "hnsw"):
+            logger.warning(f"No HNSW graph at '{index_dir / 'hnsw'}', searching the embeddings exhaustively: ingest with --dense-index hnsw to build it")
+            return dense_index
+        try:
+            logger.info(f"Loading HNSW graph from '{index_dir / 'hnsw'}'")
+            return HNSWIndex.load(index_dir / "hnsw", embeddings, ef_search=settings.hnsw_ef_search)
+        except ValueError as e:
+            # embeddings appended without rebuilding the graph, which would never return them
+            logger.warning(f"Ignoring HNSW graph, searching the embeddings exhaustively: {e}")
+    return dense_index
+
+def load_filter_index(index_dir: Path, snapshot: Optional[Snapshot]) -> Optional[FilterIndex]:
+    if snapshot is not None and "filters/dates" in snapshot:
+        return snapshot_filter_index(snapshot)
+    index_dir = index_dir / "filters"
+    if not FilterIndex.exists(index_dir):
+        logger.warning(f"No filter index at '{index_dir}', search filters will be ignored")
+        return None
+    logger.info(f"Loading filter index from '{index_dir}'")
+    return FilterIndex.load(index_dir)
+
+def load_tombstones(index_dir: Path, snapshot: Optional[Snapshot]) -> np.ndarray:
+    """Sorted doc ids of chunks deleted or replaced by incremental ingestion, which are still in the index files."""
+    if snapshot is not None:
+        return snapshot_tombstones(snapshot)
+    if not ChunkManifest.exists(index_dir):
+        return np.empty(0, dtype=np.int64)
+    manifest = ChunkManifest(index_dir)
+    tombstones = manifest.tombstones()
+    manifest.close()
+    if len(tombstones):
+        logger.info(f"Skipping {len(tombstones)} tombstoned docs, a full re-ingestion would drop them from the index")
+    return tombstones
+
+def load_cluster_ids_if_enabled(index_dir: Path, snapshot: Optional[Snapshot]) -> Optional[np.ndarray]:
+    """Near-duplicate cluster id of every doc id, or None when duplicates are not collapsed."""
+    if not settings.dedup_results:
+        return None
+    if snapshot is not None:
+        return snapshot_cluster_ids(snapshot)
+    index_dir = index_dir / "dedup"
+    if not DedupWriter.exists(index_dir):
+        logger.warning(f"No near-duplicate clusters at '{index_dir}', duplicate results will not be collapsed")
+        return None
+    return load_cluster_ids(index_dir)
+
+def index_signature(index_dir: Path, *paths: str) -> tuple:
+    """Signatures of the files a component is reloaded on: its last-written (commit) files, and the snapshot."""
+    return tuple(file_signature(index_dir / path) for path in (*paths, SNAPSHOT_FILENAME))
+
+def lexical_signature(index_dir: Path) -> tuple:
+    """A segmented lexical index is reloaded on its published generation, not on the commits made while ingesting."""
+    generation = read_published_component_generation(index_dir, "lexical")
+    signature = (generation, *index_signature(index_dir, f"lexical/{manifest_filename(generation)}", "lexical/vocab.json"))
+    if settings.lexical_shards > 1:
+        # the shard workers hold their own copy of the filters, tombstones and clusters
+        signature += index_signature(index_dir, *(path for name in ("filters", "tombstones", "clusters") for path in INDEX_COMPONENTS[name][0]))
+    return signature
+
+# component name: (files it is reloaded on, or a signature function of the index directory, loader)
+INDEX_COMPONENTS = {
+    "doc_table": ((DOC_TABLE_FILENAME, DOC_UPDATES_FILENAME, f"{DOC_STORE_DIRNAME}/page_contents/store.json", f"{METADATA_DIRNAME}/table.json"), load_doc_table),
+    "lexical": (lexical_signature, load_lexical_index),
+    "dense": (("dense/store.json", "dense/embeddings.npy", "dense/hnsw/hnsw.json", "dense/ivfpq/ivfpq.json"), load_dense_index),
+    "filters": (("filters/sources.json",), load_filter_index),
+    "tombstones": ((MANIFEST_FILENAME,), load_tombstones),
+    "clusters": (("dedup/cluster_ids.npy",), load_cluster_ids_if_enabled),
+}
+
+SEARCH_MODE_COMPONENTS = {
+    "lexical": ("doc_table", "lexical", "filters", "tombstones", "clusters"),
+    "dense": ("doc_table", "dense", "filters", "tombstones", "clusters"),
+    "hybrid": ("doc_table", "lexical", "dense", "filters", "tombstones", "clusters"),
+}
+
+# the generation a search acquired, seen by every retriever it runs (including worker threads)
+active_generation: ContextVar[Optional[IndexGeneration]] = ContextVar("active_generation", default=None)
+
+def open_index(index_dir: Path) -> IndexHandle:
+    """Loads the index of a data source and starts following its publishes."""
+    names = SEARCH_MODE_COMPONENTS.get(settings.search_mode, ())
+    components = {}
+    for name in names:
+        paths, load = INDEX_COMPONENTS[name]
+        signature = partial(paths, index_dir) if callable(paths) else partial(index_signature, index_dir, *paths)
+        components[name] = (signature, partial(load, index_dir))
+    handle = IndexHandle(components, marker=index_dir / PUBLISH_FILENAME, open_shared=partial(load_snapshot, index_dir))
+    handle.reload()
+    if settings.index_reload_interval > 0:
+        handle.start_watching(settings.index_reload_interval)
+    return handle
+
+def close_index(index_dir: Path, handle: IndexHandle):
+    handle.close()
+
+@lru_cache(maxsize=1)
+def get_index_registry() -> IndexRegistry:
+    return IndexRegistry(
+        settings.index_dir,
+        open_index,
+        close_index,
+        max_bytes=int(settings.index_cache_mb * 2**20),
+        default_source=DEFAULT_DATA_SOURCE,
+    )
+
+@lru_cache(maxsize=1)
+def get_shard_pool() -> ShardPool:
+    logger.info(f"Starting {settings.lexical_shards} lexical shard workers")
+    return ShardPool(settings.lexical_shards)
+
+@lru_cache(maxsize=1)
+def get_result_cache() -> ResultCache:
+    return ResultCache(max_entries=settings.result_cache_size, ttl=settings.result_cache_ttl)
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> Optional[SemanticCache]:
+    if settings.semantic_cache_size <= 0:
+        return None
+    return SemanticCache(
+        max_entries=settings.semantic_cache_size,
+        threshold=settings.semantic_cache_threshold,
+        ttl=settings.result_cache_ttl,
+    )
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> Optional[AnswerCache]:
+    return AnswerCache(settings.answer_cache_path) if settings.answer_cache_path else None
+
+def get_index_handle(data_source: Optional[str] = None) -> IndexHandle:
+    return get_index_registry().get(data_source)
+
+def current_generation() -> IndexGeneration:
+    generation = active_generation.get()
+    return generation if generation is not None else get_index_handle().current
+
+def get_doc_table() -> DocTable:
+    return current_generation()["doc_table"]
+
+def get_lexical_index() -> Union[BM25Index, Segment, SegmentedIndex, ShardedLexicalIndex]:
+    return current_generation()["lexical"]
+
+def get_dense_index() -> Union[DenseIndex, EmbeddingStore, HNSWIndex, IVFPQIndex]:
+    return current_generation()["dense"]
+
+def get_filter_index() -> Optional[FilterIndex]:
+    return current_generation()["filters"]
+
+def get_tombstones() -> np.ndarray:
+    return current_generation()["tombstones"]
+
+def get_cluster_ids() -> Optional[np.ndarray]:
+    return current_generation()["clusters"]
+
+def get_allowed_ids(search_params: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Resolves the sidebar filters into the sorted doc ids retrieval is restricted to (None = unfiltered)."""
+    filter_index = get_filter_index()
+    if filter_index is None or not search_params:
+        return None
+    return filter_index.allowed_ids(
+        data_source=search_params.get("data_source"),
+        date_range=search_params.get("date_range"),
+    )
+
+def lexical_search(
+    search: str,
+    k: int,
+    allowed_ids: Optional[np.ndarray] = None,
+    date_range: Optional[Sequence[datetime.date]] = None,
+    data_source: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    lexical_index = get_lexical_index()
+    if isinstance(lexical_index, ShardedLexicalIndex):
+        # the shards resolve the filters and drop tombstones and near-duplicates themselves
+        return lexical_index.top_k(search, k, data_source=data_source, date_range=date_range)
+    if isinstance(lexical_index, SegmentedIndex):
+        # only the segments overlapping the date range are scored
+        top_k = lambda k, allowed_ids: lexical_index.top_k(search, k, allowed_ids=allowed_ids, date_range=date_range)
+    else:
+        top_k = lambda k, allowed_ids: lexical_index.top_k(search, k, allowed_ids=allowed_ids)
+    return live_top_k(top_k, k, allowed_ids, get_tombstones(), get_cluster_ids())
+
+async def dense_search(
+    search: str,
+    k: int,
+    allowed_ids: Optional[np.ndarray] = None,
+    query_vector: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if query_vector is None:
+        query_vector = await embed_query(search)
+    dense_index = get_dense_index()
+    top_k = lambda k, allowed_ids: dense_index.top_k(query_vector, k, allowed_ids=allowed_ids)
+    return live_top_k(top_k, k, allowed_ids, get_tombstones(), get_cluster_ids())
+
+def no_results() -> Tuple[np.ndarray, np.ndarray]:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+async def run_search_leg(
+    name: str,
+    coroutine: Awaitable[Tuple[np.ndarray, np.ndarray]],
+    timeout: Optional[float],
+) -> Tuple[SearchLeg, Tuple[np.ndarray, np.ndarray]]:
+    """Runs one retriever with its own timeout, recording how long it took and whether it contributed."""
+    start_time = time.time()
+    try:
+        doc_ids, scores = await asyncio.wait_for(coroutine, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Search leg '{name}' timed out after {timeout}s")
+        return SearchLeg(name=name, duration=time.time() - start_time, timed_out=True), no_results()
+    except Exception as e:
+        logger.error(f"Search leg '{name}' failed: {e}")
+        return SearchLeg(name=name, duration=time.time() - start_time, error=str(e)), no_results()
+    return SearchLeg(name=name, duration=time.time() - start_time, num_results=len(doc_ids)), (doc_ids, scores)
+
+async def hybrid_search(
+    search: str,
+    k: int,
+    allowed_ids: Optional[np.ndarray] = None,
+    date_range: Optional[Sequence[datetime.date]] = None,
+    query_vector: Optional[np.ndarray] = None,
+    data_source: Optional[str] = None,
+) -> Tuple[List[SearchLeg], Tuple[np.ndarray, np.ndarray]]:
+    """Runs the lexical and dense legs concurrently and fuses their rankings with RRF."""
+    leg_results = await asyncio.gather(
+        # lexical scoring is CPU-bound, so it runs in a worker thread to overlap with the embedding call
+        run_search_leg(
+            "lexical", asyncio.to_thread(lexical_search, search, k, allowed_ids, date_range, data_source), settings.lexical_timeout,
+        ),
+        run_search_leg("dense", dense_search(search, k, allowed_ids, query_vector), settings.dense_timeout),
+    )
+    # the legs can return different copies of a near-duplicate, so they are fused by cluster
+    cluster_ids = get_cluster_ids()
+    representatives = {}
+    rankings = []
+    for _, (doc_ids, _) in leg_results:
+        fusion_ids = (cluster_ids[doc_ids] if cluster_ids is not None else doc_ids).tolist()
+        rankings.append(fusion_ids)
+        for fusion_id, doc_id in zip(fusion_ids, doc_ids.tolist()):
+            representatives.setdefault(fusion_id, doc_id)
+
+    fusion_ids, scores = reciprocal_rank_fusion(rankings, k=settings.rrf_k)
+    doc_ids = np.array([representatives[fusion_id] for fusion_id in fusion_ids[:k].tolist()], dtype=np.int64)
+    return [leg for leg, _ in leg_results], (doc_ids, scores[:k].astype(np.float32))
+
+def search_response(
+    doc_table: DocTable,
+    doc_ids: np.ndarray,
+    scores: np.ndarray,
+    legs: List[SearchLeg],
+    search_params: Dict[str, Any],
+) -> SearchResponse:
+    """Orders the results as asked in the sidebar and counts them per year, both over the metadata columns."""
+    order = doc_table.metadatas.sort(doc_ids, by=search_params.get("sort_by", "relevance"))
+    doc_ids, scores = doc_ids[order], scores[order]
+    return SearchResponse(
+        doc_ids=doc_ids,
+        scores=scores,
+        doc_table=doc_table,
+        legs=legs,
+        facets={"year": doc_table.metadatas.facet(doc_ids, "year")},
+    )
+
+async def get_source_documents(search: str, search_params: Dict[str, Any] = {}) -> SearchResponse:
+    if settings.search_mode not in SEARCH_MODE_COMPONENTS:
+        return await search_generation(search, search_params)
+    data_source = search_params.get("data_source")
+    try:
+        get_index_registry().index_dir(data_source)
+    except ValueError as e:
+        logger.error(str(e))
+        return SearchResponse.empty()
+    # the whole search runs on one index generation, even if a newer one is swapped in meanwhile
+    with get_index_registry().acquire(data_source) as generation:
+        token = active_generation.set(generation)
+        try:
+            return await cached_search(search, search_params, generation)
+        finally:
+            active_generation.reset(token)
+
+def cached_response(index_generation: IndexGeneration, cached: Tuple[np.ndarray, np.ndarray, List[SearchLeg], Dict[str, Dict[str, int]]], **fields) -> SearchResponse:
+    doc_ids, scores, legs, facets = cached
+    return SearchResponse(doc_ids=doc_ids, scores=scores, doc_table=index_generation["doc_table"], legs=legs, facets=facets, cached=True, **fields)
+
+async def cached_search(search: str, search_params: Dict[str, Any], generation: IndexGeneration) -> SearchResponse:
+    """
+    Serves the search from the result cache, or from the semantic cache when a paraphrase of it was
+    cached, and otherwise runs it and caches it in both. A sample of the semantic hits is re-run
+    to measure how often a paraphrase is served results that differ from its own.
+    """
+    result_cache = get_result_cache()
+    key = result_cache.key(search, search_params, generation_key(generation.signatures))
+    # where the results come from, for the answers generated from them
+    source = {"data_source": search_params.get("data_source"), "generation": key[2]}
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached_response(generation, cached, **source)
+
+    semantic_cache = get_semantic_cache()
+    query_vector = entry = None
+    if semantic_cache is not None:
+        try:
+            query_vector = await embed_query(search)
+        except Exception as e:
+            logger.error(f"Semantic cache lookup failed: {e}")
+        if query_vector is not None:
+            entry = semantic_cache.lookup(query_vector, key[1:])
+        if entry is not None and random.random() >= settings.semantic_cache_verify_rate:
+            answer = entry.answer if settings.semantic_cache_answers else None
+            return cached_response(generation, entry.value, semantic_match=entry.query, answer=answer, cache_entry=entry.entry_id, **source)
+
+    response = await search_generation(search, search_params, query_vector)
+    response.data_source, response.generation = source["data_source"], source["generation"]
+    if entry is not None:
+        # the first page is what the user would have been served from the cache instead
+        page = lambda doc_ids: set(doc_ids[:settings.page_size].tolist())
+        semantic_cache.verify(page(entry.value[0]) == page(response.doc_ids))
+    # results missing a timed out or failed leg are not kept, the next search retries it
+    if all(leg.error is None and not leg.timed_out for leg in response.legs):
+        cached = (response.doc_ids, response.scores, response.legs, response.facets)
+        result_cache.put(key, cached)
+        if query_vector is not None:
+            response.cache_entry = semantic_cache.put(search, query_vector, key[1:], cached)
+    return response
+
+def cache_answer(response: SearchResponse, answer: str):
+    """Keeps the RAG answer generated from a search's results for the paraphrases of its query."""
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None and response.cache_entry is not None:
+        semantic_cache.set_answer(response.cache_entry, answer)
+
+def answer_cache_key(handler: ConversationHandler, question: str, response: SearchResponse) -> Optional[str]:
+    """Key of the answer to `question` from the results, if it is deterministic (temperature 0) and can be cached."""
+    if get_answer_cache() is None or handler.temperature != 0 or response.generation is None:
+        return None
+    return answer_key(handler.model, handler.max_tokens, handler.prompt_hash(), question, response.doc_ids.tolist())
+
+def cached_answer(handler: ConversationHandler, question: str, response: SearchResponse) -> Optional[str]:
+    key = answer_cache_key(handler, question, response)
+    return get_answer_cache().get(key, response.generation) if key is not None else None
+
+def store_answer(handler: ConversationHandler, question: str, response: SearchResponse, answer: str):
+    key = answer_cache_key(handler, question, response)
+    if key is not None:
+        get_answer_cache().put(key, response.data_source or "", response.generation, answer)
+
+async def search_generation(search: str, search_params: Dict[str, Any], query_vector: Optional[np.ndarray] = None) -> SearchResponse:
+    k = settings.search_top_k
+    if settings.search_mode == "mock":
+        start_time = time.time()
+        documents = await mock_get_source_documents(search)
+        leg = SearchLeg(name="mock", duration=time.time() - start_time, num_results=len(documents))
+        doc_ids = np.arange(len(documents), dtype=np.int64)
+        return search_response(DocTable.from_documents(documents), doc_ids, np.zeros(len(documents), dtype=np.float32), [leg], search_params)
+
+    # filters are applied inside the retrievers, before top-k, so they never cost results
+    date_range = search_params.get("date_range")
+    data_source = search_params.get("data_source")
+    if settings.search_mode == "lexical" and isinstance(get_lexical_index(), ShardedLexicalIndex):
+        # resolved by the shards instead
+        allowed_ids = None
+    else:
+        allowed_ids = get_allowed_ids(search_params)
+    if settings.search_mode == "hybrid":
+        legs, (doc_ids, scores) = await hybrid_search(search, k, allowed_ids, date_range, query_vector, data_source)
+    elif settings.search_mode == "lexical":
+        leg, (doc_ids, scores) = await run_search_leg(
+            "lexical", asyncio.to_thread(lexical_search, search, k, allowed_ids, date_range, data_source), settings.lexical_timeout,
+        )
+        legs = [leg]
+    elif settings.search_mode == "dense":
+        leg, (doc_ids, scores) = await run_search_leg("dense", dense_search(search, k, allowed_ids, query_vector), settings.dense_timeout)
+        legs = [leg]
+    else:
+        logger.error(f"Search mode '{settings.search_mode}' not supported.")
+        return SearchResponse.empty()
+    return search_response(get_doc_table(), doc_ids, scores, legs, search_params)
+
 async def get_rag_response(search_query: str, source_documents: List[Document]) -> str:
     # non-streaming response
     handler = ConversationHandler(
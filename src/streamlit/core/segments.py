@@ -0,0 +1,538 @@
+import copy
+import datetime
+import json
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+import numpy as np
+from pydantic import BaseModel
+
+from core.bm25 import BM25Index
+from core.files import atomic_write_json, file_lock
+from core.filters import MISSING_DATE, contains, to_day
+from core.positions import PositionalPostings
+from core.ranking import top_k
+
+UNDATED_PARTITION = "undated"
+MANIFEST_FILENAME = "manifest.json"
+
+def manifest_filename(generation: Optional[int] = None) -> str:
+    """Manifest of a committed generation, or the head manifest (the latest commit) for None."""
+    return MANIFEST_FILENAME if generation is None else f"manifest_{generation:08d}.json"
+
+class SegmentInfo(BaseModel):
+    name: str
+    partition: str
+    min_date: int
+    max_date: int
+    num_docs: int
+    level: int = 0
+
+    def overlaps(self, start_day: int, end_day: int) -> bool:
+        return self.min_date <= end_day and self.max_date >= start_day
+
+def month_partition(day: int) -> str:
+    if day == MISSING_DATE:
+        return UNDATED_PARTITION
+    return str(np.datetime64(int(day), "D").astype("datetime64[M]"))
+
+class Segment:
+    """
+    An opened segment: a BM25 index over local doc ids plus the sorted global doc id of each local
+    id. `block_impacts` (see `BM25Index.block_impacts`) are saved with it, so its block upper
+    bounds can be rescaled to the collection statistics without rescanning the postings.
+    """
+
+    def __init__(self, info: SegmentInfo, index: BM25Index, global_ids: np.ndarray, block_impacts: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        self.info = info
+        self.index = index
+        self.global_ids = global_ids
+        self.block_impacts = block_impacts
+
+    @classmethod
+    def load(cls, path: Path, info: SegmentInfo) -> "Segment":
+        block_impacts = None
+        # segments written before impacts were saved get their bounds from the postings
+        if (path / "block_max_tfs.npy").exists():
+            block_impacts = (np.load(path / "block_max_tfs.npy", mmap_mode="r"), np.load(path / "block_min_lengths.npy", mmap_mode="r"))
+        return cls(info, BM25Index.load(path), np.load(path / "global_ids.npy", mmap_mode="r"), block_impacts)
+
+    def save(self, path: Path):
+        self.index.save(path)
+        np.save(path / "global_ids.npy", self.global_ids)
+        if self.block_impacts is None:
+            self.block_impacts = self.index.block_impacts()
+        max_term_freqs, min_doc_lengths = self.block_impacts
+        np.save(path / "block_max_tfs.npy", max_term_freqs)
+        np.save(path / "block_min_lengths.npy", min_doc_lengths)
+
+    def top_k(self, query: str, k: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `BM25Index.top_k`, but taking and returning global doc ids."""
+        local_allowed = None
+        if allowed_ids is not None:
+            allowed_ids = allowed_ids[contains(self.global_ids, allowed_ids)]
+            if len(allowed_ids) == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            local_allowed = np.searchsorted(self.global_ids, allowed_ids)
+        local_ids, scores = self.index.top_k(query, k, allowed_ids=local_allowed)
+        return np.asarray(self.global_ids[local_ids], dtype=np.int64), scores
+
+    def deleted_stats(self, deleted: np.ndarray) -> Tuple[int, float, Dict[str, int]]:
+        """Document count, total length and per-term document frequencies of the `deleted` (sorted) global ids held here."""
+        deleted = np.flatnonzero(contains(deleted, np.asarray(self.global_ids)))
+        if len(deleted) == 0:
+            return 0, 0.0, {}
+        index = self.index
+        postings = contains(deleted, np.asarray(index.doc_ids))
+        term_ids = np.repeat(np.arange(len(index.vocab)), np.diff(index.indptr))[postings]
+        doc_freqs = np.bincount(term_ids, minlength=len(index.vocab))
+        terms = np.empty(len(index.vocab), dtype=object)
+        terms[list(index.vocab.values())] = list(index.vocab)
+        nonzero = np.flatnonzero(doc_freqs)
+        return (
+            len(deleted),
+            float(np.sum(np.asarray(index.doc_lengths)[deleted], dtype=np.float64)),
+            dict(zip(terms[nonzero].tolist(), doc_freqs[nonzero].tolist())),
+        )
+
+def concatenate_segments(segments: Sequence[Segment], deleted: Optional[np.ndarray] = None) -> Tuple[BM25Index, np.ndarray]:
+    """
+    One BM25 index over the documents of all `segments`, with the sorted global id of each of its
+    local ids. Documents whose global id is in `deleted` (sorted) are left out.
+    """
+    vocab: Dict[str, int] = {}
+    term_chunks, doc_chunks, tf_chunks, length_chunks, position_chunks = [], [], [], [], []
+    for segment in segments:
+        index = segment.index
+        terms = np.empty(len(index.vocab), dtype=object)
+        terms[list(index.vocab.values())] = list(index.vocab)
+        term_map = np.fromiter((vocab.setdefault(term, len(vocab)) for term in terms), dtype=np.int64, count=len(terms))
+        term_chunks.append(np.repeat(term_map, np.diff(index.indptr)))
+        doc_chunks.append(np.asarray(segment.global_ids)[index.doc_ids])
+        tf_chunks.append(np.asarray(index.term_freqs))
+        length_chunks.append(np.asarray(index.doc_lengths))
+        position_chunks.append(index.positions)
+
+    all_global_ids = np.concatenate([np.asarray(segment.global_ids) for segment in segments])
+    posting_global_ids = np.concatenate(doc_chunks)
+    term_ids, term_freqs, lengths = np.concatenate(term_chunks), np.concatenate(tf_chunks), np.concatenate(length_chunks)
+    positions = PositionalPostings.concatenate(position_chunks) if None not in position_chunks else None
+    if deleted is not None and len(deleted):
+        kept_docs = ~contains(deleted, all_global_ids)
+        all_global_ids, lengths = all_global_ids[kept_docs], lengths[kept_docs]
+        kept_postings = ~contains(deleted, posting_global_ids)
+        posting_global_ids, term_ids, term_freqs = posting_global_ids[kept_postings], term_ids[kept_postings], term_freqs[kept_postings]
+        if positions is not None:
+            positions = positions.take(np.flatnonzero(kept_postings))
+    order = np.argsort(all_global_ids, kind="stable")
+    global_ids = all_global_ids[order]
+    merged = BM25Index.from_postings(
+        vocab,
+        term_ids,
+        np.searchsorted(global_ids, posting_global_ids),
+        term_freqs,
+        lengths[order],
+        k1=segments[0].index.k1,
+        b=segments[0].index.b,
+        positions=positions,
+    )
+    return merged, global_ids
+
+class TieredMergePolicy:
+    """
+    LSM-style tiered merging, kept within a time partition so merged segments never widen the date
+    span a query has to open: once a partition holds `merge_factor` segments of the same level they
+    are merged into one segment of the next level. Above `max_segments` segments in total, the most
+    fragmented partitions are compacted into a single segment each.
+    """
+
+    def __init__(self, merge_factor: int = 4, max_segments: int = 64):
+        self.merge_factor = merge_factor
+        self.max_segments = max_segments
+
+    def find_merges(self, segments: Sequence[SegmentInfo]) -> List[List[str]]:
+        by_partition: Dict[str, List[SegmentInfo]] = {}
+        for info in segments:
+            by_partition.setdefault(info.partition, []).append(info)
+
+        merges = []
+        for infos in by_partition.values():
+            by_level: Dict[int, List[SegmentInfo]] = {}
+            for info in infos:
+                by_level.setdefault(info.level, []).append(info)
+            for level_infos in by_level.values():
+                if len(level_infos) >= self.merge_factor:
+                    merges.append([info.name for info in level_infos[:self.merge_factor]])
+        if merges:
+            return merges
+
+        excess = len(segments) - self.max_segments
+        for infos in sorted(by_partition.values(), key=len, reverse=True):
+            if excess <= 0 or len(infos) < 2:
+                break
+            merges.append([info.name for info in infos])
+            excess -= len(infos) - 1
+        return merges
+
+class SegmentedIndex:
+    """
+    Lexical index split into immutable, time-partitioned segments (one or more per month of the
+    documents' "date" metadata). Every commit writes an immutable `manifest_<generation>.json`
+    listing the live segments, and atomically points `manifest.json` at the latest one, so readers
+    always see a consistent set of segments. Files a commit drops stay on disk until
+    `collect_garbage`, so readers can still pin an older generation, such as the last published one,
+    while a writer commits new ones.
+
+    Scoring uses collection-wide statistics (document count, average length and per-term document
+    frequencies over all segments, recorded alongside the manifest), so a document scores the same
+    whichever segment holds it and results match a single index over the same documents. Queries
+    only score the segments whose date span overlaps the requested date range.
+
+    Only the ingestion job writes and merges (serialised by a lock file, should two jobs overlap);
+    the app only reads. `pin` freezes a reader on the segments live at that point, which it opens
+    as queries first score them.
+    """
+
+    def __init__(self, path: Union[str, Path], merge_policy: Optional[TieredMergePolicy] = None):
+        self.path = Path(path)
+        self.merge_policy = merge_policy or TieredMergePolicy()
+        self._write_lock = threading.Lock()
+        self._manifest: Optional[dict] = None
+        self._manifest_mtime: Optional[int] = None
+        self._doc_freqs: Dict[str, int] = {}
+        self._open_segments: Dict[str, Segment] = {}
+        self._pinned = False
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        return (Path(path) / MANIFEST_FILENAME).exists()
+
+    @classmethod
+    def create(
+        cls,
+        path: Union[str, Path],
+        merge_policy: Optional[TieredMergePolicy] = None,
+        positions: bool = False,
+    ) -> "SegmentedIndex":
+        """Creates an empty index at `path` (unless one exists); `positions` enables phrase and NEAR queries."""
+        index = cls(path, merge_policy)
+        index.path.mkdir(parents=True, exist_ok=True)
+        if not cls.exists(index.path):
+            with open(index.path / "doc_freqs_0.json", "w") as f:
+                json.dump({}, f)
+            index._commit({
+                "generation": 0,
+                "next_segment": 0,
+                "next_doc_id": 0,
+                "num_docs": 0,
+                "total_length": 0.0,
+                "doc_freqs_file": "doc_freqs_0.json",
+                "positions": positions,
+                "segments": [],
+            })
+        return index
+
+    @property
+    def generation(self) -> int:
+        return self.manifest["generation"]
+
+    @property
+    def manifest(self) -> dict:
+        self.refresh()
+        return self._manifest
+
+    @property
+    def segments(self) -> List[SegmentInfo]:
+        return [SegmentInfo(**info) for info in self.manifest["segments"]]
+
+    @property
+    def num_docs(self) -> int:
+        return self.manifest["num_docs"]
+
+    def pin(self, generation: Optional[int] = None) -> "SegmentedIndex":
+        """
+        Freezes this reader on the segments of `generation` (by default the latest), so it keeps
+        one consistent view whatever is committed later. Segments are only opened by the first
+        query that scores them (see `top_k`), so pinning costs one manifest read however many
+        segments there are; the ingestion job keeps the files of the previously published
+        generation until the next publish, by which time apps have moved on to the new one.
+        """
+        if generation is None or (self.path / manifest_filename(generation)).exists():
+            self._load_manifest(manifest_filename(generation))
+        elif self.manifest["generation"] != generation:
+            # indexes written before per-generation manifests only have the latest one
+            raise ValueError(f"Generation {generation} of the lexical index at '{self.path}' is gone")
+        self._pinned = True
+        return self
+
+    def refresh(self):
+        """Picks up a manifest committed since the last call (by a merge or another writer)."""
+        if self._pinned:
+            return
+        self._load_manifest(MANIFEST_FILENAME)
+
+    def _load_manifest(self, filename: str):
+        mtime = (self.path / filename).stat().st_mtime_ns
+        if filename == MANIFEST_FILENAME and mtime == self._manifest_mtime:
+            return
+        with open(self.path / filename) as f:
+            manifest = json.load(f)
+        if self._manifest is None or manifest["doc_freqs_file"] != self._manifest["doc_freqs_file"]:
+            with open(self.path / manifest["doc_freqs_file"]) as f:
+                self._doc_freqs = json.load(f)
+            # the collection statistics changed, so every opened segment has to be re-scored
+            self._open_segments = {}
+        live = {info["name"] for info in manifest["segments"]}
+        self._open_segments = {name: segment for name, segment in self._open_segments.items() if name in live}
+        self._manifest = manifest
+        self._manifest_mtime = mtime if filename == MANIFEST_FILENAME else None
+
+    def _commit(self, manifest: dict):
+        atomic_write_json(self.path / manifest_filename(manifest["generation"]), manifest)
+        atomic_write_json(self.path / MANIFEST_FILENAME, manifest)
+        self.refresh()
+
+    @contextmanager
+    def _writing(self) -> Iterator[dict]:
+        """Holds the write locks and yields a copy of the latest manifest to modify and commit."""
+        if self._pinned:
+            raise RuntimeError("A pinned segmented index is read-only.")
+        with self._write_lock, file_lock(self.path / "write.lock"):
+            self.refresh()
+            yield copy.deepcopy(self._manifest)
+
+    def _open(self, info: SegmentInfo) -> Segment:
+        """
+        Loads a segment's vocabulary and memory-maps its postings, which are only paged in by the
+        queries that score it, and rescales its block bounds to the collection statistics.
+        """
+        segment = self._open_segments.get(info.name)
+        if segment is None:
+            segment = Segment.load(self.path / info.name, info)
+            manifest = self._manifest
+            vocab = segment.index.vocab
+            terms = np.empty(len(vocab), dtype=object)
+            terms[list(vocab.values())] = list(vocab)
+            segment.index.apply_collection_stats(
+                manifest["num_docs"],
+                manifest["total_length"] / max(manifest["num_docs"], 1),
+                np.fromiter((self._doc_freqs.get(term, 0) for term in terms), dtype=np.float32, count=len(terms)),
+                block_impacts=segment.block_impacts,
+            )
+            self._open_segments[info.name] = segment
+        return segment
+
+    def segments_for(self, date_range: Optional[Sequence[Union[str, datetime.date]]] = None) -> List[SegmentInfo]:
+        """Live segments overlapping `date_range` (inclusive), or all of them without a range."""
+        segments = self.segments
+        if not date_range:
+            return segments
+        start_day, end_day = to_day(date_range[0]), to_day(date_range[-1])
+        return [info for info in segments if info.overlaps(start_day, end_day)]
+
+    def top_k(
+        self,
+        query: str,
+        k: int,
+        allowed_ids: Optional[np.ndarray] = None,
+        date_range: Optional[Sequence[Union[str, datetime.date]]] = None,
+        names: Optional[Set[str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Global doc ids and BM25 scores of the k best documents over the segments overlapping
+        `date_range`, only among the named segments if `names` is given (e.g. one shard's).
+        """
+        doc_ids, scores = [], []
+        for info in self.segments_for(date_range):
+            if names is not None and info.name not in names:
+                continue
+            segment_ids, segment_scores = self._open(info).top_k(query, k, allowed_ids=allowed_ids)
+            doc_ids.append(segment_ids)
+            scores.append(segment_scores)
+        if not doc_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        doc_ids, scores = np.concatenate(doc_ids), np.concatenate(scores)
+        # in id order, so ties between segments break by doc id like within one index
+        order = np.argsort(doc_ids, kind="stable")
+        doc_ids, scores = doc_ids[order], scores[order]
+        best = top_k(scores, k)
+        return doc_ids[best], scores[best]
+
+    def add(self, texts: Sequence[str], metadatas: Sequence[dict], doc_ids: Optional[np.ndarray] = None) -> List[SegmentInfo]:
+        """
+        Indexes new documents as one new level-0 segment per month they fall in and commits them.
+        Doc ids default to consecutive ids after the highest one added so far.
+        """
+        with self._writing() as manifest:
+            if doc_ids is None:
+                doc_ids = np.arange(manifest["next_doc_id"], manifest["next_doc_id"] + len(texts), dtype=np.int64)
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            days = np.fromiter((to_day(metadata.get("date")) for metadata in metadatas), dtype=np.int64, count=len(metadatas))
+            partitions = np.array([month_partition(day) for day in days.tolist()], dtype=object)
+
+            with open(self.path / manifest["doc_freqs_file"]) as f:
+                doc_freqs = json.load(f)
+            added = []
+            for partition in sorted(set(partitions.tolist())):
+                rows = np.flatnonzero(partitions == partition)
+                rows = rows[np.argsort(doc_ids[rows], kind="stable")]
+                index = BM25Index.build((texts[row] for row in rows.tolist()), positions=manifest.get("positions", False))
+                name = f"segment_{manifest['next_segment']:08d}"
+                manifest["next_segment"] += 1
+                info = SegmentInfo(
+                    name=name,
+                    partition=partition,
+                    min_date=int(days[rows].min()),
+                    max_date=int(days[rows].max()),
+                    num_docs=len(rows),
+                )
+                Segment(info, index, doc_ids[rows]).save(self.path / name)
+                for term, doc_freq in zip(index.vocab, np.diff(index.indptr).tolist()):
+                    doc_freqs[term] = doc_freqs.get(term, 0) + doc_freq
+                manifest["total_length"] += float(np.sum(index.doc_lengths, dtype=np.float64))
+                manifest["segments"].append(info.model_dump())
+                added.append(info)
+
+            manifest["num_docs"] += len(texts)
+            if len(doc_ids):
+                manifest["next_doc_id"] = max(manifest["next_doc_id"], int(doc_ids.max()) + 1)
+            manifest["generation"] += 1
+            manifest["doc_freqs_file"] = f"doc_freqs_{manifest['generation']}.json"
+            with open(self.path / manifest["doc_freqs_file"], "w") as f:
+                json.dump(doc_freqs, f)
+            self._commit(manifest)
+            return added
+
+    def merge(self, names: Sequence[str], deleted: Optional[np.ndarray] = None) -> Optional[SegmentInfo]:
+        """
+        Merges the named segments into one segment of the next level and commits it, purging the
+        documents whose (global) doc id is in `deleted` from it and from the collection statistics.
+        Segments that are no longer live (merged by another writer meanwhile) are left out, and
+        nothing is merged unless at least two of them still are. Returns None as well when every
+        document of the merged segments was deleted, in which case they are simply dropped.
+        """
+        with self._writing() as manifest:
+            infos = [SegmentInfo(**info) for info in manifest["segments"] if info["name"] in names]
+            if len(infos) < 2:
+                return None
+            names = {info.name for info in infos}
+            segments = [Segment.load(self.path / info.name, info) for info in infos]
+
+            if deleted is not None:
+                deleted = np.unique(np.asarray(deleted, dtype=np.int64))
+                self._purge(manifest, segments, deleted)
+            merged, global_ids = concatenate_segments(segments, deleted)
+            manifest["generation"] += 1
+            if len(global_ids) == 0:
+                manifest["segments"] = [segment_info for segment_info in manifest["segments"] if segment_info["name"] not in names]
+                self._commit(manifest)
+                return None
+            name = f"segment_{manifest['next_segment']:08d}"
+            manifest["next_segment"] += 1
+            info = SegmentInfo(
+                name=name,
+                # the merge policy only merges within a partition
+                partition=infos[0].partition,
+                min_date=min(info.min_date for info in infos),
+                max_date=max(info.max_date for info in infos),
+                num_docs=len(global_ids),
+                level=max(info.level for info in infos) + 1,
+            )
+            Segment(info, merged, global_ids).save(self.path / name)
+
+            manifest["segments"] = [
+                segment_info for segment_info in manifest["segments"] if segment_info["name"] not in names
+            ] + [info.model_dump()]
+            self._commit(manifest)
+            return info
+
+    def _purge(self, manifest: dict, segments: Sequence[Segment], deleted: np.ndarray):
+        """Takes the `deleted` documents of `segments` out of the collection statistics of `manifest`, in a new doc_freqs file."""
+        stats = [segment.deleted_stats(deleted) for segment in segments]
+        if not any(num_docs for num_docs, _, _ in stats):
+            return
+        with open(self.path / manifest["doc_freqs_file"]) as f:
+            doc_freqs = json.load(f)
+        for num_docs, total_length, deleted_freqs in stats:
+            manifest["num_docs"] -= num_docs
+            manifest["total_length"] -= total_length
+            for term, doc_freq in deleted_freqs.items():
+                doc_freqs[term] -= doc_freq
+                if doc_freqs[term] <= 0:
+                    del doc_freqs[term]
+        manifest["doc_freqs_file"] = f"doc_freqs_{manifest['generation'] + 1}.json"
+        with open(self.path / manifest["doc_freqs_file"], "w") as f:
+            json.dump(doc_freqs, f)
+
+    def update_dates(self, doc_ids: np.ndarray, days: np.ndarray):
+        """
+        Widens the date span of the segments holding `doc_ids` to cover their new `days` (days since
+        epoch), so date-range queries still score the documents whose date was updated in place.
+        """
+        doc_ids, days = np.asarray(doc_ids, dtype=np.int64), np.asarray(days, dtype=np.int64)
+        with self._writing() as manifest:
+            changed = False
+            for info in manifest["segments"]:
+                held = contains(np.load(self.path / info["name"] / "global_ids.npy", mmap_mode="r"), doc_ids)
+                if not held.any():
+                    continue
+                min_date, max_date = min(info["min_date"], int(days[held].min())), max(info["max_date"], int(days[held].max()))
+                if (min_date, max_date) != (info["min_date"], info["max_date"]):
+                    info["min_date"], info["max_date"], changed = min_date, max_date, True
+            if changed:
+                manifest["generation"] += 1
+                self._commit(manifest)
+
+    def rollback(self, generation: int):
+        """
+        Makes the segments of `generation` the live ones again, dropping everything committed since
+        (by an interrupted writer). Segment names are never reused, and `collect_garbage` deletes the
+        dropped segments.
+        """
+        with self._writing() as manifest:
+            if manifest["generation"] == generation:
+                return
+            if not (self.path / manifest_filename(generation)).exists():
+                raise ValueError(f"Generation {generation} of the lexical index at '{self.path}' is gone")
+            with open(self.path / manifest_filename(generation)) as f:
+                rolled_back = json.load(f)
+            rolled_back["generation"] = manifest["generation"] + 1
+            rolled_back["next_segment"] = manifest["next_segment"]
+            self._commit(rolled_back)
+
+    def maybe_merge(self, deleted: Optional[np.ndarray] = None) -> List[SegmentInfo]:
+        """Runs every merge the merge policy asks for on the current segments, purging the `deleted` doc ids from them."""
+        merged = [self.merge(names, deleted) for names in self.merge_policy.find_merges(self.segments)]
+        return [info for info in merged if info is not None]
+
+    def collect_garbage(self, keep_generations: Sequence[int] = ()) -> int:
+        """
+        Deletes the manifests, document frequencies and segments referenced neither by the latest
+        generation nor by `keep_generations`, returning how many files and segments were deleted.
+        Readers holding deleted segments keep their memory maps, which stay valid after unlinking.
+        """
+        with self._writing() as latest:
+            manifests = [latest]
+            for generation in set(keep_generations) - {latest["generation"]}:
+                if (self.path / manifest_filename(generation)).exists():
+                    with open(self.path / manifest_filename(generation)) as f:
+                        manifests.append(json.load(f))
+            keep = {MANIFEST_FILENAME, "write.lock"}
+            for manifest in manifests:
+                keep.add(manifest_filename(manifest["generation"]))
+                keep.add(manifest["doc_freqs_file"])
+                keep.update(info["name"] for info in manifest["segments"])
+            deleted = 0
+            for path in self.path.iterdir():
+                if path.name in keep:
+                    continue
+                if path.is_dir() and path.name.startswith("segment_"):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif path.name.startswith(("manifest_", "doc_freqs_")):
+                    path.unlink(missing_ok=True)
+                else:
+                    continue
+                deleted += 1
+            return deleted
@@ -0,0 +1,114 @@
+import itertools
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+import numpy as np
+
+from core.dense import normalize
+
+class SemanticEntry:
+    def __init__(self, entry_id: int, query: str, scope: Hashable, value: Any):
+        self.entry_id = entry_id
+        self.query = query
+        self.scope = scope
+        self.value = value
+        self.answer: Optional[str] = None
+
+class SemanticCache:
+    """
+    Search results (and the RAG answers generated from them) served to paraphrases of a cached
+    query: the normalized query embeddings are rows of one matrix, and a query whose cosine
+    similarity to a cached one with the same `scope` (search params and index generation) reaches
+    `threshold` gets its entry. Holds at most `max_entries`, replacing expired entries first and
+    then the least recently used; entries expire `ttl` seconds after they were stored (0 never).
+
+    Paraphrases do not always retrieve the same results, so callers re-run a sample of the hits
+    and report through `verify` whether the fresh results matched, which gives the false hit rate.
+    """
+
+    def __init__(self, max_entries: int = 256, threshold: float = 0.95, ttl: float = 600):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors: Optional[np.ndarray] = None
+        self._scopes = np.zeros(max_entries, dtype=np.int64)
+        self._stored_at = np.full(max_entries, -np.inf)
+        self._last_used = np.full(max_entries, -np.inf)
+        self._entries: List[Optional[SemanticEntry]] = [None] * max_entries
+        self._entry_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.false_hits = 0
+
+    def _live(self, now: float) -> np.ndarray:
+        stored = self._stored_at > -np.inf
+        return stored & (now - self._stored_at <= self.ttl) if self.ttl else stored
+
+    def lookup(self, query_vector: np.ndarray, scope: Hashable) -> Optional[SemanticEntry]:
+        """Most similar live entry of `scope` if it is similar enough to the query."""
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(query):
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            candidates = self._live(now) & (self._scopes == hash(scope))
+            similarities = np.where(candidates, self._vectors @ query, -np.inf)
+            slot = int(np.argmax(similarities))
+            entry = self._entries[slot]
+            if similarities[slot] < self.threshold or entry is None or entry.scope != scope:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._last_used[slot] = now
+            return entry
+
+    def put(self, query: str, query_vector: np.ndarray, scope: Hashable, value: Any) -> Optional[int]:
+        """Stores `value` for the query and returns its entry id, to attach an answer to later."""
+        if self.max_entries <= 0:
+            return None
+        query_vector = normalize(np.asarray(query_vector, dtype=np.float32))
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(query_vector):
+                # the first query (or a new embedding model) sets the dimension
+                self._vectors = np.zeros((self.max_entries, len(query_vector)), dtype=np.float32)
+                self._stored_at[:] = -np.inf
+                self._entries = [None] * self.max_entries
+            now = time.monotonic()
+            live = self._live(now)
+            slot = int(np.argmin(live)) if not live.all() else int(np.argmin(self._last_used))
+            entry = SemanticEntry(next(self._entry_ids), query, scope, value)
+            self._vectors[slot] = query_vector
+            self._scopes[slot] = hash(scope)
+            self._stored_at[slot] = now
+            self._last_used[slot] = now
+            self._entries[slot] = entry
+            return entry.entry_id
+
+    def set_answer(self, entry_id: int, answer: str):
+        """Attaches the RAG answer generated for an entry's results, if the entry is still cached."""
+        with self._lock:
+            for entry in self._entries:
+                if entry is not None and entry.entry_id == entry_id:
+                    entry.answer = answer
+                    return
+
+    def verify(self, matched: bool):
+        with self._lock:
+            self.verifications += 1
+            self.false_hits += not matched
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(self._live(time.monotonic()).sum()),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "verifications": self.verifications,
+                "false_hit_rate": self.false_hits / self.verifications if self.verifications else None,
+            }
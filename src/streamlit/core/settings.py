@@ -9,7 +9,38 @@ class Settings(BaseSettings):
     log_level: str = os.getenv("LOG_LEVEL", "DEBUG")
     page_size: int = int(os.getenv("PAGE_SIZE", "5"))
 
+    # Search settings
+    search_mode: str = os.getenv("SEARCH_MODE", "mock") # mock | lexical | dense | hybrid
+    search_top_k: int = int(os.getenv("SEARCH_TOP_K", "20"))
+    lexical_timeout: float = float(os.getenv("LEXICAL_TIMEOUT", "1.0"))
+    dense_timeout: float = float(os.getenv("DENSE_TIMEOUT", "2.0"))
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    index_dir: str = os.getenv("INDEX_DIR", "/app/index")
+    dense_index_type: str = os.getenv("DENSE_INDEX_TYPE", "flat") # flat | hnsw | ivfpq
+    hnsw_ef_search: int = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    ivfpq_nprobe: int = int(os.getenv("IVFPQ_NPROBE", "16"))
+    ivfpq_rerank_k: int = int(os.getenv("IVFPQ_RERANK_K", "100"))
+    lexical_shards: int = int(os.getenv("LEXICAL_SHARDS", "0")) # worker processes scoring the segmented lexical index, 0 or 1 scores in-process
+    dedup_results: bool = os.getenv("DEDUP_RESULTS", "true").lower() == "true" # collapse near-duplicate chunks to one result
+    doc_store_cache_blocks: int = int(os.getenv("DOC_STORE_CACHE_BLOCKS", "256")) # decompressed doc store blocks kept per index
+    index_cache_mb: float = float(os.getenv("INDEX_CACHE_MB", "4096")) # estimated resident memory (memory-mapped files excluded) of the open data source indexes, the least recently searched are closed beyond it
+    result_cache_size: int = int(os.getenv("RESULT_CACHE_SIZE", "1024")) # searches kept for all sessions, 0 disables the cache
+    result_cache_ttl: float = float(os.getenv("RESULT_CACHE_TTL", "600")) # seconds a cached search is served, 0 keeps it until evicted
+    semantic_cache_size: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "0")) # query embeddings kept to serve paraphrases from cache, 0 disables (it embeds every query)
+    semantic_cache_threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")) # cosine similarity from which a cached query's results are served
+    semantic_cache_verify_rate: float = float(os.getenv("SEMANTIC_CACHE_VERIFY_RATE", "0.05")) # share of semantic hits re-run to measure false hits
+    semantic_cache_answers: bool = os.getenv("SEMANTIC_CACHE_ANSWERS", "true").lower() == "true" # also serve the RAG answer cached with the results
+    answer_cache_path: str = os.getenv("ANSWER_CACHE_PATH", "/app/cache/answers.sqlite") # SQLite store of temperature 0 RAG answers, empty disables it
+    answer_replay_delay: float = float(os.getenv("ANSWER_REPLAY_DELAY", "0.01")) # seconds per word when a cached answer is shown as a stream, 0 shows it at once
+    index_reload_interval: float = float(os.getenv("INDEX_RELOAD_INTERVAL", "5")) # seconds between checks for a newly published index, 0 disables
+
     llm_model_id: str = os.getenv("MODEL_ID", "llama-2-70b-chat-hf")
+    embedding_model_id: str = os.getenv("EMBEDDING_MODEL_ID", "bge-large-en-v1.5")
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32")) # concurrent query embeddings sent in one request, 1 disables batching
+    embedding_batch_wait_ms: float = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")) # longest a query embedding waits for others to join its request
+    embedding_cache_size: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")) # query embeddings kept in memory, 0 disables the memory tier
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "/app/cache/embeddings.sqlite") # SQLite store of query embeddings, empty disables the disk tier
+    embedding_cache_disk_entries: int = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", "1000000")) # the oldest are deleted beyond
     
     openai_api_service: str = os.getenv("OPENAI_API_SERVICE", "local") # local | rapid | openai
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "test")
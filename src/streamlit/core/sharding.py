@@ -0,0 +1,167 @@
+import datetime
+import heapq
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+import numpy as np
+
+from core.dedup import first_occurrences, live_top_k
+from core.files import file_lock
+from core.filters import FilterIndex
+from core.segments import SegmentedIndex, SegmentInfo
+
+def assign_shards(segments: Sequence[SegmentInfo], num_shards: int) -> List[Set[str]]:
+    """Spreads segments over shards by document count, largest first onto the least loaded shard."""
+    shards: List[Set[str]] = [set() for _ in range(num_shards)]
+    loads = [(0, shard) for shard in range(num_shards)]
+    for info in sorted(segments, key=lambda info: (-info.num_docs, info.name)):
+        load, shard = heapq.heappop(loads)
+        shards[shard].add(info.name)
+        heapq.heappush(loads, (load + info.num_docs, shard))
+    return shards
+
+class Shard(NamedTuple):
+    index: SegmentedIndex
+    names: Set[str]
+    filters: Optional[FilterIndex]
+    tombstones: np.ndarray
+    cluster_ids: Optional[np.ndarray]
+
+# state of a shard worker process: the shards it serves, by the key the pool opened them under
+_shards: Dict[int, Shard] = {}
+
+def _open_shard(
+    key: int,
+    path: str,
+    shard: int,
+    num_shards: int,
+    generation: Optional[int],
+    filters: Optional[FilterIndex],
+    tombstones: np.ndarray,
+    cluster_ids: Optional[np.ndarray],
+) -> int:
+    """Pins the index in the worker, which opens its shard's segments as they are scored, returning the pinned generation."""
+    index = SegmentedIndex(path).pin(generation)
+    names = assign_shards(index.segments, num_shards)[shard]
+    _shards[key] = Shard(index, names, filters, tombstones, cluster_ids)
+    return index.generation
+
+def _close_shard(key: int):
+    _shards.pop(key, None)
+
+def _shard_top_k(
+    key: int,
+    query: str,
+    k: int,
+    data_source: Optional[str],
+    date_range: Optional[Sequence[Union[str, datetime.date]]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The shard's top-k live docs over distinct clusters, see `ShardedLexicalIndex.top_k`."""
+    shard = _shards[key]
+    allowed_ids = shard.filters.allowed_ids(data_source=data_source, date_range=date_range) if shard.filters is not None else None
+    top_k = lambda k, allowed_ids: shard.index.top_k(query, k, allowed_ids=allowed_ids, date_range=date_range, names=shard.names)
+    return live_top_k(top_k, k, allowed_ids, shard.tombstones, shard.cluster_ids)
+
+class ShardPool:
+    """
+    `num_shards` worker processes scoring a segmented lexical index, one per shard. They are started
+    once and kept for the life of the app: every generation of every index opened on the pool (see
+    `open`) is loaded into the same workers, so reloading an index does not start new interpreters.
+    """
+
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+        # spawned rather than forked: the app is multi-threaded
+        context = multiprocessing.get_context("spawn")
+        self.executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(num_shards)]
+        self._keys = itertools.count()
+
+    def open(
+        self,
+        path: Union[str, Path],
+        generation: Optional[int] = None,
+        filters: Optional[FilterIndex] = None,
+        tombstones: Optional[np.ndarray] = None,
+        cluster_ids: Optional[np.ndarray] = None,
+    ) -> "ShardedLexicalIndex":
+        return ShardedLexicalIndex(self, path, generation, filters, tombstones, cluster_ids)
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+class ShardedLexicalIndex:
+    """
+    Segmented lexical index scored by the workers of a `ShardPool`, each pinned to its own subset of
+    the segments (see `assign_shards`), so concurrent queries are scored on as many cores instead of
+    queueing on one interpreter's GIL. Segment files are memory-mapped, so the workers share them
+    through the page cache.
+
+    The filter index, tombstones and near-duplicate clusters of the index are sent to the workers
+    once, when it is opened. A query then only carries its text and filters: every shard resolves
+    the filters, drops tombstones and collapses near-duplicates itself, and the per-shard top-k
+    lists are gathered with a k-way merge in one round trip.
+
+    All workers pin the same generation of the index: `generation` (the published one) if given,
+    otherwise the latest, read while holding the index's write lock so nothing commits in between.
+    """
+
+    def __init__(
+        self,
+        pool: ShardPool,
+        path: Union[str, Path],
+        generation: Optional[int] = None,
+        filters: Optional[FilterIndex] = None,
+        tombstones: Optional[np.ndarray] = None,
+        cluster_ids: Optional[np.ndarray] = None,
+    ):
+        self.pool = pool
+        self.path = Path(path)
+        self.cluster_ids = cluster_ids
+        self.key = next(pool._keys)
+        if tombstones is None:
+            tombstones = np.empty(0, dtype=np.int64)
+        with file_lock(self.path / "write.lock"):
+            generations = {
+                future.result() for future in [
+                    executor.submit(
+                        _open_shard, self.key, str(self.path), shard, pool.num_shards, generation, filters, tombstones, cluster_ids,
+                    )
+                    for shard, executor in enumerate(pool.executors)
+                ]
+            }
+        self.generation = generations.pop()
+
+    def top_k(
+        self,
+        query: str,
+        k: int,
+        data_source: Optional[str] = None,
+        date_range: Optional[Sequence[Union[str, datetime.date]]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k live docs matching the filters, with near-duplicates collapsed: the same results and
+        tie order as `core.dedup.live_top_k` over `SegmentedIndex.top_k`. A cluster's best doc is
+        among its shard's top-k clusters, so collapsing the merged shard lists again is exact.
+        """
+        futures = [executor.submit(_shard_top_k, self.key, query, k, data_source, date_range) for executor in self.pool.executors]
+        shard_results = [future.result() for future in futures]
+        # every shard list is best first (descending score, then ascending doc id)
+        merged = list(heapq.merge(*(zip((-scores).tolist(), doc_ids.tolist()) for doc_ids, scores in shard_results)))
+        doc_ids = np.array([doc_id for _, doc_id in merged], dtype=np.int64)
+        scores = np.array([-score for score, _ in merged], dtype=np.float32)
+        if self.cluster_ids is not None:
+            distinct = first_occurrences(self.cluster_ids[doc_ids])
+            doc_ids, scores = doc_ids[distinct], scores[distinct]
+        return doc_ids[:k], scores[:k]
+
+    def close(self):
+        """Releases this generation in the workers, which keep running for the next one."""
+        for executor in self.pool.executors:
+            try:
+                executor.submit(_close_shard, self.key)
+            except RuntimeError:
+                # the pool was shut down
+                pass
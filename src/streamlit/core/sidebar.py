@@ -1,12 +1,15 @@
 import streamlit as st
 import datetime
+from core.columns import SORT_KEYS
+from core.search import get_index_registry
 
 def sidebar():
     # Using object notation
     today = datetime.datetime.now()
     data_source = st.sidebar.selectbox(
         label = "Data source",
-        options = ("Confluence (Policies & Circulars)",)
+        # every indexed source, opened on its first search
+        options = get_index_registry().sources()
     )
     date_range = st.sidebar.date_input(
         label="Date range filter",
@@ -15,7 +18,13 @@ def sidebar():
         max_value=datetime.date(today.year, 12, 31),
         format="MM.DD.YYYY",
     )
+    sort_by = st.sidebar.selectbox(
+        label = "Sort by",
+        options = SORT_KEYS,
+        format_func = str.capitalize,
+    )
     st.session_state.search_params = {
         "data_source": data_source,
-        "date_range": date_range
+        "date_range": date_range,
+        "sort_by": sort_by,
     }
@@ -0,0 +1,325 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Union
+import numpy as np
+
+from core.bm25 import BM25Index
+from core.columns import MetadataTable, PackedStrings
+from core.dedup import DedupWriter, load_cluster_ids
+from core.dense import DenseIndex
+from core.doc_store import BlockStore
+from core.doc_table import DOC_STORE_DIRNAME, METADATA_DIRNAME, DocTable, read_doc_table
+from core.embedding_store import EmbeddingStore
+from core.filters import FilterIndex
+from core.manifest import ChunkManifest
+from core.positions import PositionalPostings
+from core.segments import Segment, SegmentedIndex, concatenate_segments
+
+SNAPSHOT_FILENAME = "snapshot.bin"
+MAGIC = b"RAGSNAP\x00"
+FORMAT_VERSION = 1
+# magic, format version, table of contents offset, length and crc32
+PREAMBLE = struct.Struct("<8sIQQI")
+ALIGNMENT = 64
+
+class SnapshotWriter:
+    """
+    Writes named arrays into a single snapshot file:
+
+        preamble | array | array | ... | table of contents (JSON)
+
+    Arrays are raw little-endian buffers aligned to `ALIGNMENT` bytes, so a reader maps them in place.
+    The table of contents holds the dtype, shape, offset and crc32 of every array plus free-form
+    metadata, and is itself checksummed in the preamble. The file is written next to its destination
+    and renamed over it on `close`, so readers of a previous snapshot keep their mapping.
+    """
+
+    def __init__(self, path: Union[str, Path], meta: Optional[dict] = None):
+        self.path = Path(path)
+        self.meta = meta or {}
+        self.arrays: Dict[str, dict] = {}
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * PREAMBLE.size)
+
+    def add(self, name: str, array: np.ndarray):
+        self.add_chunks(name, [array])
+
+    def add_chunks(self, name: str, chunks: Iterable[np.ndarray]):
+        """Writes an array given as consecutive chunks along its first axis, without concatenating them in memory."""
+        self._file.write(b"\0" * (-self._file.tell() % ALIGNMENT))
+        offset = self._file.tell()
+        crc, length, dtype, row_shape = 0, 0, None, ()
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk)
+            dtype, row_shape = chunk.dtype.newbyteorder("<"), chunk.shape[1:]
+            data = chunk.astype(dtype, copy=False).tobytes()
+            crc = zlib.crc32(data, crc)
+            length += len(chunk)
+            self._file.write(data)
+        if dtype is None:
+            raise ValueError(f"Snapshot array '{name}' has no chunks.")
+        self.arrays[name] = {
+            "dtype": dtype.str,
+            "shape": [length, *row_shape],
+            "offset": offset,
+            "nbytes": self._file.tell() - offset,
+            "crc32": crc,
+        }
+
+    def close(self) -> "Snapshot":
+        toc = json.dumps({"meta": self.meta, "arrays": self.arrays}).encode("utf-8")
+        toc_offset = self._file.tell()
+        self._file.write(toc)
+        self._file.seek(0)
+        self._file.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, toc_offset, len(toc), zlib.crc32(toc)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return Snapshot.open(self.path)
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file. Opening maps the file and only reads and checksums the
+    preamble and table of contents, so it takes the same time whatever the corpus size: arrays
+    are zero-copy views of the mapping, paged in by the OS as queries touch them. `verify` checks
+    the crc32 of every array, which does read the whole file.
+    """
+
+    def __init__(self, path: Path, buffer: mmap.mmap, meta: dict, arrays: Dict[str, dict]):
+        self.path = path
+        self.buffer = buffer
+        self.meta = meta
+        self.arrays = arrays
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "Snapshot":
+        path = Path(path)
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < PREAMBLE.size:
+            raise ValueError(f"'{path}' is too short to be an index snapshot.")
+        magic, version, toc_offset, toc_length, toc_crc = PREAMBLE.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not an index snapshot.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Index snapshot format version {version} not supported (expected {FORMAT_VERSION}).")
+        toc = buffer[toc_offset:toc_offset + toc_length]
+        if len(toc) != toc_length or zlib.crc32(toc) != toc_crc:
+            raise ValueError(f"Index snapshot '{path}' is truncated or corrupt.")
+        toc = json.loads(toc)
+        return cls(path, buffer, toc["meta"], toc["arrays"])
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        return Path(path).exists()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        entry = self.arrays[name]
+        dtype = np.dtype(entry["dtype"])
+        array = np.frombuffer(self.buffer, dtype=dtype, count=entry["nbytes"] // dtype.itemsize, offset=entry["offset"])
+        return array.reshape(entry["shape"])
+
+    def verify(self):
+        """Raises ValueError if any array does not match its checksum."""
+        for name, entry in self.arrays.items():
+            if zlib.crc32(self.buffer[entry["offset"]:entry["offset"] + entry["nbytes"]]) != entry["crc32"]:
+                raise ValueError(f"Index snapshot array '{name}' is corrupt.")
+
+def add_strings(writer: SnapshotWriter, name: str, strings: Iterable[str], batch_size: int = 10000):
+    """Writes `{name}/offsets` and `{name}/data` for `PackedStrings`, streaming the data in batches."""
+    lengths = [0]
+
+    def batches() -> Iterator[np.ndarray]:
+        batch = []
+        for string in strings:
+            encoded = string.encode("utf-8")
+            lengths.append(len(encoded))
+            batch.append(encoded)
+            if len(batch) == batch_size:
+                yield np.frombuffer(b"".join(batch), dtype=np.uint8)
+                batch = []
+        # an empty chunk still fixes the dtype of an empty array
+        yield np.frombuffer(b"".join(batch), dtype=np.uint8)
+
+    writer.add_chunks(f"{name}/data", batches())
+    writer.add(f"{name}/offsets", np.cumsum(lengths, dtype=np.int64))
+
+def read_strings(snapshot: Snapshot, name: str, as_json: bool = False) -> PackedStrings:
+    return PackedStrings(snapshot[f"{name}/offsets"], snapshot[f"{name}/data"], as_json=as_json)
+
+class PackedVocab(Mapping):
+    """Term -> term id mapping over terms sorted in a `PackedStrings`, looked up by binary search instead of a parsed dict."""
+
+    def __init__(self, terms: PackedStrings, term_ids: np.ndarray):
+        self.terms = terms
+        self.term_ids = term_ids
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __getitem__(self, term: str) -> int:
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            raise KeyError(term)
+        return int(self.term_ids[i])
+
+def write_index_snapshot(index_dir: Union[str, Path], generation: int = 0) -> Snapshot:
+    """
+    Packs the doc table, lexical index (segments compacted into one), embeddings, filter attributes,
+    tombstones and near-duplicate clusters of `index_dir` into its snapshot file, tagged with the index `generation` it reflects.
+    """
+    index_dir = Path(index_dir)
+    writer = SnapshotWriter(index_dir / SNAPSHOT_FILENAME, meta={"generation": generation})
+
+    def rows() -> Iterator[dict]:
+        return read_doc_table(index_dir)
+
+    store_dir = index_dir / DOC_STORE_DIRNAME / "page_contents"
+    if BlockStore.exists(store_dir) and MetadataTable.exists(index_dir / METADATA_DIRNAME):
+        # the compressed blocks are copied as they are
+        store = BlockStore.open(store_dir)
+        step = 1 << 24
+        writer.add_chunks("doc_store/page_contents/data", (store.data[start:start + step] for start in range(0, max(len(store.data), 1), step)))
+        writer.add("doc_store/page_contents/block_offsets", np.asarray(store.block_offsets))
+        writer.add("doc_store/page_contents/ends", np.asarray(store.ends))
+        writer.add("doc_store/page_contents/block_starts", np.asarray(store.block_starts))
+        writer.meta["doc_store"] = {"docs_per_block": store.docs_per_block, "codec": store.codec}
+        metadata_table = MetadataTable.load(index_dir / METADATA_DIRNAME)
+    else:
+        add_strings(writer, "doc_table/page_contents", (row["page_content"] for row in rows()))
+        metadata_table = MetadataTable.build(row["metadata"] for row in rows())
+    for name, array in metadata_table.arrays().items():
+        writer.add(f"metadata/{name}", np.asarray(array))
+    writer.meta["metadata"] = metadata_table.meta()
+
+    lexical_dir = index_dir / "lexical"
+    if SegmentedIndex.exists(lexical_dir):
+        segmented = SegmentedIndex(lexical_dir).pin()
+        infos = segmented.segments
+        if infos:
+            lexical, global_ids = concatenate_segments([Segment.load(lexical_dir / info.name, info) for info in infos])
+        else:
+            lexical, global_ids = BM25Index.build([]), np.empty(0, dtype=np.int64)
+        writer.add("lexical/global_ids", global_ids)
+    else:
+        lexical = BM25Index.load(lexical_dir)
+    terms = sorted(lexical.vocab)
+    add_strings(writer, "lexical/terms", terms)
+    writer.add("lexical/term_ids", np.fromiter((lexical.vocab[term] for term in terms), dtype=np.int64, count=len(terms)))
+    for name in ("indptr", "doc_ids", "term_freqs", "doc_lengths", "block_indptr", "block_last_docs", "block_max_scores"):
+        writer.add(f"lexical/{name}", np.asarray(getattr(lexical, name)))
+    if lexical.positions is not None:
+        writer.add("lexical/position_indptr", np.asarray(lexical.positions.indptr))
+        writer.add("lexical/position_deltas", np.asarray(lexical.positions.deltas))
+    writer.meta["lexical"] = {"k1": lexical.k1, "b": lexical.b}
+
+    dense_dir = index_dir / "dense"
+    if EmbeddingStore.exists(dense_dir):
+        store = EmbeddingStore.open(dense_dir)
+        block_size = store.block_size
+        writer.add_chunks("dense/vectors", (store.vectors[start:start + block_size] for start in range(0, max(store.num_docs, 1), block_size)))
+        writer.add("dense/scales", np.asarray(store.scales))
+    elif (dense_dir / "embeddings.npy").exists():
+        writer.add("dense/embeddings", DenseIndex.load(dense_dir).embeddings)
+
+    if FilterIndex.exists(index_dir / "filters"):
+        filter_index = FilterIndex.load(index_dir / "filters")
+        writer.add("filters/dates", filter_index.dates)
+        writer.add("filters/source_bitmaps", np.asarray(filter_index.source_bitmaps))
+        writer.meta["sources"] = filter_index.sources
+
+    if ChunkManifest.exists(index_dir):
+        manifest = ChunkManifest(index_dir)
+        writer.add("tombstones", manifest.tombstones())
+        manifest.close()
+
+    if DedupWriter.exists(index_dir / "dedup"):
+        writer.add("clusters", load_cluster_ids(index_dir / "dedup"))
+    return writer.close()
+
+def open_index_snapshot(index_dir: Union[str, Path], generation: int) -> Optional[Snapshot]:
+    """The snapshot of `index_dir` if there is one for the given index generation, None if it is missing or stale."""
+    path = Path(index_dir) / SNAPSHOT_FILENAME
+    if not Snapshot.exists(path):
+        return None
+    snapshot = Snapshot.open(path)
+    if snapshot.meta.get("generation") != generation:
+        return None
+    return snapshot
+
+def snapshot_doc_table(snapshot: Snapshot, cache_blocks: int = 256) -> DocTable:
+    if "doc_store" in snapshot.meta:
+        params = snapshot.meta["doc_store"]
+        page_contents = BlockStore(
+            snapshot["doc_store/page_contents/data"],
+            snapshot["doc_store/page_contents/block_offsets"],
+            snapshot["doc_store/page_contents/ends"],
+            params["docs_per_block"],
+            params["codec"],
+            cache_blocks=cache_blocks,
+            block_starts=snapshot["doc_store/page_contents/block_starts"] if "doc_store/page_contents/block_starts" in snapshot else None,
+        )
+    else:
+        page_contents = read_strings(snapshot, "doc_table/page_contents")
+    if "metadata" not in snapshot.meta:
+        # snapshot written before metadata columns, they are built from the packed dicts
+        return DocTable(page_contents, read_strings(snapshot, "doc_table/metadatas", as_json=True))
+    arrays = {name.split("/", 1)[1]: snapshot[name] for name in snapshot.arrays if name.startswith("metadata/")}
+    return DocTable(page_contents, MetadataTable.from_arrays(arrays, snapshot.meta["metadata"]))
+
+def snapshot_lexical_index(snapshot: Snapshot) -> Union[BM25Index, Segment]:
+    """The compacted lexical index, wrapped in a `Segment` if its local ids are not the global doc ids."""
+    params = snapshot.meta["lexical"]
+    index = BM25Index(
+        vocab=PackedVocab(read_strings(snapshot, "lexical/terms"), snapshot["lexical/term_ids"]),
+        indptr=snapshot["lexical/indptr"],
+        doc_ids=snapshot["lexical/doc_ids"],
+        term_freqs=snapshot["lexical/term_freqs"],
+        doc_lengths=snapshot["lexical/doc_lengths"],
+        k1=params["k1"],
+        b=params["b"],
+        block_indptr=snapshot["lexical/block_indptr"],
+        block_last_docs=snapshot["lexical/block_last_docs"],
+        block_max_scores=snapshot["lexical/block_max_scores"],
+        positions=PositionalPostings(snapshot["lexical/position_indptr"], snapshot["lexical/position_deltas"])
+        if "lexical/position_indptr" in snapshot else None,
+    )
+    if "lexical/global_ids" not in snapshot:
+        return index
+    global_ids = snapshot["lexical/global_ids"]
+    if len(global_ids) == 0 or (global_ids[0] == 0 and global_ids[-1] == len(global_ids) - 1):
+        # sorted and unique, so this means local ids are global ids
+        return index
+    return Segment(None, index, global_ids)
+
+def snapshot_embeddings(snapshot: Snapshot) -> Optional[Union[EmbeddingStore, DenseIndex]]:
+    if "dense/vectors" in snapshot:
+        return EmbeddingStore(snapshot["dense/vectors"], snapshot["dense/scales"])
+    if "dense/embeddings" in snapshot:
+        return DenseIndex(snapshot["dense/embeddings"])
+    return None
+
+def snapshot_filter_index(snapshot: Snapshot) -> Optional[FilterIndex]:
+    if "filters/dates" not in snapshot:
+        return None
+    return FilterIndex(snapshot["filters/dates"], snapshot.meta["sources"], snapshot["filters/source_bitmaps"])
+
+def snapshot_tombstones(snapshot: Snapshot) -> np.ndarray:
+    return np.asarray(snapshot["tombstones"]) if "tombstones" in snapshot else np.empty(0, dtype=np.int64)
+
+def snapshot_cluster_ids(snapshot: Snapshot) -> Optional[np.ndarray]:
+    return snapshot["clusters"] if "clusters" in snapshot else None
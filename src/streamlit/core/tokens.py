@@ -0,0 +1,49 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+def tokenizer_name(tokenizer_params: dict) -> str:
+    """The doc table key of a model's tokenizer, from the `tokenizer_params` of its model information."""
+    return f"{tokenizer_params['model_id']}@{tokenizer_params['revision']}" if tokenizer_params.get("revision") else tokenizer_params["model_id"]
+
+class Tokenizer:
+    """
+    The tokenizer of an LLM, as named by the `tokenizer_params` of its model information: a
+    Hugging Face tokenizer if `transformers` can load it, otherwise a tiktoken encoding (OpenAI
+    models). `name` is the key token counts are stored under in the doc table.
+    """
+
+    def __init__(self, model_id: str, revision: Optional[str] = None):
+        self.name = tokenizer_name({"model_id": model_id, "revision": revision})
+        self._hf_tokenizer = None
+        self._encoding = None
+        try:
+            from transformers import AutoTokenizer
+            self._hf_tokenizer = AutoTokenizer.from_pretrained(model_id, revision=revision)
+        except Exception as hf_error:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(model_id)
+            except Exception:
+                raise ValueError(f"Cannot load a tokenizer for '{self.name}': {hf_error}")
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """(start, end) character offsets of every token of `text`."""
+        if self._hf_tokenizer is not None:
+            return [
+                (start, end) for start, end in
+                self._hf_tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+                if end > start
+            ]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        _, starts = self._encoding.decode_with_offsets(tokens)
+        return list(zip(starts, starts[1:] + [len(text)]))
+
+    def count(self, text: str) -> int:
+        if self._hf_tokenizer is not None:
+            return len(self._hf_tokenizer(text, add_special_tokens=False)["input_ids"])
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model_id: str, revision: Optional[str] = None) -> Tokenizer:
+    """Loads a tokenizer once per process (the ingestion workers each load their own)."""
+    return Tokenizer(model_id, revision)
@@ -0,0 +1,151 @@
+"""
+Builds the search index from a Confluence space export: an HTML export directory (one .html file
+per page) or an XML export (`entities.xml`, or the directory holding it). Pages are streamed through
+a process pool that strips markup and chunks them, then batch-embedded and written to INDEX_DIR.
+Each data source can get its own index in a subdirectory of INDEX_DIR, which the app then only
+opens once that source is searched.
+
+Usage (from src/streamlit):
+python -m ingest /path/to/export --workers 4
+python -m ingest /path/to/export --workers 16 --no-embeddings
+python -m ingest /path/to/export --incremental
+python -m ingest /path/to/export --dense-index hnsw --hnsw-m 32
+python -m ingest /path/to/export --dense-index ivfpq --ivfpq-lists 4096 --ivfpq-bytes 64
+python -m ingest /path/to/jira-export --index-dir /app/index/jira --data-source Jira
+"""
+import argparse
+import asyncio
+import os
+import shutil
+from pathlib import Path
+from loguru import logger
+
+from core.dependencies import get_model_information
+from core.doc_table import DOC_TABLE_FILENAME
+from core.embedding_store import STORE_DTYPES
+from core.ingestion import DEFAULT_DATA_SOURCE, DENSE_INDEX_TYPES, IndexWriter, ingest, read_export
+from core.manifest import MANIFEST_FILENAME, ChunkManifest
+from core.snapshot import SNAPSHOT_FILENAME
+from core.tokens import load_tokenizer
+from core.settings import settings
+
+INDEX_PARTS = ("doc_store", "metadata", "lexical", "dense", "filters", "dedup")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("export", help="HTML export directory, entities.xml or the directory containing it")
+    parser.add_argument("--index-dir", default=settings.index_dir)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="markup stripping and chunking processes")
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--data-source", default=DEFAULT_DATA_SOURCE)
+    parser.add_argument("--base-url", default="", help="Confluence URL the page links are built from")
+    parser.add_argument("--chunk-by", default="tokens", choices=("tokens", "words"), help="unit of --chunk-size and --chunk-overlap")
+    parser.add_argument("--tokenizer", help="MODEL_ID[@REVISION] of the tokenizer to chunk by (default: the tokenizer of MODEL_ID)")
+    parser.add_argument("--chunk-size", type=int, default=300, help="tokens (or words) per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="tokens (or words) shared by consecutive chunks")
+    parser.add_argument("--segment-size", type=int, default=20000, help="chunks per lexical index flush")
+    parser.add_argument("--merge-factor", type=int, default=4, help="lexical segments of one month and level merged together")
+    parser.add_argument("--max-segments", type=int, default=64, help="lexical segments above which whole months are compacted")
+    parser.add_argument("--positions", action="store_true", help="store token positions for phrase and NEAR queries")
+    parser.add_argument("--no-embeddings", action="store_true", help="only build the lexical index")
+    parser.add_argument("--embedding-batch-size", type=int, default=64)
+    parser.add_argument("--embedding-concurrency", type=int, default=4, help="embedding requests in flight")
+    parser.add_argument("--store-dtype", default="float32", choices=STORE_DTYPES)
+    parser.add_argument("--dense-index", default=settings.dense_index_type, choices=DENSE_INDEX_TYPES, help="index built over the embeddings (default: DENSE_INDEX_TYPE), kept up to date once built")
+    parser.add_argument("--hnsw-m", type=int, default=16, help="HNSW out-degree bound (twice that on the bottom layer)")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=200, help="HNSW candidate neighbours considered per node while building")
+    parser.add_argument("--ivfpq-lists", type=int, default=1024, help="IVF-PQ coarse centroids (inverted lists)")
+    parser.add_argument("--ivfpq-bytes", type=int, default=32, help="IVF-PQ code bytes per vector (subquantizers), must divide the embedding dimension")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing index in --index-dir")
+    parser.add_argument("--incremental", action="store_true", help="only index and embed chunks that changed since the last run")
+    parser.add_argument("--partial-export", action="store_true", help="keep indexed pages missing from this export")
+    parser.add_argument("--no-dedup", action="store_true", help="skip near-duplicate detection")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="estimated Jaccard similarity of near-duplicate chunks")
+    parser.add_argument("--snapshot", action="store_true", help="also write a single-file snapshot for fast app startup (kept up to date once written)")
+    args = parser.parse_args()
+
+    index_dir = Path(args.index_dir)
+    embedding_model = "" if args.no_embeddings else settings.embedding_model_id
+    existing = [part for part in INDEX_PARTS if (index_dir / part).exists()]
+    has_index = (index_dir / DOC_TABLE_FILENAME).exists() or bool(existing)
+    if args.incremental and has_index:
+        if not ChunkManifest.exists(index_dir):
+            parser.error(f"'{index_dir}' has no chunk manifest to update, rebuild it with --overwrite")
+        manifest = ChunkManifest(index_dir)
+        indexed_model = manifest.get_meta("embedding_model")
+        manifest.close()
+        if indexed_model != embedding_model:
+            # one embedding store cannot mix vectors of two models
+            parser.error(f"'{index_dir}' was embedded with '{indexed_model}', not '{embedding_model}': rebuild it with --overwrite")
+    elif has_index:
+        if not args.overwrite:
+            parser.error(f"'{index_dir}' already holds an index, pass --incremental to update it or --overwrite to replace it")
+        for part in existing:
+            shutil.rmtree(index_dir / part)
+        (index_dir / MANIFEST_FILENAME).unlink(missing_ok=True)
+        (index_dir / SNAPSHOT_FILENAME).unlink(missing_ok=True)
+
+    tokenizer = None
+    if args.chunk_by == "tokens":
+        if args.tokenizer:
+            model_id, _, revision = args.tokenizer.partition("@")
+            tokenizer = (model_id, revision or None)
+        else:
+            model_information = get_model_information(settings.llm_model_id)
+            if model_information is None:
+                parser.error(f"Cannot get the tokenizer of '{settings.llm_model_id}', pass --tokenizer or --chunk-by words")
+            tokenizer_params = model_information["tokenizer_params"]
+            tokenizer = (tokenizer_params["model_id"], tokenizer_params.get("revision"))
+        # loaded once here so a missing tokenizer fails before any worker starts
+        try:
+            logger.info(f"Chunking by tokens of '{load_tokenizer(*tokenizer).name}'")
+        except ValueError as e:
+            parser.error(str(e))
+
+    embed = None
+    if not args.no_embeddings:
+        from core.embeddings import embed_texts
+        embed = embed_texts
+
+    writer = IndexWriter(
+        index_dir,
+        segment_size=args.segment_size,
+        positions=args.positions,
+        merge_factor=args.merge_factor,
+        max_segments=args.max_segments,
+        store_dtype=args.store_dtype,
+        embeddings=embed is not None,
+        append=args.incremental and has_index,
+        snapshot=args.snapshot or (index_dir / SNAPSHOT_FILENAME).exists(),
+        dedup=not args.no_dedup,
+        dedup_threshold=args.dedup_threshold,
+        dense_index=args.dense_index,
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_construction=args.hnsw_ef_construction,
+        ivfpq_lists=args.ivfpq_lists,
+        ivfpq_subquantizers=args.ivfpq_bytes,
+    )
+    stats = asyncio.run(ingest(
+        read_export(args.export, base_url=args.base_url),
+        writer,
+        workers=args.workers,
+        pages_per_task=args.pages_per_task,
+        data_source=args.data_source,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        tokenizer=tokenizer,
+        embed=embed,
+        embedding_model=embedding_model,
+        embedding_batch_size=args.embedding_batch_size,
+        embedding_concurrency=args.embedding_concurrency,
+        delete_missing_pages=not args.partial_export,
+    ))
+    logger.info(
+        f"Ingested {stats.num_pages} pages ({stats.num_chunks} chunks) in {stats.duration:.1f}s: "
+        f"{stats.pages_per_second:.1f} docs/s, {stats.chunks_per_second:.1f} chunks/s with {args.workers} workers; "
+        f"{stats.num_added} chunks added, {stats.num_updated} with new metadata, {stats.num_unchanged - stats.num_updated} unchanged, "
+        f"{stats.num_deleted} deleted"
+    )
+
+if __name__ == "__main__":
+    main()
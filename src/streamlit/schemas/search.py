@@ -1,8 +1,57 @@
-from pydantic import BaseModel
-from typing import Optional, Callable, Any, List, Optional
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, Callable, Any, Dict, List, Optional
+from langchain_core.documents import Document
+from core.doc_table import DocTable
 
 class PaginationButton(BaseModel):
     text: str
     onClick: Callable
     args: Optional[List[Any]]
     disabled: bool = False
+
+class SearchLeg(BaseModel):
+    name: str
+    duration: float
+    num_results: int = 0
+    timed_out: bool = False
+    error: Optional[str] = None
+
+    @property
+    def contributed(self) -> bool:
+        return self.num_results > 0
+
+class SearchResponse(BaseModel):
+    """
+    Ranked doc ids and scores of a search, with the doc table of the index generation they came from:
+    `documents` only materializes the rows asked for, e.g. the page being rendered.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    doc_ids: np.ndarray
+    scores: np.ndarray
+    doc_table: DocTable
+    legs: List[SearchLeg] = []
+    facets: Dict[str, Dict[str, int]] = {}
+    cached: bool = False
+    # query of the semantic cache entry the results were served from, and the answer cached with them
+    semantic_match: Optional[str] = None
+    answer: Optional[str] = None
+    cache_entry: Optional[int] = None
+    # data source and index generation the results were retrieved from
+    data_source: Optional[str] = None
+    generation: Optional[str] = None
+
+    @classmethod
+    def empty(cls, legs: List[SearchLeg] = []) -> "SearchResponse":
+        return cls(doc_ids=np.empty(0, dtype=np.int64), scores=np.empty(0, dtype=np.float32), doc_table=DocTable([], []), legs=legs)
+
+    @property
+    def num_results(self) -> int:
+        return len(self.doc_ids)
+
+    def documents(self, start: int = 0, end: Optional[int] = None) -> List[Document]:
+        documents = self.doc_table.get(self.doc_ids[start:end])
+        for document, score in zip(documents, self.scores[start:end].tolist()):
+            document.metadata["score"] = score
+        return documents
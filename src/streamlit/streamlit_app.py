@@ -3,7 +3,8 @@ import time
 import streamlit as st
 import templates
 from urllib import parse
-from core.search import mock_get_source_documents
+from core.answer_cache import replay
+from core.search import cache_answer, cached_answer, get_index_registry, get_result_cache, get_semantic_cache, get_source_documents, store_answer
 from core.feedback import handle_search_feedback, handle_rag_feedback
 from core.conversation_handler import ConversationHandler
 from core.settings import settings
@@ -18,12 +19,16 @@ def set_session_state():
         st.session_state.page = 1
     if '_search' not in st.session_state:
         st.session_state._search = None
+    if '_search_params' not in st.session_state:
+        st.session_state._search_params = None
     if 'search_results' not in st.session_state:
         st.session_state._search = None
     if 'llm_response' not in st.session_state:
         st.session_state.llm_response = None    
     if 'query_time' not in st.session_state:
         st.session_state.query_time = None
+    if 'search_legs' not in st.session_state:
+        st.session_state.search_legs = []
     if 'rag_feedback' not in st.session_state:
         st.session_state.rag_feedback = None
     if 'search_feedbacks' not in st.session_state:
@@ -52,17 +57,27 @@ async def main():
     st.title('AI-Powered Search')
 
     sidebar()
+    if settings.search_mode != "mock":
+        st.sidebar.caption(templates.index_status(get_index_registry().stats(), st.session_state.search_params.get("data_source")))
+        st.sidebar.caption(templates.result_cache_status(get_result_cache().stats()))
+        if get_semantic_cache() is not None:
+            st.sidebar.caption(templates.semantic_cache_status(get_semantic_cache().stats()))
 
     search = st.text_input('Enter search words:', key="search", on_change=search_input_on_change)
     if search:
-        if st.session_state._search != search:
+        if st.session_state._search != search or st.session_state._search_params != st.session_state.search_params:
             with st.spinner("Searching for docs..."):
                 start_time = time.time()
-                results = await mock_get_source_documents(search)
+                response = await get_source_documents(search, st.session_state.search_params)
+                # only the rows of the displayed page are materialized as Documents
+                results = response
+                search_legs = response.legs
                 query_time = time.time() - start_time
                 st.session_state._search = search
+                st.session_state._search_params = st.session_state.search_params
                 st.session_state.search_results = results           
                 st.session_state.query_time = query_time
+                st.session_state.search_legs = search_legs
 
                 # For the case of new generation, set as placeholder for later streaming
                 llm_response_div = st.empty()
@@ -70,6 +85,7 @@ async def main():
             results = st.session_state.search_results
             llm_response = st.session_state.llm_response
             query_time = st.session_state.query_time
+            search_legs = st.session_state.search_legs
 
             # For case of existing results, just write the existing response from session_state
             # We follow the case of Bing search, where the LLM response will not show on the screen
@@ -91,10 +107,10 @@ async def main():
                 llm_response_div = None
 
         from_i = (st.session_state.page - 1) * settings.page_size
-        paginated_results = results[from_i:from_i + settings.page_size]
+        paginated_results = results.documents(from_i, from_i + settings.page_size)
 
         # show number of results and time taken
-        st.write(templates.number_of_results(len(results), query_time),
+        st.write(templates.number_of_results(results.num_results, query_time, search_legs, results.facets.get("year", {}), results.cached, results.semantic_match),
                  unsafe_allow_html=True)
         
         # search results
@@ -112,8 +128,8 @@ async def main():
                 disable_with_score=st.session_state.search_feedbacks[f"search_feedback_{from_i + i}"]["score"] if st.session_state.search_feedbacks and f"search_feedback_{from_i + i}" in st.session_state.search_feedbacks else None,
             )
         # pagination
-        if len(results) > settings.page_size:
-            total_pages = (len(results) + settings.page_size - 1) // settings.page_size
+        if results.num_results > settings.page_size:
+            total_pages = (results.num_results + settings.page_size - 1) // settings.page_size
             templates.pagination(total_pages, search, st.session_state.page)
 
         if llm_response_div is not None:
@@ -127,14 +143,23 @@ async def main():
                     temperature = 0,
                     max_tokens = 1024,
                 )
-                rag_chain = handler.get_rag_chain()
-                async for chunk in rag_chain.astream({
-                    "context": handler.format_docs(results),
-                    "question": search,
-                }):
-                    full_response += chunk + " "
-                    # Add a blinking cursor to simulate typing
-                    message_placeholder.markdown(full_response + "▌")
+                # served with the results of a paraphrase of this query, or generated before from the same results
+                answer = results.answer if results.answer is not None else cached_answer(handler, search, results)
+                if answer is not None:
+                    async for partial_response in replay(answer, settings.answer_replay_delay):
+                        message_placeholder.markdown(partial_response + "▌")
+                    full_response = answer
+                else:
+                    rag_chain = handler.get_rag_chain()
+                    async for chunk in rag_chain.astream({
+                        "context": handler.format_docs(results.documents()),
+                        "question": search,
+                    }):
+                        full_response += chunk + " "
+                        # Add a blinking cursor to simulate typing
+                        message_placeholder.markdown(full_response + "▌")
+                    cache_answer(results, full_response)
+                    store_answer(handler, search, results, full_response)
 
                 message_placeholder.markdown(full_response)
                 st.session_state.llm_response = full_response
@@ -1,6 +1,8 @@
+import html
 import urllib
 import streamlit as st
-from schemas.search import PaginationButton
+from typing import Any, Dict, List, Optional
+from schemas.search import PaginationButton, SearchLeg
 
 def load_css() -> str:
     """ Return all css styles. """
@@ -52,14 +54,53 @@ def load_css() -> str:
         </style>
     """
 
-def number_of_results(total_hits: int, duration: float) -> str:
-    """ HTML scripts to display number of results and duration. """
+def number_of_results(total_hits: int, duration: float, search_legs: List[SearchLeg] = [], years: Dict[str, int] = {}, cached: bool = False, semantic_match: Optional[str] = None) -> str:
+    """ HTML scripts to display number of results, duration, the time spent in each search leg and the results per year. """
+    leg_timings = []
+    for leg in search_legs:
+        status = "timed out" if leg.timed_out else "failed" if leg.error else f"{leg.num_results} hits"
+        leg_timings.append(f"{leg.name} {leg.duration:.2f}s, {status}")
+    breakdown = f" &middot; {' | '.join(leg_timings)}" if len(search_legs) > 1 or any(not leg.contributed for leg in search_legs) else ""
+    if semantic_match is not None:
+        breakdown += f" &middot; results of the similar search \"{html.escape(semantic_match)}\""
+    facets = f"<br>{' · '.join(f'{year}: {count}' for year, count in sorted(years.items(), reverse=True))}" if len(years) > 1 else ""
     return f"""
         <div style="color:grey;font-size:95%;">
-            {total_hits} results ({duration:.2f} seconds)
+            {total_hits} results ({duration:.2f} seconds{", cached" if cached else ""}){breakdown}{facets}
         </div><br>
     """
 
+def index_status(stats: Dict[str, Any], data_source: str) -> str:
+    """ Caption with the selected source's index generation and load time, and how many indexes are open. """
+    index = next((index for index in stats["open_indexes"] if data_source in index["sources"]), None)
+    if index is None:
+        status = "Index not loaded yet"
+    else:
+        status = f"Index generation {index['generation']}, loaded in {index['last_reload_duration']:.2f}s"
+        if index["retired_in_flight"]:
+            status += f" ({index['retired_in_flight']} previous still serving searches)"
+    open_sources = sum(len(index["sources"]) for index in stats["open_indexes"])
+    status += f" · {open_sources} of {stats['num_sources']} sources open ({stats['size'] / 2**20:.0f} of {stats['max_size'] / 2**20:.0f} MiB)"
+    if stats["hit_rate"] is not None:
+        status += f", {stats['hit_rate']:.0%} hits"
+    return status
+
+def result_cache_status(stats: Dict[str, Any]) -> str:
+    """ Caption with how many searches are cached for all sessions and how often they are served. """
+    status = f"{stats['entries']} of {stats['max_entries']} searches cached"
+    if stats["hit_rate"] is not None:
+        status += f", {stats['hit_rate']:.0%} hits"
+    return status
+
+def semantic_cache_status(stats: Dict[str, Any]) -> str:
+    """ Caption with how often paraphrased searches are served from cache and how often that was wrong. """
+    status = f"{stats['entries']} of {stats['max_entries']} searches cached for paraphrases"
+    if stats["hit_rate"] is not None:
+        status += f", {stats['hit_rate']:.0%} hits"
+    if stats["false_hit_rate"] is not None:
+        status += f" ({stats['false_hit_rate']:.0%} of {stats['verifications']} checked differed)"
+    return status
+
 def search_result(i: int, url: str, title: str, highlights: str) -> str:
     """ HTML scripts to display search results. """
     return f"""
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app imports its modules from src/streamlit (`core`, `schemas`), so do the tests
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
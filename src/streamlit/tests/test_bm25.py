@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+
+from benchmarks.lexical_pruning import natural_language_queries, zipf_corpus
+from core.bm25 import BM25Index
+from core.positions import parse_query
+
+TEXTS = [
+    "the policy covers remote work",
+    "remote access policy for contractors",
+    "travel expenses are reimbursed monthly",
+]
+
+@pytest.fixture
+def index() -> BM25Index:
+    return BM25Index.build(TEXTS, positions=True)
+
+@pytest.mark.parametrize("query", ['"--" policy', '"?"', '"" policy'])
+def test_wordless_phrases_do_not_constrain(index, query):
+    assert index.constrained_doc_ids(parse_query(query)) is None
+    doc_ids, _ = index.top_k(query, 10)
+    assert sorted(doc_ids.tolist()) == ([0, 1] if "policy" in query else [])
+
+def test_wordless_phrase_next_to_a_phrase(index):
+    assert index.top_k('"--" "remote access"', 10)[0].tolist() == [1]
+
+def test_phrase_constrains_matches(index):
+    assert index.top_k('"remote access" policy', 10)[0].tolist() == [1]
+    assert index.top_k('"access remote"', 10)[0].tolist() == []
+
+def test_near_constrains_matches(index):
+    assert sorted(index.top_k("policy NEAR/2 remote", 10)[0].tolist()) == [0, 1]
+    assert index.top_k("travel NEAR/1 monthly", 10)[0].tolist() == []
+
+def test_pruned_and_filtered_top_k_match_exhaustive_scoring():
+    index = BM25Index.build(" ".join(f"w{token}" for token in row) for row in zipf_corpus(3000, 2000, 60))
+    allowed_ids = np.arange(0, 3000, 7, dtype=np.int64)
+    for num_common in (0, 2, 8):
+        for query in natural_language_queries(10, 2000, num_common=num_common):
+            doc_ids, scores = index.top_k_exhaustive(query, 10)
+            for adaptive in (False, True):
+                pruned_ids, pruned_scores = index.top_k_block_max(query, 10, adaptive=adaptive)
+                assert pruned_ids.tolist() == doc_ids.tolist() and np.array_equal(pruned_scores, scores)
+
+            filtered_scores = index.score(query)[allowed_ids]
+            matches = np.flatnonzero(filtered_scores > 0)
+            best = matches[np.lexsort((matches, -filtered_scores[matches]))][:10]
+            filtered_ids, _ = index.top_k(query, 10, allowed_ids=allowed_ids)
+            assert filtered_ids.tolist() == allowed_ids[best].tolist()
@@ -0,0 +1,33 @@
+import numpy as np
+
+from core.doc_store import BlockStore, BlockStoreWriter
+
+def write(path, values, num_docs=None):
+    writer = BlockStoreWriter(path, codec="zlib", docs_per_block=4, num_docs=num_docs)
+    for value in values:
+        writer.add(value)
+    writer.close()
+    return BlockStore.open(path)
+
+def test_append_only_compresses_new_blocks(tmp_path):
+    first = [f"doc {i}" for i in range(6)]
+    write(tmp_path, first)
+    data = (tmp_path / "data.bin").read_bytes()
+
+    store = write(tmp_path, ["doc 6", "doc 7"], num_docs=6)
+    assert [store[doc_id] for doc_id in range(len(store))] == first + ["doc 6", "doc 7"]
+    # the existing blocks are kept byte for byte, the partial one included
+    assert (tmp_path / "data.bin").read_bytes().startswith(data)
+    assert store.block_starts.tolist() == [0, 4, 6]
+
+def test_append_after_fewer_docs_drops_the_rest(tmp_path):
+    write(tmp_path, [f"doc {i}" for i in range(10)])
+    store = write(tmp_path, ["new"], num_docs=5)
+    assert [store[doc_id] for doc_id in range(len(store))] == [f"doc {i}" for i in range(5)] + ["new"]
+
+def test_store_without_block_starts(tmp_path):
+    write(tmp_path, [f"doc {i}" for i in range(6)])
+    (tmp_path / "block_starts.npy").unlink()
+    store = write(tmp_path, ["doc 6"], num_docs=6)
+    assert [store[doc_id] for doc_id in range(len(store))] == [f"doc {i}" for i in range(7)]
+    assert np.asarray(store.block_starts).tolist() == [0, 4, 6]
@@ -0,0 +1,51 @@
+import numpy as np
+
+from benchmarks.hnsw_recall import clustered_embeddings
+from core.dense import DenseIndex
+from core.hnsw import HNSWIndex
+
+def select_one(embeddings, candidates, sims, m):
+    """The selection heuristic for one node, walking its candidates one at a time."""
+    selected, pruned = [], []
+    for sim, candidate in zip(sims, candidates):
+        if len(selected) >= m or candidate < 0:
+            break
+        if not selected or (embeddings[selected] @ embeddings[candidate]).max() < sim:
+            selected.append(candidate)
+        else:
+            pruned.append(candidate)
+    return selected + pruned[:m - len(selected)]
+
+def test_batched_neighbour_selection_matches_one_node_at_a_time():
+    index = HNSWIndex.build(clustered_embeddings(2000, 16, num_clusters=10), M=8, ef_construction=40)
+    nodes = np.arange(0, 2000, 10)
+    candidates, sims = index._candidate_neighbors(nodes, np.arange(2000), 40, np.random.default_rng(0))
+    # some rows with fewer candidates than others
+    candidates[::7, 30:], sims[::7, 30:] = -1, -np.inf
+    selected = index._select_neighbors(candidates, sims, 8)
+    for row in range(len(nodes)):
+        expected = select_one(index.embeddings, candidates[row], sims[row], 8)
+        assert selected[row].tolist() == expected + [-1] * (8 - len(expected))
+
+def test_build_connects_every_layer_and_reaches_exact_recall(tmp_path):
+    # enough nodes for layer 0 to be searched cell by cell, in tight clusters
+    embeddings = clustered_embeddings(6000, 32)
+    index = HNSWIndex.build(embeddings, M=16, ef_construction=100)
+    for indptr, neighbors in zip(index.layer_indptrs, index.layer_neighbors):
+        members = np.flatnonzero(np.diff(indptr) > 0)
+        reached = np.zeros(index.num_docs, dtype=bool)
+        frontier = np.array([index.entry_point])
+        reached[frontier] = True
+        while len(frontier):
+            frontier = np.unique(np.concatenate([neighbors[indptr[node]:indptr[node + 1]] for node in frontier]))
+            frontier = frontier[~reached[frontier]]
+            reached[frontier] = True
+        assert reached[members].all()
+        assert (np.diff(indptr) <= 2 * index.M).all()
+
+    query_vectors = clustered_embeddings(50, 32, seed=1)
+    assert index.recall(DenseIndex.build(embeddings), query_vectors, 10, ef_search=256) >= 0.95
+
+    index.save(tmp_path / "hnsw")
+    loaded = HNSWIndex.load(tmp_path / "hnsw", index.embeddings)
+    assert loaded.top_k(query_vectors[0], 10)[0].tolist() == index.top_k(query_vectors[0], 10)[0].tolist()
@@ -0,0 +1,25 @@
+from core.index_handle import IndexHandle
+
+def test_reload_opens_the_shared_snapshot_once_per_generation():
+    opened = []
+    versions = {"lexical": 1, "dense": 1}
+
+    def open_shared():
+        opened.append(len(opened))
+        return f"snapshot {len(opened)}"
+
+    components = {
+        name: (lambda name=name: versions[name], lambda snapshot, name=name: (name, snapshot))
+        for name in versions
+    }
+    handle = IndexHandle(components, open_shared=open_shared)
+    assert handle.reload()
+    assert handle.current["lexical"] == ("lexical", "snapshot 1") and handle.current["dense"] == ("dense", "snapshot 1")
+    # nothing changed, nothing is opened
+    assert not handle.reload()
+    assert len(opened) == 1
+
+    versions["dense"] = 2
+    assert handle.reload()
+    assert handle.current["lexical"] == ("lexical", "snapshot 1") and handle.current["dense"] == ("dense", "snapshot 2")
+    assert len(opened) == 2
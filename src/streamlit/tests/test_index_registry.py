@@ -0,0 +1,24 @@
+import sys
+import numpy as np
+
+from core.filters import FilterIndex
+from core.index_registry import resident_size
+
+def test_resident_size_counts_heap_arrays_but_not_mapped_files(tmp_path):
+    dates = np.arange(100_000, dtype=np.int32)
+    np.save(tmp_path / "dates.npy", dates)
+    mapped = np.load(tmp_path / "dates.npy", mmap_mode="r")
+
+    assert resident_size(mapped[10:]) < 1000
+    assert resident_size(dates[10:]) >= dates.nbytes
+    # a view and its base are counted once
+    assert resident_size([dates, dates[::2]]) < 1.01 * dates.nbytes + 1000
+
+    filters = FilterIndex(dates, ["Confluence"], np.packbits(np.ones(len(dates), dtype=bool))[None])
+    # dates, the date order and sorted dates on the heap, found through the object's attributes
+    assert 4 * dates.nbytes <= resident_size(filters) < 4.2 * dates.nbytes
+
+def test_resident_size_extrapolates_large_containers():
+    vocab = {f"term{i}": i for i in range(100_000)}
+    exact = sys.getsizeof(vocab) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in vocab.items())
+    assert 0.95 * exact < resident_size(vocab) < 1.05 * exact
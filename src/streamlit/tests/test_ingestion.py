@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from core.dedup import load_cluster_ids
+from core.doc_table import DOC_TABLE_FILENAME, DocTable
+from core.embedding_store import EmbeddingStore
+from core.filters import FilterIndex
+from core.hnsw import HNSWIndex
+from core.index_handle import read_published_generation
+from core.ingestion import IndexWriter, RawPage, ingest
+from core.ivfpq import IVFPQIndex
+from core.segments import SegmentedIndex
+
+def chunks(*texts):
+    return [(text, {"title": text, "date": "2024-01-15", "data_source": "Confluence"}) for text in texts]
+
+def add(writer, texts):
+    writer.add(chunks(*texts))
+    writer.add_embeddings(np.random.default_rng(len(texts)).normal(size=(len(texts), 8)))
+
+def write(index_dir, texts, append=False):
+    writer = IndexWriter(index_dir, segment_size=1, append=append)
+    add(writer, texts)
+    writer.close()
+
+def test_rerun_after_interrupted_ingestion_drops_its_writes(tmp_path, monkeypatch):
+    write(tmp_path, ["remote work policy", "travel expenses"])
+
+    writer = IndexWriter(tmp_path, segment_size=1, append=True)
+    add(writer, ["remote access", "remote desk"])
+    # dies after every index file was written, before the manifest commit
+    monkeypatch.setattr(writer.manifest, "commit", lambda: (_ for _ in ()).throw(KeyboardInterrupt))
+    with pytest.raises(KeyboardInterrupt):
+        writer.close()
+    writer.manifest.close()
+    monkeypatch.undo()
+    assert read_published_generation(tmp_path) == 1
+
+    write(tmp_path, ["remote access"], append=True)
+
+    with open(tmp_path / DOC_TABLE_FILENAME) as f:
+        assert [json.loads(line)["page_content"] for line in f] == ["remote work policy", "travel expenses", "remote access"]
+    doc_table = DocTable.load(tmp_path)
+    documents = doc_table.get(range(len(doc_table)))
+    assert [document.page_content for document in documents] == ["remote work policy", "travel expenses", "remote access"]
+    assert [document.metadata["title"] for document in documents] == ["remote work policy", "travel expenses", "remote access"]
+    lexical = SegmentedIndex(tmp_path / "lexical").pin()
+    assert lexical.num_docs == 3
+    assert sorted(lexical.top_k("remote", 10)[0].tolist()) == [0, 2]
+    assert FilterIndex.load(tmp_path / "filters").num_docs == 3
+    assert len(load_cluster_ids(tmp_path / "dedup")) == 3
+    assert EmbeddingStore.open(tmp_path / "dense").num_docs == 3
+
+def ingest_pages(index_dir, pages, append, embedded):
+    async def embed(texts):
+        embedded.extend(texts)
+        return np.ones((len(texts), 8))
+
+    writer = IndexWriter(index_dir, segment_size=1, append=append, dedup=False)
+    return asyncio.run(ingest(pages, writer, workers=1, chunk_size=4, chunk_overlap=0, embed=embed, embedding_model="model"))
+
+def test_metadata_change_updates_rows_without_reembedding(tmp_path):
+    body = "<p>remote work policy for all staff members</p>"
+    embedded = []
+    stats = ingest_pages(tmp_path, [RawPage("1", "/1", "Policy", "2024-01-15", body)], append=False, embedded=embedded)
+    assert stats.num_added == 2 and len(embedded) == 2
+
+    embedded.clear()
+    stats = ingest_pages(tmp_path, [RawPage("1", "/1", "Remote policy", "2024-06-01", body)], append=True, embedded=embedded)
+    assert (stats.num_added, stats.num_updated, stats.num_deleted) == (0, 2, 0)
+    assert embedded == []
+
+    doc_table = DocTable.load(tmp_path)
+    assert len(doc_table) == 2
+    assert {document.metadata["title"] for document in doc_table.get([0, 1])} == {"Remote policy"}
+    assert {document.metadata["date"] for document in doc_table.get([0, 1])} == {"2024-06-01"}
+    assert FilterIndex.load(tmp_path / "filters").date_range_ids("2024-06-01", "2024-06-01").tolist() == [0, 1]
+    # the segment still holding them is scored for the new date
+    assert sorted(SegmentedIndex(tmp_path / "lexical").pin().top_k("remote", 10, date_range=["2024-06-01", "2024-06-01"])[0].tolist()) == [0]
+
+def test_merges_purge_tombstoned_chunks(tmp_path):
+    embedded = []
+    pages = [RawPage(str(i), f"/{i}", f"Page {i}", "2024-01-15", f"<p>remote page number {i}</p>") for i in range(3)]
+    ingest_pages(tmp_path, pages, append=False, embedded=embedded)
+    # the page 0 is gone and page 1 changed
+    pages = [RawPage("1", "/1", "Page 1", "2024-01-15", "<p>remote page edited</p>"), pages[2]]
+    ingest_pages(tmp_path, pages, append=True, embedded=embedded)
+
+    lexical = SegmentedIndex(tmp_path / "lexical").pin()
+    assert len(lexical.segments) == 1
+    assert lexical.num_docs == 2
+    assert sorted(lexical.top_k("remote", 10)[0].tolist()) == [2, 3]
+
+def test_hnsw_graph_is_rebuilt_over_appended_embeddings(tmp_path):
+    writer = IndexWriter(tmp_path, segment_size=1, dense_index="hnsw", hnsw_m=4, hnsw_ef_construction=16)
+    add(writer, ["remote work policy", "travel expenses"])
+    writer.close()
+    store = EmbeddingStore.open(tmp_path / "dense")
+    assert HNSWIndex.load(tmp_path / "dense" / "hnsw", store).M == 4
+
+    # later runs keep the graph they find up to date, whatever their own dense index
+    write(tmp_path, ["remote access"], append=True)
+    store = EmbeddingStore.open(tmp_path / "dense")
+    graph = HNSWIndex.load(tmp_path / "dense" / "hnsw", store)
+    assert graph.top_k(store[2], 1)[0].tolist() == [2]
+    with pytest.raises(ValueError):
+        HNSWIndex.load(tmp_path / "dense" / "hnsw", store[:2])
+
+def test_ivfpq_lists_are_trained_once_and_extended_by_incremental_runs(tmp_path):
+    def write_ivfpq(texts, append):
+        writer = IndexWriter(tmp_path, append=append, dedup=False, dense_index="ivfpq", ivfpq_lists=4, ivfpq_subquantizers=4)
+        add(writer, texts)
+        writer.close()
+
+    # too few embeddings to train the codebooks, the flat store is searched meanwhile
+    write_ivfpq([f"policy {i}" for i in range(10)], append=False)
+    assert not IVFPQIndex.exists(tmp_path / "dense" / "ivfpq")
+
+    write_ivfpq([f"circular {i}" for i in range(300)], append=True)
+    trained = IVFPQIndex.load(tmp_path / "dense" / "ivfpq")
+    assert sorted(trained.list_ids.tolist()) == list(range(310))
+
+    write_ivfpq([f"memo {i}" for i in range(5)], append=True)
+    extended = IVFPQIndex.load(tmp_path / "dense" / "ivfpq")
+    assert np.array_equal(extended.coarse_centroids, trained.coarse_centroids)
+    assert sorted(extended.list_ids.tolist()) == list(range(315))
+    store = EmbeddingStore.open(tmp_path / "dense")
+    # the appended rows are in the lists of their nearest trained centroid
+    list_id = np.searchsorted(extended.list_indptr, np.flatnonzero(extended.list_ids == 312)[0], side="right") - 1
+    assert list_id == extended.encode(store[312:313])[0][0]
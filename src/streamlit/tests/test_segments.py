@@ -0,0 +1,76 @@
+import pytest
+import numpy as np
+
+from core.segments import SegmentedIndex, TieredMergePolicy
+
+def add_segment(index: SegmentedIndex, texts, start: int):
+    doc_ids = np.arange(start, start + len(texts), dtype=np.int64)
+    return index.add(texts, [{"date": "2024-01-15"}] * len(texts), doc_ids)
+
+def test_merge_skips_segments_no_longer_live(tmp_path):
+    index = SegmentedIndex.create(tmp_path / "lexical", TieredMergePolicy(merge_factor=2))
+    first = add_segment(index, ["remote work policy"], 0)[0].name
+    second = add_segment(index, ["travel expenses"], 1)[0].name
+    third = add_segment(index, ["remote access"], 2)[0].name
+
+    merged = index.merge([first, second])
+    assert merged is not None and merged.num_docs == 2
+    # a second writer planned a merge on the segments it saw before the first one committed
+    assert index.merge([first, second]) is None
+    assert index.merge([first, third]) is None
+    assert {info.name for info in index.segments} == {merged.name, third}
+    assert sorted(index.top_k("remote", 10)[0].tolist()) == [0, 2]
+
+def test_pin_keeps_a_generation_after_later_commits(tmp_path):
+    index = SegmentedIndex.create(tmp_path / "lexical", TieredMergePolicy(merge_factor=2))
+    add_segment(index, ["remote work policy"], 0)
+    published = index.generation
+    add_segment(index, ["remote access"], 1)
+    index.maybe_merge()
+
+    reader = SegmentedIndex(tmp_path / "lexical").pin(published)
+    assert reader.num_docs == 1
+    assert reader.top_k("remote", 10)[0].tolist() == [0]
+    assert sorted(SegmentedIndex(tmp_path / "lexical").pin().top_k("remote", 10)[0].tolist()) == [0, 1]
+
+def test_collect_garbage_keeps_the_given_generations(tmp_path):
+    index = SegmentedIndex.create(tmp_path / "lexical", TieredMergePolicy(merge_factor=2))
+    add_segment(index, ["remote work policy"], 0)
+    published = index.generation
+    add_segment(index, ["remote access"], 1)
+    index.maybe_merge()
+
+    assert index.collect_garbage(keep_generations=[published]) > 0
+    assert SegmentedIndex(tmp_path / "lexical").pin(published).top_k("remote", 10)[0].tolist() == [0]
+    index.collect_garbage()
+    assert sorted(path.name for path in (tmp_path / "lexical").glob("segment_*")) == [info.name for info in index.segments]
+    with pytest.raises(ValueError):
+        SegmentedIndex(tmp_path / "lexical").pin(published)
+
+def test_pin_opens_only_the_segments_queries_score(tmp_path):
+    index = SegmentedIndex.create(tmp_path / "lexical")
+    index.add(["remote work policy", "remote access"], [{"date": "2024-01-15"}, {"date": "2024-03-15"}])
+
+    reader = SegmentedIndex(tmp_path / "lexical").pin()
+    assert reader._open_segments == {}
+    assert reader.top_k("remote", 10, date_range=["2024-03-01", "2024-03-31"])[0].tolist() == [1]
+    assert [segment.info.partition for segment in reader._open_segments.values()] == ["2024-03"]
+
+def test_saved_block_impacts_bound_every_block_under_collection_stats(tmp_path):
+    rng = np.random.default_rng(0)
+    words = np.array(["remote", "work", "policy", "travel", "expenses", "access"])
+    texts = [" ".join(rng.choice(words, rng.integers(1, 30))) for _ in range(1500)]
+    index = SegmentedIndex.create(tmp_path / "lexical")
+    for start in range(0, len(texts), 500):
+        add_segment(index, texts[start:start + 500], start)
+
+    reader = SegmentedIndex(tmp_path / "lexical").pin()
+    for info in reader.segments:
+        segment = reader._open(info)
+        assert segment.block_impacts is not None
+        block_indptr, block_last_docs, exact_max_scores = segment.index._compute_blocks()
+        assert np.array_equal(block_indptr, segment.index.block_indptr)
+        assert np.array_equal(block_last_docs, segment.index.block_last_docs)
+        assert (segment.index.block_max_scores >= exact_max_scores).all()
+        for query in ("remote", "travel expenses", "remote work policy access"):
+            assert segment.index.top_k(query, 10)[0].tolist() == segment.index.top_k_exhaustive(query, 10)[0].tolist()
@@ -0,0 +1,38 @@
+import numpy as np
+
+from core.dedup import live_top_k
+from core.filters import FilterIndex
+from core.segments import SegmentedIndex
+from core.sharding import ShardPool
+
+def test_shards_filter_and_collapse_like_a_single_index(tmp_path):
+    texts = [f"remote work policy {i}" if i % 3 else f"remote access {i}" for i in range(40)]
+    metadatas = [{"date": f"2024-{i % 4 + 1:02d}-15", "data_source": ("Confluence", "Jira")[i % 2]} for i in range(40)]
+    index = SegmentedIndex.create(tmp_path)
+    for doc_ids in np.array_split(np.arange(40), 4):
+        index.add([texts[i] for i in doc_ids.tolist()], [metadatas[i] for i in doc_ids.tolist()], doc_ids)
+    index = SegmentedIndex(tmp_path).pin()
+    filters = FilterIndex.build(metadatas)
+    tombstones = np.array([1, 4, 9], dtype=np.int64)
+    # docs 0-11 are near-duplicates of each other, spread over the shards
+    cluster_ids = np.where(np.arange(40) < 12, 0, np.arange(40))
+
+    pool = ShardPool(2)
+    try:
+        sharded = pool.open(tmp_path, filters=filters, tombstones=tombstones, cluster_ids=cluster_ids)
+        for data_source, date_range in [(None, None), ("Jira", None), ("Confluence", ("2024-02-01", "2024-03-31"))]:
+            allowed_ids = filters.allowed_ids(data_source=data_source, date_range=date_range)
+            top_k = lambda k, allowed_ids: index.top_k("remote policy", k, allowed_ids=allowed_ids, date_range=date_range)
+            doc_ids, scores = live_top_k(top_k, 5, allowed_ids, tombstones, cluster_ids)
+            sharded_ids, sharded_scores = sharded.top_k("remote policy", 5, data_source=data_source, date_range=date_range)
+            assert sharded_ids.tolist() == doc_ids.tolist()
+            assert np.allclose(sharded_scores, scores)
+
+        # a reload opens the next generation in the same worker processes
+        processes = [set(executor._processes) for executor in pool.executors]
+        sharded.close()
+        reopened = pool.open(tmp_path, filters=filters)
+        assert len(reopened.top_k("remote policy", 40)[0]) == 40
+        assert [set(executor._processes) for executor in pool.executors] == processes
+    finally:
+        pool.close()